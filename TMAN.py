@@ -1,24 +1,162 @@
-import sys
+import argparse
 import os
+import sys
+import time
+
+from ranking import RANKINGS
+from utils import Utils
+
+PLOTTING_MODULES = ("matplotlib", "networkx")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="T-Man topology construction")
+    parser.add_argument("N", type=int, help="number of nodes")
+    parser.add_argument("k", type=int, help="number of neighbors")
+    parser.add_argument("topology", help="R for ring, D for dynamic ring")
+    parser.add_argument("radii", type=int, nargs="*", help="radii of the dynamic ring")
+    parser.add_argument("--sockets", action="store_true",
+                        help="run the ring with every peer behind a TCP server on localhost")
+    parser.add_argument("--processes", type=int, default=2, help="worker processes of the socket mode")
+    parser.add_argument("--base-port", type=int, default=20000, help="peer i listens on base port + i")
+    parser.add_argument("--snapshot-workers", type=int, default=0,
+                        help="background processes that render and write the snapshots")
+    parser.add_argument("--trajectory", help="record every epoch into this binary trajectory file instead of the "
+                                             "snapshot text files")
+    parser.add_argument("--raster", action="store_true", help="render the snapshot graphs as PNG from a NumPy canvas")
+    parser.add_argument("--early-stop", action="store_true",
+                        help="stop once every color graph is connected and pure for 3 epochs")
+    parser.add_argument("--ranking", choices=sorted(RANKINGS), default="lab",
+                        help="ranking function the nodes rank each other by")
+    parser.add_argument("--churn-rate", type=float, default=0.0,
+                        help="expected fraction of the live nodes that leave in every epoch")
+    parser.add_argument("--crash-ratio", type=float, default=0.5,
+                        help="fraction of the leaving nodes that crash instead of departing gracefully")
+    parser.add_argument("--no-plot", action="store_true",
+                        help="write only the text files, the plotting libraries are then never imported")
+    parser.add_argument("--output-dir", default=Utils.get_homework_directory(),
+                        help="directory of the plots and text files, created when missing")
+    parser.add_argument("--snapshot-every", type=int, default=5, metavar="EPOCHS",
+                        help="epochs between two snapshots, also written at epoch 1 and when a run stops early")
+    parser.add_argument("--seed", type=int, help="seed of the run, the same seed reproduces the same topology")
+    parser.add_argument("--engine", choices=["python", "batched", "sharded"], default="python",
+                        help="run exchanges one at a time, whole cycles in NumPy or cycles in worker processes")
+    parser.add_argument("--workers", type=int, help="worker processes of the sharded engine, one per core by default")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="print the time spent on imports and start-up, and the plotting import time avoided")
+    parser.add_argument("--active-set", action="store_true",
+                        help="let only the nodes whose views still change initiate in every cycle")
+    parser.add_argument("--peer-sampling", type=int, metavar="V",
+                        help="keep a view of V random peers per node and mix a few of them into every merge")
+    parser.add_argument("--mixed", type=int, default=2, metavar="M", help="random peers mixed into every merge")
+    parser.add_argument("--checkpoint", metavar="FILE", help="save the state of the run to FILE every few epochs")
+    parser.add_argument("--checkpoint-every", type=int, default=10, metavar="M", help="epochs between two checkpoints")
+    parser.add_argument("--resume", metavar="FILE",
+                        help="continue the run saved in FILE, its N, k and radii replace the ones given")
+    parser.add_argument("--instrument", metavar="FILE",
+                        help="write per-epoch timers and counters to FILE, Prometheus text if it ends in .prom, "
+                             "JSON lines otherwise")
+    parser.add_argument("--profile", metavar="FILE", help="run under cProfile and dump the statistics to FILE")
+    args = parser.parse_args()
+    if args.sockets and args.topology != "R":
+        parser.error("--sockets only runs the ring topology R")
+    if args.topology == "D" and args.ranking == "torus":
+        parser.error("--ranking torus wraps at a fixed period and cannot rank a dynamic ring, which keeps growing")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # imports are timed from here, instrumentation imports the topology modules
+    started = time.perf_counter()
+    instrumentation = None
+    if args.instrument:
+        from instrumentation import Instrumentation, sink_for
+        instrumentation = Instrumentation(sink_for(args.instrument)).install()
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run(args, started)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            import pstats
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+        if instrumentation is not None:
+            instrumentation.uninstall()
+
+
+def run(args, started):
+    from checkpoint import Checkpointer, resume
+    from churn import Churn
+    from dynamic_ring import DynamicRing
+    from metrics import ConvergenceMonitor
+    from peer_sampling import PeerSampling
+    from ring import Ring
+    from scheduler import ActiveSet
+    from simulation import Callback
+    timings = {"imports": time.perf_counter() - started}
 
-from dynamic_ring import DynamicRing
-from ring import Ring
+    N = args.N
+    k = args.k
+    topology = args.topology
+    monitor = ConvergenceMonitor() if args.early_stop else None
+    churn = Churn(args.churn_rate, args.crash_ratio, seed=args.seed) if args.churn_rate else None
+    scheduler = ActiveSet() if args.active_set else None
+    sampling = PeerSampling(args.peer_sampling, args.mixed, args.seed) if args.peer_sampling else None
+    subscribers = [Callback(lambda topology, epoch: timings.setdefault("start-up", time.perf_counter() - started))]
+    if args.checkpoint:
+        subscribers.append(Checkpointer(args.checkpoint, args.checkpoint_every))
+    options = dict(snapshot_workers=args.snapshot_workers, trajectory=args.trajectory, raster=args.raster,
+                   monitor=monitor, churn=churn, ranking=args.ranking, subscribers=subscribers, seed=args.seed,
+                   engine=args.engine, workers=args.workers, output_dir=args.output_dir, plot=not args.no_plot,
+                   snapshot_every=args.snapshot_every, scheduler=scheduler, sampling=sampling)
+    if args.resume:
+        resume(args.resume, **options)
+    elif topology == 'R' and args.sockets:
+        from socket_mode import print_report, run_socket_ring, write_report_topology
+        report = run_socket_ring(N, k, 40, processes=args.processes, base_port=args.base_port, seed=args.seed)
+        print_report(report)
+        write_report_topology(report, N, k, args.output_dir)
+    elif topology == 'R':
+        ring = Ring(N, k, 40, **options)
+    elif topology == 'D':
+        radii = args.radii
+        dynamic_ring = DynamicRing(N, k, len(radii), radii, **options)
+    else:
+        print("Unknown Topology")
+        return
+    if churn is not None and not args.sockets:
+        print("churn: {departures} departures, {crashes} crashes, {detected} dead entries detected, "
+              "{repaired} lists repaired, {touched} of them on departures".format(**churn.stats))
+    if scheduler is not None and not args.sockets:
+        print(scheduler.report())
+    if sampling is not None and not args.sockets:
+        print(sampling.report())
+    if args.startup_report:
+        timings["total"] = time.perf_counter() - started
+        print_startup_report(timings)
 
-args = sys.argv
-N = int(args[1])
-k = int(args[2])
-topology = args[3]
 
-home = os.path.expanduser("~")
-homework_directory = 'Patil_EEL6761_HW1'
+def print_startup_report(timings):
+    """
+    Print where the start-up time went. When no plotting library was loaded the plotting stack is imported once
+    more here, after the run, to measure the time the lazy import saved.
+    :param timings: seconds spent on the imports of the run, until the initial topology was built and in total
+    :return: None
+    """
+    print("startup: imports {:.1f} ms, initial topology after {:.1f} ms, run {:.1f} ms".format(
+        1000 * timings["imports"], 1000 * timings.get("start-up", timings["total"]), 1000 * timings["total"]))
+    if any(module in sys.modules for module in PLOTTING_MODULES):
+        print("startup: plotting libraries were loaded for rendering")
+        return
+    started = time.perf_counter()
+    import renderer
+    print("startup: plotting libraries not loaded, saved {:.1f} ms of imports".format(
+        1000 * (time.perf_counter() - started)))
 
-if not os.path.exists(os.path.join(home, homework_directory)):
-    os.mkdir(os.path.join(home, homework_directory))
 
-if topology == 'R':
-    ring = Ring(N, k, 40)
-elif topology == 'D':
-    radii = [int(r) for r in args[4:]]
-    dynamic_ring = DynamicRing(N, k, len(radii), radii)
-else:
-    print("Unknown Topology")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import argparse
+import heapq
+import math
+import time
+
+import numpy as np
+
+from ring import Ring
+
+TICK = 0
+REQUEST = 1
+REPLY = 2
+
+
+class AsyncGossipSimulator:
+    """
+    Discrete-event, asynchronous version of Ring.evolve_network.
+
+    Every node has its own timer that fires once per period, starting at a random phase. When it fires the node sends
+    its view (neighbors plus itself) to a random neighbor. The message arrives after latency plus uniform jitter
+    unless it is lost. The receiver captures its own view, merges the incoming one with Node.update_neighbors and, in
+    two-way mode, replies with the captured view, which the initiator merges when the reply arrives. With zero latency
+    this is the exchange of Ring.communicate, so convergence is comparable with the round-based Ring.
+
+    Events are processed in batches: time is cut into windows of batch_window, every window holds a plain list of
+    events that is heapified once when the window starts, and the timer ticks, latencies and losses of a whole window
+    are drawn with one random call each. Only events scheduled into the running window pay a heap push.
+    """
+
+    def __init__(self, nodes, k, period=1.0, latency=0.05, jitter=0.02, loss=0.0, one_way=False, seed=None,
+                 batch_window=None):
+        """
+        Initializer
+        :param nodes: list of nodes with initialised neighbors, node ids are 0..len(nodes) - 1
+        :param k: number of neighbors
+        :param period: time between two exchanges initiated by the same node
+        :param latency: fixed part of the one-way message delay
+        :param jitter: upper bound of the uniform random part of the message delay
+        :param loss: probability that a message is lost
+        :param one_way: if true only the receiving neighbor updates its neighbors list
+        :param seed: seed of the event schedule
+        :param batch_window: width of an event batch in time units, a tenth of the period by default
+        """
+        self.nodes = nodes
+        self.k = k
+        self.period = period
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.one_way = one_way
+        self.batch_window = batch_window if batch_window is not None else period / 10
+        self.rng = np.random.default_rng(seed)
+        self.now = 0.0
+        self.next_tick = self.rng.random(len(nodes)) * period
+        self.windows = {}
+        self.current_window = None
+        self.sequence = 0
+        self.events = 0
+        self.exchanges = 0
+        self.lost = 0
+
+    def delays(self, count):
+        """
+        :param count: number of messages
+        :return: delays of the messages, inf for lost ones
+        """
+        delay = self.latency + self.rng.random(count) * self.jitter
+        if self.loss:
+            delay[self.rng.random(count) < self.loss] = math.inf
+        return delay
+
+    def schedule(self, when, kind, target, sender=None, payload=None, current=None):
+        """
+        Put an event into its window, lost messages are counted and dropped
+        :param when: time of the event
+        :param kind: TICK, REQUEST or REPLY
+        :param target: id of the node that handles the event
+        :param sender: id of the node that sent the message
+        :param payload: a tick carries the delays of the request and reply it causes, a request carries the sender's
+                        view and the reply delay, a reply carries the receiver's view
+        :param current: heap of the running window, if any
+        :return: None
+        """
+        if when == math.inf:
+            self.lost += 1
+            return
+        self.sequence += 1
+        event = (when, self.sequence, kind, target, sender, payload)
+        window = int(when // self.batch_window)
+        if current is not None and window == self.current_window:
+            heapq.heappush(current, event)
+        else:
+            self.windows.setdefault(window, []).append(event)
+
+    def schedule_ticks(self, window):
+        """
+        Add the timer ticks of every node that fire inside a window, with the delays of the messages they cause
+        :param window: index of the window
+        :return: None
+        """
+        end = (window + 1) * self.batch_window
+        while True:
+            due = np.flatnonzero(self.next_tick < end)
+            if not len(due):
+                return
+            delays = self.delays(2 * len(due)).reshape(len(due), 2).tolist()
+            for node_id, when, delay in zip(due.tolist(), self.next_tick[due].tolist(), delays):
+                self.schedule(when, TICK, node_id, payload=delay)
+            self.next_tick[due] += self.period
+
+    def handle(self, event, current):
+        """
+        Process one event
+        :param event: the event
+        :param current: heap of the running window
+        :return: None
+        """
+        when, _, kind, target, sender, payload = event
+        node = self.nodes[target]
+        if kind == TICK:
+            request_delay, reply_delay = payload
+            neighbor = node.select_random_neighbor(self.k, self)
+            self.schedule(when + request_delay, REQUEST, neighbor.id, target,
+                          (node.get_identifiers() + [node], reply_delay), current)
+        elif kind == REQUEST:
+            view, reply_delay = payload
+            if not self.one_way:
+                self.schedule(when + reply_delay, REPLY, sender, target, node.get_identifiers() + [node], current)
+            node.update_neighbors(view, self.k)
+            self.exchanges += 1
+        else:
+            node.update_neighbors(payload, self.k)
+
+    def randrange(self, start, stop):
+        """
+        randrange for Node.select_random_neighbor, drawn from the simulator's generator
+        """
+        return start + int(self.rng.random() * (stop - start))
+
+    def run(self, until, on_period=None):
+        """
+        Run the simulation
+        :param until: simulated time to stop at
+        :param on_period: optional callback called with the period number whenever a full period has elapsed
+        :return: None
+        """
+        last_window = int(until // self.batch_window)
+        first_window = int(self.now // self.batch_window)
+        next_period = math.floor(self.now / self.period) + 1
+        for window in range(first_window, last_window + 1):
+            self.current_window = window
+            self.schedule_ticks(window)
+            current = self.windows.pop(window, [])
+            heapq.heapify(current)
+            while current and current[0][0] < until:
+                event = heapq.heappop(current)
+                self.now = event[0]
+                self.handle(event, current)
+                self.events += 1
+            if current:
+                self.windows[window] = current
+            window_end = min((window + 1) * self.batch_window, until)
+            self.now = window_end
+            while on_period is not None and next_period * self.period <= window_end:
+                on_period(next_period)
+                next_period += 1
+
+    def stats(self):
+        """
+        :return: a map with the processed events, completed exchanges and lost messages
+        """
+        return {"events": self.events, "exchanges": self.exchanges, "lost": self.lost, "time": self.now}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Asynchronous event driven T-Man on the ring topology")
+    parser.add_argument("N", type=int)
+    parser.add_argument("k", type=int)
+    parser.add_argument("periods", type=int, help="simulated time in gossip periods")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--one-way", action="store_true")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    ring = Ring(args.N, args.k, 0, seed=args.seed, output=False)
+    simulator = AsyncGossipSimulator(ring.nodes, args.k, latency=args.latency, jitter=args.jitter, loss=args.loss,
+                                     one_way=args.one_way, seed=args.seed)
+
+    def report(period):
+        same = sum(neighbor.color == node.color for node in ring.nodes for neighbor in node.neighbors)
+        total = sum(len(node.neighbors) for node in ring.nodes)
+        print("period {}: same color edges {:.4f}".format(period, same / total), flush=True)
+
+    start = time.perf_counter()
+    simulator.run(args.periods, report)
+    elapsed = time.perf_counter() - start
+    stats = simulator.stats()
+    print("{} events, {} exchanges, {} lost in {:.2f}s ({:.0f} events/s)".format(
+        stats["events"], stats["exchanges"], stats["lost"], elapsed, stats["events"] / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import argparse
+import functools
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+
+import numpy as np
+
+from dynamic_ring import DynamicRing
+from node_store import NodeStore
+from ring import Ring
+
+PHASES = ["build_nodes", "initialise_network_of_nodes", "gossip_cycle", "evolve_network", "add_build_nodes",
+          "plot_network", "write_network_color", "write_network_topology"]
+
+
+class RecordingRing(Ring):
+    """
+    A Ring that remembers the state of its random generators right before it builds its nodes
+    """
+
+    def build_nodes(self):
+        self.build_state = self.rng.bit_generator.state, self.random.getstate()
+        super().build_nodes()
+
+
+def phase_setups(n, k, engine, seed, epochs, joins, directory, workers=None):
+    """
+    Every phase as a setup function that returns the action to time, so each repetition starts from a fresh topology
+    :param n: number of nodes
+    :param k: number of neighbors
+    :param engine: "python", "batched" or "sharded"
+    :param seed: seed of every topology
+    :param epochs: gossip cycles of the evolve_network phase
+    :param joins: number of nodes joining in the add_build_nodes phase
+    :param directory: directory for the files of the output phases
+    :param workers: number of worker processes of the sharded engine, one per core by default
+    :return: map of phase name to setup function, and a function releasing the workers of the topologies they built
+    """
+    built = []
+
+    def make(topology, *args):
+        ring = topology(n, k, *args, engine=engine, workers=workers, seed=seed, output=False)
+        built.append(ring)
+        if engine == "sharded":
+            # start the workers outside of the timed action, the constructor released them
+            ring.engine.prepare()
+        return ring
+
+    def release():
+        while built:
+            engine = built.pop().engine
+            if engine is not None:
+                engine.close()
+
+    def build_nodes():
+        ring = make(RecordingRing, 0)
+        ring.nodes = []
+        if ring.store is not None:
+            ring.store = NodeStore(k, None, ring.ranking)
+        # the constructor advanced the generators, the timed build starts where the first build started
+        rng_state, random_state = ring.build_state
+        ring.rng.bit_generator.state = rng_state
+        ring.random.setstate(random_state)
+        return functools.partial(Ring.build_nodes, ring)
+
+    def initialise_network_of_nodes():
+        return make(Ring, 0).initialise_network_of_nodes
+
+    def gossip_cycle():
+        return make(Ring, 0).gossip_cycle
+
+    def evolve_network():
+        ring = make(Ring, 0)
+        ring.epochs = epochs + 1
+        return ring.evolve_network
+
+    def add_build_nodes():
+        dynamic_ring = make(DynamicRing, 0, [])
+        dynamic_ring.radii = deque([joins])
+        return dynamic_ring.rearrange_nodes
+
+    def plot_network():
+        ring = make(Ring, 0)
+        return lambda: ring.plot_network("red", os.path.join(directory, "plot.png"))
+
+    def write_network_color():
+        ring = make(Ring, 0)
+        return lambda: ring.write_network_color(os.path.join(directory, "color.txt"))
+
+    def write_network_topology():
+        ring = make(Ring, 0)
+        return lambda: ring.write_network_topology(os.path.join(directory, "topology.txt"))
+
+    return {
+        "build_nodes": build_nodes,
+        "initialise_network_of_nodes": initialise_network_of_nodes,
+        "gossip_cycle": gossip_cycle,
+        "evolve_network": evolve_network,
+        "add_build_nodes": add_build_nodes,
+        "plot_network": plot_network,
+        "write_network_color": write_network_color,
+        "write_network_topology": write_network_topology,
+    }, release
+
+
+def measure(setup, repeat, release=None):
+    """
+    Time an action and profile its memory, every run on a fresh setup. Timing runs without tracemalloc, which slows
+    allocation heavy code down, and the peak is taken in one extra traced run.
+    :param setup: function returning the action
+    :param repeat: number of timed runs, fewer when a run takes longer than a second
+    :param release: optional function called after every run, outside of the measurement
+    :return: best time in seconds and peak of traced memory in bytes
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        action = setup()
+        gc.collect()
+        start = time.perf_counter()
+        action()
+        best = min(best, time.perf_counter() - start)
+        if release is not None:
+            release()
+        if best > 1.0:
+            break
+
+    action = setup()
+    gc.collect()
+    tracemalloc.start()
+    action()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if release is not None:
+        release()
+    return best, peak
+
+
+def run_benchmarks(sizes, ks, engines, phases, seed=0, epochs=10, joins=100, repeat=3, verbose=True,
+                   workers=None):
+    """
+    :param sizes: numbers of nodes
+    :param ks: numbers of neighbors
+    :param engines: engines to benchmark
+    :param phases: names of the phases to benchmark
+    :param seed: seed of every topology
+    :param epochs: gossip cycles of the evolve_network phase
+    :param joins: nodes joining in the add_build_nodes phase, at most N
+    :param repeat: number of timed runs of a phase, the best one counts
+    :param verbose: if true print a line per result
+    :param workers: number of worker processes of the sharded engine, one per core by default
+    :return: list of results
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for n in sizes:
+            for k in ks:
+                if k > n - 1:
+                    continue
+                for engine in engines:
+                    setups, release = phase_setups(n, k, engine, seed, epochs, min(joins, n), directory, workers)
+                    for phase in phases:
+                        seconds, peak = measure(setups[phase], repeat, release)
+                        result = {"phase": phase, "n": n, "k": k, "engine": engine, "seconds": seconds,
+                                  "peak_bytes": peak}
+                        results.append(result)
+                        if verbose:
+                            print("{:<28} N={:<7} k={:<3} {:<8} {:10.4f}s {:12d} B".format(
+                                phase, n, k, engine, seconds, peak), flush=True)
+    return results
+
+
+def result_key(result):
+    return result["phase"], result["n"], result["k"], result["engine"]
+
+
+def compare(results, baseline, threshold, min_seconds=0.001):
+    """
+    Compare results with a baseline
+    :param results: list of results
+    :param baseline: list of baseline results, results without a baseline entry are skipped
+    :param threshold: allowed relative slowdown or memory growth, 0.25 allows 25%
+    :param min_seconds: timings below this are too noisy to fail a run
+    :return: list of (result, baseline result, metric, ratio) for every regression
+    """
+    reference = {result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        base = reference.get(result_key(result))
+        if base is None:
+            continue
+        if base["seconds"] >= min_seconds and result["seconds"] > base["seconds"] * (1 + threshold):
+            regressions.append((result, base, "seconds", result["seconds"] / base["seconds"]))
+        if base["peak_bytes"] and result["peak_bytes"] > base["peak_bytes"] * (1 + threshold):
+            regressions.append((result, base, "peak_bytes", result["peak_bytes"] / base["peak_bytes"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time and memory-profile every phase of a T-Man run")
+    parser.add_argument("--n", type=int, nargs="+", default=[100, 1000, 10000, 100000], help="numbers of nodes")
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 10], help="numbers of neighbors")
+    parser.add_argument("--engines", nargs="+", choices=["python", "batched", "sharded"],
+                        default=["python", "batched"])
+    parser.add_argument("--workers", type=int, help="worker processes of the sharded engine, one per core by default")
+    parser.add_argument("--phases", nargs="+", choices=PHASES, default=PHASES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--epochs", type=int, default=10, help="gossip cycles of the evolve_network phase")
+    parser.add_argument("--joins", type=int, default=100, help="nodes joining in the add_build_nodes phase")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", default="benchmark.json", help="results file")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed relative slowdown or memory growth before the run fails")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.n, args.k, args.engines, args.phases, args.seed, args.epochs, args.joins,
+                             args.repeat, workers=args.workers)
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "seed": args.seed,
+        "epochs": args.epochs,
+        "joins": args.joins,
+        "workers": args.workers,
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for result, base, metric, ratio in regressions:
+            print("REGRESSION {} N={} k={} {}: {} {:.4g} -> {:.4g} ({:.2f}x)".format(
+                result["phase"], result["n"], result["k"], result["engine"], metric, base[metric], result[metric],
+                ratio))
+        if regressions:
+            sys.exit(1)
+        print("no regressions beyond {:.0%} against {}".format(args.threshold, args.baseline))
+
+
+if __name__ == "__main__":
+    main()
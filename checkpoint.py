@@ -0,0 +1,254 @@
+import os
+import struct
+from collections import deque
+
+import numpy as np
+
+from node import Node
+from node_store import COLOR_LABELS
+from peer_sampling import STATS as SAMPLING_STATS
+from scheduler import STATS as SCHEDULE_STATS
+from simulation import Subscriber
+from trajectory import padding, topology_arrays
+
+MAGIC = b"TMANCKPT"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIIqqq")
+ENTRY = struct.Struct("<16s4sqqq")
+
+RING = 1
+DYNAMIC = 2
+
+STATS = ("departures", "crashes", "detected", "repaired", "touched")
+
+
+def generator_state(rng):
+    """
+    :param rng: a numpy random Generator over PCG64, what default_rng gives
+    :return: (6,) uint64 array: state and increment as low and high words, has_uint32 and uinteger
+    """
+    state = rng.bit_generator.state
+    if state["bit_generator"] != "PCG64":
+        raise ValueError("cannot checkpoint a {} generator".format(state["bit_generator"]))
+    words = [state["state"]["state"], state["state"]["inc"]]
+    return np.array([word >> shift & (2 ** 64 - 1) for word in words for shift in (0, 64)]
+                    + [state["has_uint32"], state["uinteger"]], dtype=np.uint64)
+
+
+def set_generator_state(rng, words):
+    """
+    :param rng: a numpy random Generator over PCG64
+    :param words: array from generator_state
+    :return: None
+    """
+    words = [int(word) for word in words]
+    rng.bit_generator.state = {"bit_generator": "PCG64",
+                               "state": {"state": words[0] | words[1] << 64, "inc": words[2] | words[3] << 64},
+                               "has_uint32": words[4], "uinteger": words[5]}
+
+
+def write_checkpoint(topology, file_name):
+    """
+    Save the state of a Ring or DynamicRing between two epochs: node arrays, neighbor matrix, epoch, remaining radii,
+    the state of the scheduler, the peer-sampling views and every random generator of the run. The file is written
+    next to its final name and renamed, so a crash while writing leaves the previous checkpoint intact.
+
+    Layout, little endian: header (magic, version, kind, number of arrays, k, epochs, epochs run, radius), one
+    entry (name, dtype, rows, columns or -1, offset) per array, then the arrays, each starting at a multiple of 8
+    bytes so they can be memory-mapped in place.
+    :param topology: the Ring or DynamicRing
+    :param file_name: the checkpoint file, replaced
+    :return: None
+    """
+    kind = DYNAMIC if hasattr(topology, "radii") else RING
+    color_code, lab, neighbors = topology_arrays(topology.store, topology.nodes, topology.k)
+    if topology.store is not None:
+        position, rgb = topology.store.position, topology.store.rgb
+    else:
+        position = [(node.position.x, node.position.y) for node in topology.nodes]
+        rgb = [node.r_g_b for node in topology.nodes]
+    random_state = topology.random.getstate()
+    arrays = [("lab", np.asarray(lab, dtype="<f8")),
+              ("rgb", np.asarray(rgb, dtype="u1").reshape(-1, 3)),
+              ("position", np.asarray(position, dtype="<f8").reshape(-1, 2)),
+              ("color_code", np.asarray(color_code, dtype="i1")),
+              ("neighbors", np.asarray(neighbors, dtype="<i4")),
+              ("rng", generator_state(topology.rng).astype("<u8")),
+              ("random", np.array(random_state[1], dtype="<u4")),
+              ("gauss", np.array([] if random_state[2] is None else [random_state[2]], dtype="<f8"))]
+    if kind == DYNAMIC:
+        arrays.append(("radii", np.array(list(topology.radii), dtype="<i8")))
+    if topology.churn is not None:
+        churn = topology.churn
+        arrays += [("alive", churn.alive.astype("u1")),
+                   ("churn_rng", generator_state(churn.rng).astype("<u8")),
+                   ("churn_stats", np.array([churn.stats[name] for name in STATS], dtype="<i8"))]
+    if topology.scheduler is not None:
+        scheduler = topology.scheduler
+        arrays += [("quiet", scheduler.quiet.astype("<i8")),
+                   ("schedule_stats", np.array([scheduler.stats[name] for name in SCHEDULE_STATS], dtype="<i8"))]
+        if scheduler.previous is not None:
+            arrays.append(("previous", scheduler.previous.astype("<i4")))
+    if topology.sampling is not None:
+        sampling = topology.sampling
+        arrays += [("sampling_views", sampling.views.astype("<i4")),
+                   ("sampling_rng", generator_state(sampling.rng).astype("<u8")),
+                   ("sampling_stats", np.array([sampling.stats[name] for name in SAMPLING_STATS], dtype="<i8"))]
+    if hasattr(topology.engine, "cycle"):
+        arrays.append(("engine", np.array([topology.engine.seed, topology.engine.cycle], dtype="<u8")))
+
+    offset = HEADER.size + ENTRY.size * len(arrays)
+    offset += padding(offset)
+    entries = []
+    for name, array in arrays:
+        entries.append(ENTRY.pack(name.encode(), array.dtype.str.encode(), array.shape[0],
+                                  array.shape[1] if array.ndim == 2 else -1, offset))
+        offset += array.nbytes + padding(array.nbytes)
+
+    temporary = file_name + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, kind, len(arrays), topology.k, topology.epochs, topology.epochs_run,
+                               getattr(topology, "radius", 0)))
+        for entry in entries:
+            file.write(entry)
+        file.write(b"\0" * padding(HEADER.size + ENTRY.size * len(arrays)))
+        for _, array in arrays:
+            array = np.ascontiguousarray(array)
+            if array.size:
+                file.write(memoryview(array).cast("B"))
+            file.write(b"\0" * padding(array.nbytes))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, file_name)
+
+
+class Checkpoint:
+    """
+    A checkpoint file, memory-mapped: an array is only read from disk when it is used
+    """
+
+    def __init__(self, file_name):
+        """
+        Initializer
+        :param file_name: a file written by write_checkpoint
+        """
+        self.file_name = file_name
+        with open(file_name, "rb") as file:
+            magic, version, self.kind, count, self.k, self.epochs, self.epochs_run, self.radius = \
+                HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("{} is not a version {} checkpoint".format(file_name, VERSION))
+            entries = [ENTRY.unpack(file.read(ENTRY.size)) for _ in range(count)]
+        self.data = np.memmap(file_name, dtype=np.uint8, mode="r")
+        self.arrays = {}
+        for name, dtype, rows, columns, offset in entries:
+            shape = (rows,) if columns < 0 else (rows, columns)
+            self.arrays[name.rstrip(b"\0").decode()] = np.ndarray(shape, np.dtype(dtype.rstrip(b"\0").decode()),
+                                                                 self.data, offset)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    @property
+    def num_nodes(self):
+        return len(self["lab"])
+
+    def restore_nodes(self, topology):
+        """
+        Rebuild the nodes and neighbor lists of a topology, in place of its random initial network
+        :param topology: a Ring or DynamicRing without nodes
+        :return: None
+        """
+        position, rgb, lab, neighbors = self["position"], self["rgb"], self["lab"], self["neighbors"]
+        colors = [COLOR_LABELS[code] for code in self["color_code"].tolist()]
+        if topology.store is not None:
+            topology.nodes = topology.store.add_nodes(position, rgb, lab, colors)
+            topology.store.neighbors[:] = neighbors
+            return
+
+        nodes = []
+        for i, (point, r_g_b, l_a_b) in enumerate(zip(position.tolist(), rgb.tolist(), lab.tolist())):
+            node = Node(i, point[0], point[1])
+            node.l_distance, node.a_distance, node.b_distance = l_a_b
+            node.r_g_b = r_g_b
+            node.color = colors[i]
+            node.ranking = topology.ranking
+            nodes.append(node)
+        for node, row in zip(nodes, neighbors.tolist()):
+            node.neighbors = [nodes[j] for j in row if j >= 0]
+        topology.nodes = nodes
+
+    def restore_state(self, topology):
+        """
+        Restore the epoch, radii and random generators of a topology built with restore_nodes, after its engine and
+        churn are set up
+        :param topology: the Ring or DynamicRing
+        :return: None
+        """
+        topology.epochs_run = self.epochs_run
+        if self.kind == DYNAMIC:
+            topology.iteration = self.epochs_run + 1
+            topology.radius = self.radius
+            topology.radii = deque(self["radii"].tolist())
+        set_generator_state(topology.rng, self["rng"])
+        gauss = self["gauss"].tolist()
+        topology.random.setstate((3, tuple(self["random"].tolist()), gauss[0] if gauss else None))
+        if topology.churn is not None and "alive" in self:
+            churn = topology.churn
+            churn.alive[:] = self["alive"].astype(bool)
+            set_generator_state(churn.rng, self["churn_rng"])
+            churn.stats.update(zip(STATS, self["churn_stats"].tolist()))
+        if topology.scheduler is not None and "quiet" in self:
+            scheduler = topology.scheduler
+            scheduler.quiet = np.array(self["quiet"], dtype=np.int64)
+            scheduler.previous = np.array(self["previous"], dtype=np.int32) if "previous" in self else None
+            scheduler.stats.update(zip(SCHEDULE_STATS, self["schedule_stats"].tolist()))
+        if topology.sampling is not None and "sampling_views" in self:
+            sampling = topology.sampling
+            sampling.views = np.array(self["sampling_views"], dtype=np.int32)
+            set_generator_state(sampling.rng, self["sampling_rng"])
+            sampling.stats.update(zip(SAMPLING_STATS, self["sampling_stats"].tolist()))
+        if hasattr(topology.engine, "cycle") and "engine" in self:
+            topology.engine.seed, topology.engine.cycle = self["engine"].tolist()
+
+
+def resume(file_name, **options):
+    """
+    Continue a run from a checkpoint. Pass the options of the original run, e.g. engine, ranking or a new Churn with
+    the same schedule; the same options give a run identical to one that was never interrupted. Convergence monitors
+    start over from the resumed epoch.
+    :param file_name: a file written by write_checkpoint
+    :param options: keyword arguments of Ring or DynamicRing
+    :return: the Ring or DynamicRing, evolved to the end unless run=False is given
+    """
+    from dynamic_ring import DynamicRing
+    from ring import Ring
+
+    checkpoint = Checkpoint(file_name)
+    if checkpoint.kind == DYNAMIC:
+        radii = checkpoint["radii"].tolist()
+        return DynamicRing(checkpoint.num_nodes, checkpoint.k, checkpoint.epochs // 5, radii, checkpoint=checkpoint,
+                           **options)
+    return Ring(checkpoint.num_nodes, checkpoint.k, checkpoint.epochs - 1, checkpoint=checkpoint, **options)
+
+
+class Checkpointer(Subscriber):
+    """
+    Writes a checkpoint every few epochs, each one replacing the one before
+    """
+
+    def __init__(self, file_name, every=10):
+        """
+        Initializer
+        :param file_name: the checkpoint file
+        :param every: number of epochs between two checkpoints
+        """
+        self.file_name = file_name
+        self.every = every
+
+    def on_epoch(self, topology, epoch):
+        if epoch and epoch % self.every == 0:
+            write_checkpoint(topology, self.file_name)
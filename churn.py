@@ -0,0 +1,229 @@
+import itertools
+
+import numpy as np
+
+
+class Churn:
+    """
+    Departures and crash failures of a running topology.
+
+    A departing node hands its neighbor list to every node that points to it, which drop it and repair their lists
+    from the hand-over. A crashed node disappears silently: the nodes pointing to it only notice when they pick it
+    for an exchange, then drop it and repair their lists from the lists of their remaining neighbors. Dead entries
+    can spread through exchanges until they are detected. Nodes never come back and ids are never reused, the rows
+    of dead nodes stay in the topology with an empty neighbor list.
+
+    The reverse index holds, for every node, the ids of the nodes pointing to it, so a departure only touches the
+    in-neighbors of the node, O(in-degree) instead of a scan of all N lists. Exchanges of the python loop and repairs
+    update it right away. Rows written elsewhere, by the batched and sharded engines or by joining nodes, are only
+    marked in dirty, and the index catches up on those rows when the next departure needs it.
+    """
+
+    def __init__(self, rate=0.0, crash_ratio=0.5, departures=None, crashes=None, seed=None):
+        """
+        Initializer
+        :param rate: expected fraction of the live nodes that leave in every epoch
+        :param crash_ratio: fraction of the random leaves that are crashes instead of departures
+        :param departures: map of epoch to ids of nodes that depart at the start of that epoch
+        :param crashes: map of epoch to ids of nodes that crash at the start of that epoch
+        :param seed: seed of the random leaves
+        """
+        self.rate = rate
+        self.crash_ratio = crash_ratio
+        self.departures = departures or {}
+        self.crashes = crashes or {}
+        self.rng = np.random.default_rng(seed)
+        self.alive = np.ones(0, dtype=bool)
+        self.previous = None
+        self.reverse = []
+        self.dirty = np.zeros(0, dtype=bool)
+        self.stats = {"departures": 0, "crashes": 0, "detected": 0, "repaired": 0, "touched": 0}
+
+    def attach(self, topology):
+        """
+        Start tracking a topology, all of its nodes alive
+        :param topology: a Ring or DynamicRing
+        :return: None
+        """
+        self.alive = np.ones(0, dtype=bool)
+        self.previous = np.full((0, topology.k), -1, dtype=np.int32)
+        self.reverse = []
+        self.dirty = np.zeros(0, dtype=bool)
+        self.sync(topology)
+
+    def sync(self, topology):
+        """
+        Track the nodes that joined since the last call. Joins may rewrite any neighbor list, so every row is marked
+        dirty.
+        :param topology: the tracked topology
+        :return: None
+        """
+        joined = len(topology.nodes) - len(self.alive)
+        if joined:
+            self.alive = np.concatenate((self.alive, np.ones(joined, dtype=bool)))
+            self.previous = np.concatenate((self.previous, np.full((joined, topology.k), -1, dtype=np.int32)))
+            self.reverse.extend(set() for _ in range(joined))
+            self.dirty = np.zeros(len(self.alive), dtype=bool)
+        self.dirty[:] = True
+        if topology.engine is not None:
+            topology.engine.alive = self.alive
+            topology.engine.written = self.dirty
+
+    def refresh(self, topology):
+        """
+        Bring the reverse index up to date on the dirty rows, only the rows that changed update it
+        :param topology: the tracked topology
+        :return: None
+        """
+        rows = np.flatnonzero(self.dirty)
+        if not len(rows):
+            return
+        if topology.store is not None:
+            current = np.asarray(topology.store.neighbors[rows], dtype=np.int32)
+        else:
+            current = np.full((len(rows), topology.k), -1, dtype=np.int32)
+            for i, node_id in enumerate(rows.tolist()):
+                ids = [neighbor.id for neighbor in topology.nodes[node_id].neighbors]
+                current[i, :len(ids)] = ids
+        changed = (current != self.previous[rows]).any(axis=1)
+        for node_id, row in zip(rows[changed].tolist(), current[changed].tolist()):
+            self.update(node_id, [j for j in row if j >= 0])
+        self.dirty[rows] = False
+
+    def track(self, node):
+        """
+        Update the reverse index from the current neighbor list of a node
+        :param node: a node of the tracked topology
+        :return: None
+        """
+        self.update(node.id, [neighbor.id for neighbor in node.neighbors])
+
+    def update(self, node_id, ids):
+        row = self.previous[node_id]
+        old = set(j for j in row.tolist() if j >= 0)
+        new = set(ids)
+        for j in old - new:
+            self.reverse[j].discard(node_id)
+        for j in new - old:
+            self.reverse[j].add(node_id)
+        row[:len(ids)] = ids
+        row[len(ids):] = -1
+
+    def live(self):
+        """
+        :return: ids of the live nodes, in order
+        """
+        return np.flatnonzero(self.alive)
+
+    def mask(self, color_code):
+        """
+        :param color_code: (N,) color codes of the topology
+        :return: the color codes with dead nodes set to 0, the code of no color
+        """
+        return np.where(self.alive, color_code, 0).astype(color_code.dtype)
+
+    def apply(self, topology, epoch):
+        """
+        Let the scheduled and the random leaves of an epoch happen, before its gossip cycle
+        :param topology: the tracked topology
+        :param epoch: the epoch that starts
+        :return: None
+        """
+        for node_id in self.departures.get(epoch, []):
+            self.depart(topology, node_id)
+        for node_id in self.crashes.get(epoch, []):
+            self.crash(topology, node_id)
+        if not self.rate:
+            return
+        live = self.live()
+        leaving = self.rng.choice(live, self.rng.binomial(len(live), self.rate), replace=False)
+        crashing = self.rng.random(len(leaving)) < self.crash_ratio
+        for node_id, crashed in zip(leaving.tolist(), crashing.tolist()):
+            if crashed:
+                self.crash(topology, node_id)
+            else:
+                self.depart(topology, node_id)
+
+    def depart(self, topology, node_id):
+        """
+        Graceful departure: every in-neighbor drops the node and takes the nearest of the handed over neighbors
+        :param topology: the tracked topology
+        :param node_id: id of the departing node
+        :return: None
+        """
+        if not self.alive[node_id]:
+            return
+        self.refresh(topology)
+        self.alive[node_id] = False
+        leaving = topology.nodes[node_id]
+        handover = leaving.neighbors
+        for in_neighbor in sorted(self.reverse[node_id]):
+            self.repair(topology, topology.nodes[in_neighbor], node_id, handover)
+            self.stats["touched"] += 1
+        leaving.neighbors = []
+        self.track(leaving)
+        self.stats["departures"] += 1
+
+    def crash(self, topology, node_id):
+        """
+        Crash failure: nobody is told, the entries pointing to the node stay until they are detected
+        :param topology: the tracked topology
+        :param node_id: id of the crashing node
+        :return: None
+        """
+        if not self.alive[node_id]:
+            return
+        self.alive[node_id] = False
+        node = topology.nodes[node_id]
+        node.neighbors = []
+        self.track(node)
+        self.stats["crashes"] += 1
+
+    def repair(self, topology, node, dead_id, offered=None):
+        """
+        Drop a dead entry and refill the list from the offered nodes, the lists of the remaining neighbors by default
+        :param topology: the tracked topology
+        :param node: the node holding the dead entry
+        :param dead_id: id of the dead node
+        :param offered: candidate nodes, e.g. the hand-over of a departing node
+        :return: None
+        """
+        node.neighbors = [neighbor for neighbor in node.neighbors if neighbor.id != dead_id]
+        if offered is None:
+            offered = list(itertools.chain.from_iterable(neighbor.neighbors for neighbor in node.neighbors))
+        node.update_neighbors([candidate for candidate in offered if candidate.id != dead_id], topology.k)
+        self.track(node)
+        self.stats["repaired"] += 1
+
+    def contact(self, topology, node):
+        """
+        Pick the exchange partner of a node. Every dead partner picked is detected and repaired and another one is
+        picked, until a live one answers.
+        :param topology: the tracked topology
+        :param node: the initiating node
+        :return: the partner, None if the node has no neighbors left
+        """
+        neighbors = node.neighbors
+        while neighbors:
+            partner = neighbors[topology.random.randrange(0, len(neighbors))]
+            if self.alive[partner.id]:
+                return partner
+            self.stats["detected"] += 1
+            self.repair(topology, node, partner.id)
+            neighbors = node.neighbors
+        return None
+
+    def collect_timeouts(self, topology):
+        """
+        After a batched cycle: repair the dead entries whose exchanges timed out, unless the cycle already replaced
+        them
+        :param topology: the tracked topology
+        :return: None
+        """
+        engine = topology.engine
+        timeouts, engine.timeouts = engine.timeouts, []
+        for node_id, dead_id in timeouts:
+            node = topology.nodes[node_id]
+            if any(neighbor.id == dead_id for neighbor in node.neighbors):
+                self.stats["detected"] += 1
+                self.repair(topology, node, dead_id)
@@ -0,0 +1,62 @@
+import numpy as np
+
+RGB_TO_XYZ = np.array([
+    [0.4124, 0.3576, 0.1805],
+    [0.2126, 0.7152, 0.0722],
+    [0.0193, 0.1192, 0.9505],
+])
+REFERENCE_WHITE = np.array([94.811, 100.00, 107.304])
+
+
+def linearize(values):
+    """
+    sRGB gamma expansion
+    :param values: channel values on a scale of 0 to 1
+    :return: linear channel values on a scale of 0 to 100
+    """
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(values > 0.04045, ((values + 0.055) / 1.055) ** 2.4, values / 12.92) * 100
+
+
+SRGB_TO_LINEAR = linearize(np.arange(256) / 255.0)
+
+
+def rgb_to_xyz(rgb, dtype=np.float64):
+    """
+    Convert R G B values to X Y Z, 8-bit integer input is linearized through a 256 entry lookup table
+    :param rgb: (N, 3) array of redness, greenness, blueness on a scale of 0 to 255
+    :param dtype: dtype of the result
+    :return: (N, 3) array of X Y Z values
+    """
+    rgb = np.asarray(rgb)
+    if rgb.dtype.kind in "ui":
+        linear = SRGB_TO_LINEAR[rgb]
+    else:
+        linear = linearize(rgb / 255.0)
+    return (linear @ RGB_TO_XYZ.T).astype(dtype, copy=False)
+
+
+def xyz_to_lab(xyz, dtype=np.float64):
+    """
+    Convert X Y Z values to cie-l, cie-a, cie-b
+    :param xyz: (N, 3) array of X Y Z values
+    :param dtype: dtype of the result
+    :return: (N, 3) array of cie-l, cie-a, cie-b values
+    """
+    scaled = np.asarray(xyz, dtype=np.float64) / REFERENCE_WHITE
+    f = np.where(scaled > 0.008856, np.cbrt(scaled), (7.87 * scaled) + (16 / 116))
+    lab = np.empty(f.shape, dtype=dtype)
+    lab[:, 0] = (116 * f[:, 1]) - 16
+    lab[:, 1] = 500 * (f[:, 0] - f[:, 1])
+    lab[:, 2] = 200 * (f[:, 1] - f[:, 2])
+    return lab
+
+
+def rgb_to_lab(rgb, dtype=np.float64):
+    """
+    Convert R G B values to cie-l, cie-a, cie-b in one call
+    :param rgb: (N, 3) array of redness, greenness, blueness on a scale of 0 to 255
+    :param dtype: dtype of the result, np.float32 halves the memory of large populations
+    :return: (N, 3) array of cie-l, cie-a, cie-b values
+    """
+    return xyz_to_lab(rgb_to_xyz(rgb), dtype)
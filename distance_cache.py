@@ -0,0 +1,184 @@
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+DEFAULT_TILE_SIZE = 256
+ENTRY_BYTES = np.dtype(np.float64).itemsize
+
+
+class LabDistanceCache:
+    """
+    Cache of pairwise cie distances between nodes, Lab coordinates never change once a node is built.
+
+    When the full float64 N x N matrix fits into the memory budget it is precomputed ("full" mode). Otherwise square
+    tiles of tile_size x tile_size distances are computed on demand and kept in an LRU bounded by the budget
+    ("tiled" mode), with tiles made smaller until one fits. Only tiles with i-block <= j-block are stored, the rest
+    are read transposed. Distances are float64 and summed in the order Node.select_k_nearest_neighbors sums them, so
+    they are bit for bit the uncached distances and near-ties rank the same way.
+    """
+
+    def __init__(self, lab, memory_budget=DEFAULT_MEMORY_BUDGET, tile_size=DEFAULT_TILE_SIZE):
+        """
+        Initializer
+        :param lab: (N, 3) array of l, a, b values
+        :param memory_budget: upper bound in bytes for cached distances
+        :param tile_size: largest edge length of a tile in tiled mode, halved until a tile fits into the budget
+        """
+        if memory_budget < ENTRY_BYTES:
+            raise ValueError("a memory budget of {} bytes cannot hold a single distance".format(memory_budget))
+        while tile_size > 1 and tile_size * tile_size * ENTRY_BYTES > memory_budget:
+            tile_size //= 2
+        self.lab = np.array(lab, dtype=np.float64).reshape(-1, 3)
+        self.memory_budget = memory_budget
+        self.tile_size = tile_size
+        self.max_tiles = memory_budget // (tile_size * tile_size * ENTRY_BYTES)
+        self.matrix = None
+        self.tiles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if self.fits_full(len(self.lab)):
+            self.matrix = self.compute_block(np.arange(len(self.lab)), np.arange(len(self.lab)))
+
+    def __len__(self):
+        return len(self.lab)
+
+    @property
+    def mode(self):
+        return "full" if self.matrix is not None else "tiled"
+
+    def fits_full(self, num_nodes):
+        """
+        :param num_nodes: number of nodes
+        :return: true if the full distance matrix fits into the memory budget
+        """
+        return num_nodes * num_nodes * ENTRY_BYTES <= self.memory_budget
+
+    def compute_block(self, rows, cols):
+        """
+        Compute distances between two groups of nodes
+        :param rows: ids of the first group
+        :param cols: ids of the second group
+        :return: (len(rows), len(cols)) float64 distances
+        """
+        block = np.empty((len(rows), len(cols)), dtype=np.float64)
+        step = max(1, (1 << 20) // max(1, len(cols)))
+        cols_lab = self.lab[cols]
+        for start in range(0, len(rows), step):
+            diff = cols_lab[None, :, :] - self.lab[rows[start:start + step]][:, None, :]
+            # float_power squares through pow like the ** 2 of Node, diff * diff can round differently
+            square = np.float_power(diff, 2)
+            block[start:start + step] = np.sqrt(square[:, :, 0] + square[:, :, 1] + square[:, :, 2])
+        return block
+
+    def extend(self, lab):
+        """
+        Add the Lab coordinates of newly joined nodes, ids continue from the current size.
+        Full mode computes only the new rows and columns; tiled mode drops only the tiles of the last partial block.
+        :param lab: (M, 3) array of l, a, b values
+        :return: None
+        """
+        old_size = len(self.lab)
+        self.lab = np.concatenate((self.lab, np.asarray(lab, dtype=np.float64).reshape(-1, 3)))
+        new_size = len(self.lab)
+
+        if self.matrix is not None:
+            if not self.fits_full(new_size):
+                self.matrix = None
+                return
+            matrix = np.empty((new_size, new_size), dtype=np.float64)
+            matrix[:old_size, :old_size] = self.matrix
+            new_rows = self.compute_block(np.arange(old_size, new_size), np.arange(new_size))
+            matrix[old_size:] = new_rows
+            matrix[:, old_size:] = new_rows.T
+            self.matrix = matrix
+            return
+
+        if old_size % self.tile_size:
+            partial = old_size // self.tile_size
+            for key in [key for key in self.tiles if partial in key]:
+                del self.tiles[key]
+
+    def tile(self, tile_i, tile_j, pairs=1):
+        """
+        :param tile_i: block index of the rows, tile_i <= tile_j
+        :param tile_j: block index of the columns
+        :param pairs: number of pairs looked up in the tile, counted as hits or misses
+        :return: the distance tile, computed if it is not cached
+        """
+        key = (tile_i, tile_j)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.hits += pairs
+            self.tiles.move_to_end(key)
+            return tile
+
+        self.misses += pairs
+        size = self.tile_size
+        rows = np.arange(tile_i * size, min((tile_i + 1) * size, len(self.lab)))
+        cols = np.arange(tile_j * size, min((tile_j + 1) * size, len(self.lab)))
+        tile = self.compute_block(rows, cols)
+        if len(self.tiles) >= self.max_tiles:
+            self.tiles.popitem(last=False)
+        self.tiles[key] = tile
+        return tile
+
+    def pair_distances(self, rows, cols):
+        """
+        Look up distances of many pairs at once
+        :param rows: ids of the first node of every pair, broadcast against cols
+        :param cols: ids of the second node of every pair
+        :return: float64 distances with the broadcast shape of rows and cols
+        """
+        rows, cols = np.broadcast_arrays(np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))
+        if self.matrix is not None:
+            self.hits += rows.size
+            return self.matrix[rows, cols]
+
+        shape = rows.shape
+        low, high = np.minimum(rows, cols).ravel(), np.maximum(rows, cols).ravel()
+        size = self.tile_size
+        num_tiles = -(-len(self.lab) // size)
+        keys = (low // size) * num_tiles + high // size
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        bounds = np.flatnonzero(np.diff(sorted_keys)) + 1
+
+        out = np.empty(len(keys), dtype=np.float64)
+        for group in np.split(order, bounds):
+            if not len(group):
+                continue
+            tile_i, tile_j = divmod(int(keys[group[0]]), num_tiles)
+            out[group] = self.tile(tile_i, tile_j, len(group))[low[group] - tile_i * size, high[group] - tile_j * size]
+        return out.reshape(shape)
+
+    def distances(self, node_id, ids):
+        """
+        :param node_id: identifier for a node
+        :param ids: ids of other nodes
+        :return: float64 distances from node_id to every node in ids
+        """
+        return self.pair_distances(node_id, ids)
+
+    def distance(self, node_id, other_id):
+        """
+        :param node_id: identifier for a node
+        :param other_id: identifier for another node
+        :return: distance between the two nodes
+        """
+        return float(self.pair_distances(node_id, other_id))
+
+    def stats(self):
+        """
+        :return: a map with the cache mode, hit and miss counts and hit rate of the looked up pairs, and bytes held
+        """
+        lookups = self.hits + self.misses
+        held = self.matrix.nbytes if self.matrix is not None else sum(tile.nbytes for tile in self.tiles.values())
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "tiles": len(self.tiles),
+            "bytes": held,
+        }
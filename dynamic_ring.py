@@ -1,11 +1,20 @@
 import math
 import random
-import matplotlib.pyplot as plt
 from collections import deque
-import networkx as nx
+import numpy as np
 
+import color_space
 from utils import Utils
+from gossip_engine import BatchedGossipEngine
+from metrics import count_changes
 from node import Node
+from node_store import NodeStore
+from ranking import get_ranking
+from sharded import ShardedGossipEngine
+from simulation import EpochDelta, SnapshotFiles
+from snapshot_writer import SnapshotWriter, take_snapshot
+from spatial_index import join_neighbors
+from trajectory import TrajectoryWriter, topology_arrays
 from TwoDPoint import TwoDPoint
 
 
@@ -14,7 +23,53 @@ class DynamicRing:
     Dynamic Ring Topology
     """
 
-    def __init__(self, num_nodes, k, m, radii):
+    def __init__(self, num_nodes, k, m, radii, use_store=False, engine="python", distance_cache=None, synchronous=True,
+                 seed=None, output=True, snapshot_workers=0, trajectory=None,
+                 raster=False, monitor=None, churn=None, join="index",
+                 workers=None, ranking="lab", subscribers=None, run=True,
+                 checkpoint=None, output_dir=None, plot=True,
+                 snapshot_every=5, scheduler=None, sampling=None):
+        """
+        Initializer
+        :param num_nodes: number of nodes on the initial ring
+        :param k: number of neighbors
+        :param m: number of radius changes, the network evolves for 5 epochs per radius
+        :param radii: radius for every change, also the number of nodes joining at that change
+        :param use_store: if true keep the topology in a struct-of-arrays NodeStore, self.nodes then holds views
+        :param engine: "python" to run exchanges one at a time, "batched" to run whole cycles with
+                       BatchedGossipEngine, "sharded" to run them in worker processes with ShardedGossipEngine
+                       (both imply use_store)
+        :param synchronous: update semantics of the batched engine, see BatchedGossipEngine
+        :param distance_cache: memory budget in bytes of a LabDistanceCache kept by the store (implies use_store)
+        :param seed: seed of the run, the same seed reproduces the same topology
+        :param output: if false skip all plots and text files
+        :param snapshot_workers: number of background processes that render and write the snapshots, 0 to write them
+                                 inside the gossip loop
+        :param trajectory: file name of a binary trajectory that records the neighbor matrix of every epoch, the
+                           snapshot text files are not written then, see trajectory.py
+        :param raster: if true render the snapshot graphs as PNG files from a NumPy canvas, see SnapshotRenderer
+        :param monitor: a ConvergenceMonitor that records the metrics of every epoch, the evolution stops early once
+                        it reports convergence and no radius is left
+        :param churn: a Churn that lets nodes depart and crash while the network evolves, see churn.py
+        :param join: "index" to connect joining nodes with grid queries over Lab, see spatial_index.join_neighbors,
+                     "scan" to offer every joining node to every node, always used with rankings other than "lab"
+        :param workers: number of worker processes of the sharded engine, one per core by default
+        :param ranking: name of the ranking function nodes rank each other by, see ranking.py. "lab" is the Lab
+                        distance of the assignment, which also uses the distance memo, cache and join index. "torus" is
+                        not supported: its period is fixed, while the ring grows with every radius
+        :param subscribers: output sinks notified after every epoch, see simulation.py
+        :param run: if true run the whole evolution before returning, otherwise nothing runs until run or stream is
+                    called. Either way the plots and text files of the assignment are written unless output is false.
+        :param checkpoint: a Checkpoint to continue from instead of building a random network, see checkpoint.py
+        :param output_dir: directory of the plots and text files, the assignment's directory in the home directory by
+                           default
+        :param plot: if false write only the text files, matplotlib is then never imported
+        :param snapshot_every: epochs between two snapshots, they are also written at epoch 1 and when a run stops early
+        :param scheduler: an ActiveSet that lets only the nodes whose views still change initiate in every cycle, see
+                          scheduler.py
+        :param sampling: a PeerSampling that mixes a few random peers into every merge of neighbor lists, see
+                         peer_sampling.py
+        """
         self.num_nodes = num_nodes
         self.epochs = m * 5
         self.nodes = []
@@ -24,49 +79,95 @@ class DynamicRing:
         self.iteration = 1
         self.radii = deque(radii)
         self.radius = 1
-        self.build_nodes()
-        self.initialise_network_of_nodes()
-        self.evolve_network()
+        self.output = output
+        self.output_dir = output_dir or Utils.get_homework_directory()
+        self.plot = plot
+        self.rng = np.random.default_rng(seed)
+        self.random = random.Random(seed)
+        if ranking == "torus":
+            raise ValueError("the torus ranking wraps at a fixed period, a dynamic ring grows past it")
+        self.ranking = get_ranking(ranking) if ranking != "lab" else None
+        if use_store or engine != "python" or distance_cache is not None:
+            self.store = NodeStore(k, distance_cache, self.ranking)
+        else:
+            self.store = None
+        self.engine = None
+        if engine == "batched":
+            self.engine = BatchedGossipEngine(self.store, synchronous=synchronous, rng=self.rng)
+        elif engine == "sharded":
+            self.engine = ShardedGossipEngine(self.store, workers, rng=self.rng)
+        self.raster = raster
+        self.join = join
+        self.renderer = None
+        self.writer = SnapshotWriter(snapshot_workers) if output and snapshot_workers else None
+        if checkpoint is None:
+            self.build_nodes()
+            self.initialise_network_of_nodes()
+        else:
+            checkpoint.restore_nodes(self)
+        self.monitor = monitor
+        self.scheduler = scheduler
+        self.churn = churn
+        if churn is not None:
+            churn.attach(self)
+        self.sampling = sampling
+        if sampling is not None:
+            sampling.attach(self)
+        self.epochs_run = 0
+        self.trajectory = None
+        if trajectory is not None:
+            color_code, lab, _ = topology_arrays(self.store, self.nodes, k)
+            self.trajectory = TrajectoryWriter(trajectory, color_code, lab, k, seed)
+        if checkpoint is not None:
+            checkpoint.restore_state(self)
+        self.stopped = False
+        self.closed = False
+        self.subscribers = list(subscribers or [])
+        if output:
+            self.subscribers.append(SnapshotFiles(snapshot_every))
+        if run:
+            self.run()
 
-    @staticmethod
-    def get_nodes_color_randomized(points_set: set, num_nodes):
+    def get_nodes_color_randomized(self, points, num_nodes):
         """
         get random colored nodes
-        :param points_set: a set of points with a specified x,y position on the topology curve
-        :param num_nodes: total number of nodes in the topology
-        :return: colored nodes
+        :param points: (M, 2) array of points with a specified x,y position on the topology curve
+        :param num_nodes: number of nodes to color, at most M
+        :return: points of the colored nodes, (num_nodes, 3) array of redness, greenness, blueness, the color
+                 labels and the remaining points in random order
         """
-        points_colored = []
-
-        for i in range(num_nodes):
-            point = random.choice(tuple(points_set))
-            r, g, b, color = Utils.get_random_color()
-            points_colored.append((point, r, g, b, color))
-            points_set.remove(point)
+        shuffled = points[self.rng.permutation(len(points))]
+        colors = [""] * num_nodes
+        rgb = Utils.sample_colors(self.rng, colors)
+        return shuffled[:num_nodes], rgb, colors, shuffled[num_nodes:]
 
-        return points_colored
+    def ring_points(self, num_points):
+        """
+        :param num_points: number of points
+        :return: (num_points, 2) array of evenly spaced points on the ring of the current radius
+        """
+        theta = 2 * math.pi / num_points * np.arange(num_points)
+        return np.column_stack((self.radius * np.cos(theta), self.radius * np.sin(theta)))
 
     def build_nodes(self):
         """
         build the topology with user input number of nodes on a ring
         :return:
         """
-        theta = [2 * math.pi / self.num_nodes * i for i in range(self.num_nodes)]
-        co_ordinates = set((self.radius * math.cos(t), self.radius * math.sin(t)) for t in theta)
-
-        colored_nodes = self.get_nodes_color_randomized(co_ordinates, self.num_nodes)
-        points, red, green, blue, color = zip(*colored_nodes)
+        points, rgb, color, _ = self.get_nodes_color_randomized(self.ring_points(self.num_nodes), self.num_nodes)
+        lab = color_space.rgb_to_lab(rgb)
 
-        X, Y, Z = Utils.transform_rgb_to_xyz(red, green, blue)
-        l, a, b = Utils.transform_xyz_to_cie_l_ab(X, Y, Z)
+        if self.store is not None:
+            self.nodes = self.store.add_nodes(points, rgb, lab, color)
+            return
 
+        points, rgb, lab = points.tolist(), rgb.tolist(), lab.tolist()
         for i in range(0, self.num_nodes):
             node = Node(i, points[i][0], points[i][1])
-            node.l_distance = l[i]
-            node.a_distance = a[i]
-            node.b_distance = b[i]
-            node.r_g_b = [red[i], green[i], blue[i]]
+            node.l_distance, node.a_distance, node.b_distance = lab[i]
+            node.r_g_b = rgb[i]
             node.color = color[i]
+            node.ranking = self.ranking
             self.nodes.append(node)
 
     def add_build_nodes(self):
@@ -75,35 +176,45 @@ class DynamicRing:
         :return:
         """
         total_nodes = self.num_nodes + self.num_new_nodes
-        theta = [2 * math.pi / total_nodes * i for i in range(total_nodes)]
-        co_ordinates = set((self.radius * math.cos(t), self.radius * math.sin(t)) for t in theta)
-
-        new_nodes = self.get_nodes_color_randomized(co_ordinates, self.num_new_nodes)
-        points, red, green, blue, color = zip(*new_nodes)
-
-        X, Y, Z = Utils.transform_rgb_to_xyz(red, green, blue)
-        l, a, b = Utils.transform_xyz_to_cie_l_ab(X, Y, Z)
+        points, rgb, color, co_ordinates = self.get_nodes_color_randomized(self.ring_points(total_nodes),
+                                                                           self.num_new_nodes)
+        lab = color_space.rgb_to_lab(rgb)
 
         start = self.num_nodes
         end = self.num_nodes + self.num_new_nodes
-        for i in range(start, end):
-            node = Node(i, points[i - start][0], points[i - start][1])
-            node.l_distance = l[i - start]
-            node.a_distance = a[i - start]
-            node.b_distance = b[i - start]
-            node.r_g_b = [red[i - start], green[i - start], blue[i - start]]
-            node.color = color[i - start]
-            self.new_nodes.append(node)
+        if self.store is not None:
+            self.new_nodes = self.store.add_nodes(points, rgb, lab, color)
+        else:
+            points, rgb, lab = points.tolist(), rgb.tolist(), lab.tolist()
+            for i in range(start, end):
+                node = Node(i, points[i - start][0], points[i - start][1])
+                node.l_distance, node.a_distance, node.b_distance = lab[i - start]
+                node.r_g_b = rgb[i - start]
+                node.color = color[i - start]
+                node.ranking = self.ranking
+                self.new_nodes.append(node)
 
-        for i in range(0, self.num_nodes):
-            point = random.choice(tuple(co_ordinates))
-            co_ordinates.remove(point)
-            self.nodes[i].position = TwoDPoint(point[0], point[1])
-            self.nodes[i].update_neighbors(self.new_nodes, self.k)
+        all_nodes = self.nodes + self.new_nodes
+        if self.store is not None:
+            self.store.position[:start] = co_ordinates
+        else:
+            for node, point in zip(self.nodes, co_ordinates.tolist()):
+                node.position = TwoDPoint(point[0], point[1])
 
-        for i in range(start, end):
-            all_nodes = self.nodes + self.new_nodes
-            self.new_nodes[i - start].update_neighbors(all_nodes, self.k)
+        if self.join == "index" and self.ranking is None:
+            _, lab, neighbors = topology_arrays(self.store, all_nodes, self.k)
+            joined = join_neighbors(lab, neighbors, start, self.k, None if self.churn is None else self.churn.alive)
+            if self.store is not None:
+                self.store.neighbors[:] = joined
+            else:
+                for node, row in zip(all_nodes, joined.tolist()):
+                    node.neighbors = [all_nodes[i] for i in row if i >= 0]
+        else:
+            live = self.nodes if self.churn is None else [self.nodes[i] for i in self.churn.live().tolist()]
+            for node in live:
+                node.update_neighbors(self.new_nodes, self.k)
+            for node in self.new_nodes:
+                node.update_neighbors(live + self.new_nodes, self.k)
 
         self.num_nodes = total_nodes
 
@@ -114,10 +225,13 @@ class DynamicRing:
         Initiate network building
         :return:
         """
-        for i in range(self.num_nodes):
-            node = self.nodes[i]
-            neighbors = Utils.select_k_neighbors(node, self.nodes, self.k)
-            node.neighbors = neighbors
+        neighbor_ids = Utils.select_k_neighbors_batch(self.rng, self.num_nodes, self.k)
+        if self.store is not None:
+            self.store.neighbors[:] = neighbor_ids
+            return
+
+        for node, row in zip(self.nodes, neighbor_ids.tolist()):
+            node.neighbors = [self.nodes[j] for j in row]
 
     def communicate(self, node):
         """
@@ -125,35 +239,197 @@ class DynamicRing:
         :param node: the node that initiates communication
         :return:
         """
-        random_neighbor = node.select_random_neighbor(self.k)
+        if self.churn is None:
+            random_neighbor = node.select_random_neighbor(self.k, self.random)
+        else:
+            random_neighbor = self.churn.contact(self, node)
+            if random_neighbor is None:
+                return
 
         current_node_identifiers = node.get_identifiers() + [node]
         random_neighbor_identifiers = random_neighbor.get_identifiers() + [random_neighbor]
+        if self.sampling is not None:
+            random_neighbor_identifiers += self.sampling.sample_nodes(self, node)
+            current_node_identifiers += self.sampling.sample_nodes(self, random_neighbor)
 
         node.update_neighbors(random_neighbor_identifiers, self.k)
         random_neighbor.update_neighbors(current_node_identifiers, self.k)
+        if self.churn is not None:
+            self.churn.track(node)
+            self.churn.track(random_neighbor)
+
+    def gossip_cycle(self):
+        """
+        Every node initiates one communication, only the nodes it picks when there is a scheduler
+        :return:
+        """
+        initiators = None if self.churn is None else self.churn.live()
+        if self.scheduler is not None:
+            initiators = self.scheduler.select(self, initiators)
+        if self.sampling is not None:
+            self.sampling.shuffle(self)
+        if self.engine is not None:
+            self.engine.run_cycle(initiators)
+            if self.churn is not None:
+                self.churn.collect_timeouts(self)
+            return
+        for i in range(self.num_nodes) if initiators is None else initiators.tolist():
+            self.communicate(self.nodes[i])
+
+    def run(self):
+        """
+        Run the whole evolution, then release the workers and files of the run
+        :return: self
+        """
+        try:
+            self.evolve_network()
+        finally:
+            self.close()
+        return self
 
     def evolve_network(self):
         """
-        Network evolution and dynamic change in ring topology for every 5th epoch
+        Network evolution and dynamic change in ring topology for every 5th epoch, until the radii run out. Once they
+        have run out the evolution stops early when the monitor reports convergence.
         :return:
         """
-        network_color_file_name = Utils.get_homework_directory() + "/D_N{}_k{}.txt".format(self.num_nodes, self.k)
-        Utils.write_network_color_to_file(self.nodes, network_color_file_name)
-        for _ in range(self.epochs):
-            if self.iteration % 5 == 0 or self.iteration == 1:
+        for _ in self.advance():
+            pass
+
+    def advance(self):
+        """
+        Lazy network evolution: every item pulled runs one epoch, records it and notifies the subscribers. Epoch 0 is
+        the initial topology, a run resumed from a checkpoint starts after the epoch of the checkpoint.
+        :return: generator of the epochs that ran
+        """
+        if self.epochs_run == 0:
+            self.record_epoch(0)
+            self.notify(0)
+            yield 0
+        while self.iteration <= self.epochs:
+            if (self.iteration % 5 == 0 or self.iteration == 1) and self.radii:
                 self.rearrange_nodes()
-            for i in range(self.num_nodes):
-                self.communicate(self.nodes[i])
-            if self.iteration == 1 or self.iteration % 5 == 0:
-                image_file_name = Utils.get_homework_directory() + "/D_N{}_k{}_{}_{}.jpg".format(self.num_nodes, self.k,
-                                                                                                 "all", self.iteration)
-                self.plot_network(image_file_name)
-                file_name = Utils.get_homework_directory() + "/D_N{}_k{}_{}_{}.txt".format(self.num_nodes, self.k,
-                                                                                           "all",
-                                                                                           self.iteration)
-                Utils.write_network_topology_to_file(self.nodes, file_name)
+            if self.churn is not None:
+                self.churn.apply(self, self.iteration)
+            self.gossip_cycle()
+            self.record_epoch(self.iteration)
+            self.epochs_run = iteration = self.iteration
+            self.stopped = self.monitor is not None and self.monitor.converged() and not self.radii
+            self.notify(iteration)
             self.iteration += 1
+            yield iteration
+            if self.stopped:
+                break
+
+    def stream(self):
+        """
+        Lazy network evolution that yields what changed: the delta of an epoch holds the rows of the neighbor matrix
+        that differ from the epoch before and the rows of the nodes that joined, so a consumer keeps at most one
+        matrix however long the run, see apply_delta. The run is closed once the stream is exhausted or closed.
+        :return: generator of EpochDelta
+        """
+        previous = np.full((0, self.k), -1, dtype=np.int32)
+        try:
+            for epoch in self.advance():
+                neighbors = np.array(topology_arrays(self.store, self.nodes, self.k)[2], dtype=np.int32)
+                rows, _ = count_changes(previous, neighbors)
+                changed = neighbors[rows]
+                changed.flags.writeable = False
+                yield EpochDelta(epoch, len(neighbors), rows, changed)
+                previous = neighbors
+        finally:
+            self.close()
+
+    def notify(self, iteration):
+        for subscriber in self.subscribers:
+            subscriber.on_epoch(self, iteration)
+
+    def close(self):
+        """
+        Close the subscribers, then release the engine workers, snapshot writers and trajectory file of the run
+        :return: None
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            for subscriber in self.subscribers:
+                subscriber.close()
+        finally:
+            if self.engine is not None:
+                self.engine.close()
+            if self.writer is not None:
+                self.writer.close()
+            if self.trajectory is not None:
+                self.trajectory.close()
+
+    def record_epoch(self, iteration):
+        """
+        Append the neighbor matrix of the current epoch to the trajectory and the monitor, if there are any, joined
+        nodes included
+        :param iteration: the current epoch
+        :return:
+        """
+        if self.trajectory is None and self.monitor is None:
+            return
+        color_code, lab, neighbors = topology_arrays(self.store, self.nodes, self.k)
+        if self.trajectory is not None:
+            self.trajectory.record(iteration, color_code, lab, neighbors)
+        if self.monitor is not None:
+            self.monitor.update(iteration, color_code if self.churn is None else self.churn.mask(color_code),
+                                neighbors)
+
+    def write_snapshot(self, iteration):
+        """
+        Plot and write the whole topology at the current epoch, in the background when there is a writer. Nothing is
+        plotted when plot is false.
+        :param iteration: the current epoch
+        :return:
+        """
+        image_file_name = None
+        if self.plot:
+            image_file_name = self.output_dir + "/D_N{}_k{}_{}_{}.{}".format(
+                self.num_nodes, self.k, "all", iteration, "png" if self.raster else "jpg")
+        file_name = self.output_dir + "/D_N{}_k{}_{}_{}.txt".format(self.num_nodes, self.k, "all", iteration)
+        if self.trajectory is not None:
+            file_name = None
+        if self.writer is not None:
+            self.writer.submit(take_snapshot(self.store, self.nodes, self.k), [(None, image_file_name, file_name)],
+                               self.raster)
+            return
+        if image_file_name is not None:
+            self.plot_network(image_file_name)
+        if file_name is not None:
+            self.write_network_topology(file_name)
+
+    def write_colors(self):
+        """
+        Write the node colors of the initial topology
+        :return: None
+        """
+        self.write_network_color(self.output_dir + "/D_N{}_k{}.txt".format(self.num_nodes, self.k))
+
+    def write_network_color(self, file_name):
+        """
+        Write node colors, through the store when there is one
+        :param file_name: a file to capture the colored network snapshot
+        :return:
+        """
+        if self.store is not None:
+            Utils.write_store_color_to_file(self.store, file_name)
+        else:
+            Utils.write_network_color_to_file(self.nodes, file_name)
+
+    def write_network_topology(self, file_name):
+        """
+        Write the neighbor lists, through the store when there is one
+        :param file_name: a file to capture the network snapshot
+        :return:
+        """
+        if self.store is not None:
+            Utils.write_store_topology_to_file(self.store, file_name)
+        else:
+            Utils.write_network_topology_to_file(self.nodes, file_name)
 
     def rearrange_nodes(self):
         """
@@ -164,34 +440,19 @@ class DynamicRing:
         self.radius = new_radius
         self.add_build_nodes()
         self.new_nodes = []
+        if self.churn is not None:
+            self.churn.sync(self)
+        if self.monitor is not None:
+            self.monitor.reset()
 
     def plot_network(self, image_file_name):
         """
-        Visualising the network at current instant of time.
+        Visualising the network at current instant of time, every edge in the color of its source node.
         :param image_file_name: a file to capture the network snapshot
         :return:
         """
-        position = {}
-        rgb, X, Y = [], [], []
-        color_map = []
-
-        for node in self.nodes:
-            rgb.append(node.r_g_b)
-            X.append(node.position.x)
-            Y.append(node.position.y)
-            position[node.id] = (node.position.x, node.position.y)
-            color_map.append(Utils.convert_to_hex(tuple(node.r_g_b)))
-
-        edges = [(node.id, nei.id) for node in self.nodes for nei in node.neighbors]
-
-        graph = nx.Graph()
-        for key, value in position.items():
-            graph.add_node(key, pos=value)
-        graph.add_edges_from(edges)
-
-        pos = nx.get_node_attributes(graph, 'pos')
-        nx.draw_networkx(graph, pos, node_color=color_map, node_size=5, with_labels=False, edge_color=color_map)
-        plt.grid('on')
-        plt.savefig(image_file_name)
-        graph.clear()
-        plt.clf()
+        if self.renderer is None:
+            from renderer import SnapshotRenderer
+            self.renderer = SnapshotRenderer(self.raster)
+        topology = self.store if self.store is not None else take_snapshot(nodes=self.nodes, k=self.k)
+        self.renderer.render(topology, [(None, image_file_name)])
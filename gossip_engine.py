@@ -0,0 +1,257 @@
+import numpy as np
+
+from ranking import store_features
+
+
+def take_rows(values, columns):
+    """
+    Row-wise gather, the same as np.take_along_axis(values, columns, axis=1) but cheaper on wide batches
+    :param values: (R, W) array
+    :param columns: (R, C) column indices into every row of values
+    :return: (R, C) gathered values
+    """
+    offsets = np.arange(0, values.size, values.shape[1])[:, None]
+    return values.ravel().take(columns + offsets)
+
+
+class BatchedGossipEngine:
+    """
+    Runs a whole gossip cycle over a NodeStore as batched NumPy operations.
+
+    Every node initiates one exchange per cycle with a random neighbor. An exchange between a target t and a
+    source s offers t the candidate block [neighbors(t), neighbors(s), s]; duplicates and t itself are masked and
+    the k nearest candidates in Lab space are kept, ties broken by node id, the same rule as
+    Node.select_k_nearest_neighbors. In two-way mode both ends of an exchange are updated, in one-way mode only the
+    receiving neighbor is.
+
+    Update semantics:
+    synchronous -- all exchanges of a cycle read the neighbor matrix as it was at the start of the cycle. A node
+                   touched by several exchanges keeps the k nearest of the union of everything it was offered.
+                   Fastest, but differs from the Python loop, where later exchanges see earlier results.
+    sequential  -- exchanges are applied in initiator order, in rounds of exchanges that share no node. An
+                   exchange only runs once every earlier pending exchange touching its nodes has run, and its
+                   partner is picked from the initiator's view at that time. This follows the order of the Python
+                   loop; it can still differ when an earlier exchange changes its partner after a later one ran.
+
+    Under churn, alive marks the nodes that still answer. An exchange with a partner that does not answer times out:
+    it changes nothing and the (initiator, partner) pair is appended to timeouts, for the caller to repair. A boolean
+    mask set as written gets every row the engine writes marked, so the caller can catch up on exactly those rows.
+
+    A PeerSampling set as sampling adds a few random peers from the view of the target to every candidate block.
+    """
+
+    def __init__(self, store, one_way=False, synchronous=True, rng=None):
+        """
+        Initializer
+        :param store: the NodeStore holding Lab coordinates and the neighbor matrix
+        :param one_way: if true only the receiving neighbor updates its neighbors list
+        :param synchronous: if true use synchronous update semantics otherwise sequential
+        :param rng: a numpy random Generator
+        """
+        self.store = store
+        self.one_way = one_way
+        self.synchronous = synchronous
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.alive = None
+        self.timeouts = []
+        self.written = None
+        self.sampling = None
+
+    def run_cycle(self, initiators=None):
+        """
+        Run one gossip cycle
+        :param initiators: ids of the nodes that initiate an exchange, in order; all nodes if None
+        :return: None
+        """
+        if initiators is None:
+            initiators = np.arange(len(self.store))
+        initiators = np.asarray(initiators, dtype=np.int64)
+        if len(initiators) == 0:
+            return
+        draws = self.rng.random(len(initiators))
+        if self.synchronous:
+            self._run_synchronous(initiators, draws)
+        else:
+            self._run_sequential(initiators, draws)
+
+    def close(self):
+        """
+        Release the resources of the engine, the batched engine holds none
+        :return: None
+        """
+
+    def pick_partners(self, initiators, draws):
+        """
+        Map uniform draws in [0, 1) to a random valid neighbor of every initiator
+        :param initiators: ids of the initiating nodes
+        :param draws: one uniform draw per initiator
+        :return: ids of the partners
+        """
+        rows = self.store.neighbors[initiators]
+        counts = (rows >= 0).sum(axis=1)
+        slots = (draws * counts).astype(np.int64)
+        return rows[np.arange(len(initiators)), slots]
+
+    def distances(self, targets, candidates):
+        """
+        Squared Lab distances, which rank candidates exactly like the Euclidean distance. When the store keeps a
+        distance cache the cached distances are used instead, they rank candidates the same way. A store with a
+        ranking from ranking.py is ranked by its kernel.
+        :param targets: (R,) ids of the nodes being updated
+        :param candidates: (R, W) candidate ids, -1 marks an empty slot
+        :return: (R, W) distances, inf for empty slots
+        """
+        empty = candidates < 0
+        cache = self.store.distance_cache
+        ranking = self.store.ranking
+        if ranking is not None:
+            features = store_features(ranking, self.store)
+            candidates = np.where(empty, targets[:, None], candidates)
+            distance = ranking.kernel(features[targets][:, None, :], features[candidates])
+        elif cache is not None:
+            candidates = np.where(empty, targets[:, None], candidates)
+            distance = cache.pair_distances(targets[:, None], candidates)
+        else:
+            lab = self.store.lab
+            diff = lab.take(candidates, axis=0) - lab.take(targets, axis=0)[:, None, :]
+            distance = np.einsum("ijk,ijk->ij", diff, diff)
+        distance[empty] = np.inf
+        return distance
+
+    def select(self, ids, distance):
+        """
+        Keep the k nearest candidates of every row, invalid candidates must already be at distance inf
+        :param ids: (R, W) candidate ids
+        :param distance: (R, W) candidate distances
+        :return: (R, k) ids sorted by distance then id, -1 where fewer than k candidates were valid,
+                 and their distances
+        """
+        k = self.store.k
+        nearest = np.argpartition(distance, k - 1, axis=1)[:, :k]
+        kept = take_rows(distance, nearest)
+        nearest = take_rows(nearest, np.lexsort((take_rows(ids, nearest), kept), axis=1))
+
+        # a candidate left out of the partition at the k-th distance may have the smaller id, only the rows where
+        # that happens pay for sorting all their candidates
+        kth = kept.max(axis=1)
+        tied = np.flatnonzero(np.isfinite(kth) & ((distance == kth[:, None]).sum(axis=1) >
+                                                  (kept == kth[:, None]).sum(axis=1)))
+        if len(tied):
+            nearest[tied] = np.lexsort((ids[tied], distance[tied]), axis=1)[:, :k]
+        ids, distance = take_rows(ids, nearest), take_rows(distance, nearest)
+        ids[distance == np.inf] = -1
+        return ids.astype(np.int32), distance
+
+    def merge(self, targets, ids, distance, offered_ids, offered_distance):
+        """
+        Merge the current view of every target with a block of offered candidates
+        :param targets: (R,) ids of the nodes being updated
+        :param ids: (R, k) current neighbor ids of the targets
+        :param distance: (R, k) distances of the current neighbors
+        :param offered_ids: (R, W) offered candidate ids, free of duplicates within a row
+        :param offered_distance: (R, W) distances of the offered candidates
+        :return: (R, k) new neighbor ids and their distances
+        """
+        offered_distance = offered_distance.copy()
+        invalid = (offered_ids == targets[:, None]) | (offered_ids < 0)
+        for column in range(ids.shape[1]):
+            invalid |= offered_ids == ids[:, column:column + 1]
+        offered_distance[invalid] = np.inf
+        return self.select(np.concatenate((ids, offered_ids), axis=1),
+                           np.concatenate((distance, offered_distance), axis=1))
+
+    def offers(self, initiators, partners):
+        """
+        Turn exchanges into offers, exchanges with partners that do not answer are dropped
+        :param initiators: ids of the initiating nodes
+        :param partners: ids of their partners, -1 for an initiator without neighbors
+        :return: target and source of every offer, a source offers its view and itself to its target
+        """
+        # an initiator without neighbors has partner -1 and simply has no exchange
+        answered = partners >= 0
+        if self.alive is not None:
+            known = answered.copy()
+            answered[known] = self.alive[partners[known]]
+            timed_out = known & ~answered
+            self.timeouts.extend(zip(initiators[timed_out].tolist(), partners[timed_out].tolist()))
+        initiators, partners = initiators[answered], partners[answered]
+        if self.one_way:
+            return partners, initiators
+        return np.concatenate((initiators, partners)), np.concatenate((partners, initiators))
+
+    def combine(self, neighbors, targets, sources, distance=None):
+        """
+        Apply offers that all read the same neighbor matrix, a target offered several views keeps the k nearest of
+        the union of its view and everything it was offered
+        :param neighbors: (N, k) neighbor matrix the offers read
+        :param targets: (E,) target of every offer, targets may repeat
+        :param sources: (E,) source of every offer
+        :param distance: (N, k) distances of the entries of neighbors, computed for the targets if None
+        :return: the distinct targets, their new neighbor ids and distances
+        """
+        order = np.argsort(targets, kind="stable")
+        targets, sources = targets[order], sources[order]
+        current = neighbors[targets]
+        current_distance = self.distances(targets, current) if distance is None else distance[targets]
+        offered = np.concatenate((neighbors[sources], sources[:, None].astype(np.int32)), axis=1)
+        if self.sampling is not None:
+            offered = self.sampling.mix(targets, offered)
+        ids, new_distance = self.merge(targets, current, current_distance, offered, self.distances(targets, offered))
+
+        positions = np.arange(len(targets))
+        starts = np.ones(len(targets), dtype=bool)
+        starts[1:] = targets[1:] != targets[:-1]
+        rank = positions - np.maximum.accumulate(np.where(starts, positions, 0))
+        group = np.cumsum(starts) - 1
+
+        updated, updated_distance = ids[starts], new_distance[starts]
+        level = 1
+        while True:
+            mask = rank == level
+            if not mask.any():
+                break
+            rows = group[mask]
+            updated[rows], updated_distance[rows] = self.merge(targets[mask], updated[rows], updated_distance[rows],
+                                                               ids[mask], new_distance[mask])
+            level += 1
+        return targets[starts], updated, updated_distance
+
+    def _exchange(self, neighbors, distance, initiators, partners):
+        """
+        Compute the updates caused by a set of exchanges that share no node, all reading the given state
+        :return: targets, their new neighbor ids and distances
+        """
+        targets, sources = self.offers(initiators, partners)
+        offered = np.concatenate((neighbors[sources], sources[:, None].astype(np.int32)), axis=1)
+        if self.sampling is not None:
+            offered = self.sampling.mix(targets, offered)
+        ids, new_distance = self.merge(targets, neighbors[targets], distance[targets], offered,
+                                       self.distances(targets, offered))
+        return targets, ids, new_distance
+
+    def _run_synchronous(self, initiators, draws):
+        neighbors = self.store.neighbors
+        targets, sources = self.offers(initiators, self.pick_partners(initiators, draws))
+        rows, ids, _ = self.combine(neighbors, targets, sources)
+        neighbors[rows] = ids
+        if self.written is not None:
+            self.written[rows] = True
+
+    def _run_sequential(self, initiators, draws):
+        neighbors = self.store.neighbors
+        distance = self.distances(np.arange(len(neighbors)), neighbors)
+        while len(initiators):
+            partners = self.pick_partners(initiators, draws)
+            order = np.arange(len(initiators))
+            # partner -1 marks an initiator without neighbors, it touches no other node and offers drops it
+            known = partners >= 0
+            first_touch = np.full(len(self.store), len(initiators), dtype=np.int64)
+            np.minimum.at(first_touch, initiators, order)
+            np.minimum.at(first_touch, partners[known], order[known])
+            ready = (first_touch[initiators] == order) & (~known | (first_touch[np.maximum(partners, 0)] == order))
+
+            targets, ids, new_distance = self._exchange(neighbors, distance, initiators[ready], partners[ready])
+            neighbors[targets], distance[targets] = ids, new_distance
+            if self.written is not None:
+                self.written[targets] = True
+            initiators, draws = initiators[~ready], draws[~ready]
@@ -0,0 +1,345 @@
+import functools
+import json
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+
+import snapshot_writer
+from dynamic_ring import DynamicRing
+from gossip_engine import BatchedGossipEngine
+from metrics import count_changes
+from node import DISTANCE_MEMO_SIZE, Node
+from node_store import NodeView
+from ring import Ring
+from sharded import ShardedGossipEngine
+from trajectory import topology_arrays
+from utils import Utils
+
+TIMED = [
+    (Ring, "communicate", "communicate"),
+    (DynamicRing, "communicate", "communicate"),
+    (Node, "update_neighbors", "update_neighbors"),
+    (Node, "select_k_nearest_neighbors", "select_k_nearest_neighbors"),
+    (NodeView, "select_k_nearest_neighbors", "select_k_nearest_neighbors"),
+    (BatchedGossipEngine, "run_cycle", "engine_cycle"),
+    (Utils, "write_network_color_to_file", "write"),
+    (Utils, "write_network_topology_to_file", "write"),
+    (Utils, "write_store_color_to_file", "write"),
+    (Utils, "write_neighbor_matrix_to_file", "write"),
+]
+
+# methods that construct a SnapshotRenderer to render, the renderer is patched right before the first of them runs:
+# (owner, name, function of the call arguments telling whether the call renders)
+RENDERING = [
+    (Ring, "plot_views", lambda ring, views: True),
+    (DynamicRing, "plot_network", lambda ring, image_file_name: True),
+    (snapshot_writer, "write_snapshot_files",
+     lambda snapshot, outputs, raster=False: any(image is not None for _, image, _ in outputs)),
+]
+
+
+class JsonLinesSink:
+    """
+    Writes every epoch report as one JSON line
+    """
+
+    def __init__(self, file_name):
+        self.file = open(file_name, "w")
+
+    def emit(self, report, totals):
+        self.file.write(json.dumps(report) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class PrometheusSink:
+    """
+    Keeps a Prometheus text exposition file with the totals of the run, replaced atomically after every epoch
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    def emit(self, report, totals):
+        lines = ["# TYPE tman_epoch gauge", "tman_epoch {}".format(report["epoch"]),
+                 "# TYPE tman_phase_seconds_total counter"]
+        lines += ['tman_phase_seconds_total{{phase="{}"}} {:.9f}'.format(phase, seconds)
+                  for phase, seconds in sorted(totals["seconds"].items())]
+        lines.append("# TYPE tman_phase_calls_total counter")
+        lines += ['tman_phase_calls_total{{phase="{}"}} {}'.format(phase, calls)
+                  for phase, calls in sorted(totals["calls"].items())]
+        for name, value in sorted(totals["counters"].items()):
+            lines += ["# TYPE tman_{}_total counter".format(name), "tman_{}_total {}".format(name, value)]
+        temporary = self.file_name + ".tmp"
+        with open(temporary, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temporary, self.file_name)
+
+    def close(self):
+        pass
+
+
+def sink_for(file_name):
+    """
+    :param file_name: a .prom file for Prometheus text format, anything else for JSON lines
+    :return: the sink
+    """
+    return PrometheusSink(file_name) if file_name.endswith(".prom") else JsonLinesSink(file_name)
+
+
+class Instrumentation:
+    """
+    Timers and counters on the hot paths of a run. Nothing is instrumented until install(): it replaces the methods
+    of TIMED and gossip_cycle by wrappers and uninstall() puts the originals back, so a run without instrumentation
+    executes exactly the uninstrumented code. The renderer, and with it matplotlib, is only imported and patched
+    right before the first method of RENDERING renders.
+
+    Timers are inclusive, a communicate contains the update_neighbors calls it makes, and a call nested in a call of
+    the same phase is only counted once. Counters:
+    exchanges, distance_evaluations (memo misses of Node, lookups of NodeView, matrix entries of the batched and
+    sharded engines), heap_selections and heap_candidates (k-nearest selections and the candidates they rank), and
+    changed_entries (neighbor entries that are new after a gossip cycle). The sharded engine selects in its worker
+    processes, so its counters are derived after the cycle from the exchanges it ran. A report is emitted after
+    every gossip cycle and covers everything since the previous one, so the plots and writes after cycle i are
+    reported with cycle i + 1.
+    """
+
+    def __init__(self, sink):
+        """
+        Initializer
+        :param sink: receives emit(report, totals) after every epoch and close() at uninstall
+        """
+        self.sink = sink
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.active = defaultdict(int)
+        self.totals = {"seconds": defaultdict(float), "calls": defaultdict(int), "counters": defaultdict(int)}
+        self.epoch = 0
+        self.originals = []
+        self.renderer_patched = False
+
+    def patch(self, owner, name, wrapper):
+        """
+        Replace a method, static methods stay static
+        :param owner: class defining the method
+        :param name: name of the method
+        :param wrapper: function taking the original function and returning its replacement
+        :return: None
+        """
+        original = owner.__dict__[name]
+        self.originals.append((owner, name, original))
+        if isinstance(original, staticmethod):
+            setattr(owner, name, staticmethod(wrapper(original.__func__)))
+        else:
+            setattr(owner, name, wrapper(original))
+
+    def timed(self, phase, counted=None):
+        """
+        :param phase: timer name
+        :param counted: optional function called with the call arguments before the call, for the counters, it
+                        returns the positional arguments to call with
+        :return: a wrapper factory for patch
+        """
+        seconds, calls, active, clock = self.seconds, self.calls, self.active, time.perf_counter
+
+        def wrap(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                # a call made from inside a call of the same phase, e.g. NodeView falling back to Node, is part of it
+                if active[phase]:
+                    return function(*args, **kwargs)
+                if counted is not None:
+                    args = counted(*args, **kwargs)
+                active[phase] += 1
+                start = clock()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    seconds[phase] += clock() - start
+                    calls[phase] += 1
+                    active[phase] -= 1
+            return wrapper
+        return wrap
+
+    def count_exchange(self, topology, *args, **kwargs):
+        self.counters["exchanges"] += 1
+        return (topology,) + args
+
+    def count_selection(self, node, nodes, k):
+        nodes = list(nodes)
+        if node.ranking is not None:
+            misses = len(nodes)
+        else:
+            # replay the LRU of the memo, a candidate can be evicted by the misses before it in the same call
+            memo = dict.fromkeys(node.distance_memo)
+            misses = 0
+            for candidate in nodes:
+                if candidate.id in memo:
+                    del memo[candidate.id]
+                else:
+                    misses += 1
+                    if len(memo) >= DISTANCE_MEMO_SIZE:
+                        del memo[next(iter(memo))]
+                memo[candidate.id] = None
+        self.counters["distance_evaluations"] += misses
+        self.counters["heap_selections"] += 1
+        self.counters["heap_candidates"] += len(nodes)
+        return node, nodes, k
+
+    def count_view_selection(self, node, nodes, k):
+        nodes = list(nodes)
+        self.counters["distance_evaluations"] += len(nodes)
+        self.counters["heap_selections"] += 1
+        self.counters["heap_candidates"] += len(nodes)
+        return node, nodes, k
+
+    def count_engine_cycle(self, engine, *args, **kwargs):
+        initiators = args[0] if args else kwargs.get("initiators")
+        self.counters["exchanges"] += len(engine.store) if initiators is None else len(initiators)
+        return (engine,) + args
+
+    def count_sharded_cycle(self, engine, *args, **kwargs):
+        """
+        Count the exchanges of a sharded cycle and the selection work its workers do, the way the batched engine
+        counts its own, from the arrays the cycle leaves in shared memory
+        """
+        shared = engine.shared
+        current = shared.buffers(engine.cycle - 1)[0]
+        initiators = np.flatnonzero(shared.active)
+        partners = shared.partners[initiators]
+        self.counters["exchanges"] += len(initiators)
+        answered = partners >= 0
+        answered[answered] = shared.alive[partners[answered]]
+        initiators, partners = initiators[answered], partners[answered]
+        if engine.one_way:
+            targets, sources = partners, initiators
+        else:
+            targets, sources = np.concatenate((initiators, partners)), np.concatenate((partners, initiators))
+        offers, distinct, k = len(targets), len(np.unique(targets)), current.shape[1]
+        # combine merges every target with its first offer, then folds in each further offer with one more merge
+        self.counters["distance_evaluations"] += int((current[targets] >= 0).sum() + (current[sources] >= 0).sum())
+        self.counters["distance_evaluations"] += offers
+        self.counters["heap_selections"] += 2 * offers - distinct
+        self.counters["heap_candidates"] += offers * (2 * k + 1) + (offers - distinct) * 2 * k
+
+    def sharded_cycle(self, function):
+        timed = self.timed("engine_cycle")(function)
+
+        @functools.wraps(function)
+        def wrapper(engine, *args, **kwargs):
+            timed(engine, *args, **kwargs)
+            self.count_sharded_cycle(engine)
+        return wrapper
+
+    def rendering(self, renders):
+        """
+        :param renders: function of the call arguments telling whether the call renders
+        :return: a wrapper factory for patch that patches the renderer before the first call that renders
+        """
+        def wrap(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.renderer_patched and renders(*args, **kwargs):
+                    self.patch_renderer()
+                return function(*args, **kwargs)
+            return wrapper
+        return wrap
+
+    def patch_renderer(self):
+        # the wrapped call is about to import it anyway
+        import renderer
+        self.renderer_patched = True
+        self.patch(renderer.SnapshotRenderer, "render", self.timed("plot"))
+
+    def install(self):
+        """
+        Instrument the run
+        :return: self
+        """
+        counted = {
+            ("communicate",): self.count_exchange,
+            (Node, "select_k_nearest_neighbors"): self.count_selection,
+            (NodeView, "select_k_nearest_neighbors"): self.count_view_selection,
+            (BatchedGossipEngine, "run_cycle"): self.count_engine_cycle,
+        }
+        for owner, name, phase in TIMED:
+            self.patch(owner, name, self.timed(phase, counted.get((owner, name), counted.get((name,)))))
+        for owner, name, renders in RENDERING:
+            self.patch(owner, name, self.rendering(renders))
+
+        counters = self.counters
+
+        def distances(function):
+            @functools.wraps(function)
+            def wrapper(engine, targets, candidates):
+                counters["distance_evaluations"] += int((candidates >= 0).sum())
+                return function(engine, targets, candidates)
+            return wrapper
+
+        def select(function):
+            @functools.wraps(function)
+            def wrapper(engine, ids, distance):
+                counters["heap_selections"] += len(ids)
+                counters["heap_candidates"] += ids.size
+                return function(engine, ids, distance)
+            return wrapper
+
+        self.patch(BatchedGossipEngine, "distances", distances)
+        self.patch(BatchedGossipEngine, "select", select)
+        self.patch(ShardedGossipEngine, "run_cycle", self.sharded_cycle)
+        for owner in (Ring, DynamicRing):
+            self.patch(owner, "gossip_cycle", self.gossip_cycle)
+        return self
+
+    def gossip_cycle(self, function):
+        instrumentation = self
+        timed = self.timed("gossip_cycle")(function)
+
+        @functools.wraps(function)
+        def wrapper(topology):
+            previous = topology_arrays(topology.store, topology.nodes, topology.k)[2].copy()
+            timed(topology)
+            neighbors = topology_arrays(topology.store, topology.nodes, topology.k)[2]
+            instrumentation.counters["changed_entries"] += count_changes(previous, neighbors)[1]
+            instrumentation.epoch += 1
+            instrumentation.emit()
+        return wrapper
+
+    def emit(self):
+        """
+        Hand the report of the epoch to the sink and start the next one
+        :return: None
+        """
+        report = {"epoch": self.epoch, "seconds": dict(self.seconds), "calls": dict(self.calls),
+                  "counters": dict(self.counters)}
+        for kind in ("seconds", "calls", "counters"):
+            for name, value in report[kind].items():
+                self.totals[kind][name] += value
+        self.sink.emit(report, self.totals)
+        self.seconds.clear()
+        self.calls.clear()
+        self.counters.clear()
+
+    def uninstall(self):
+        """
+        Restore the original methods, report what happened after the last epoch and close the sink
+        :return: None
+        """
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+        self.renderer_patched = False
+        if self.calls or self.counters:
+            self.emit()
+        self.sink.close()
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.uninstall()
@@ -0,0 +1,142 @@
+import argparse
+import time
+
+import numpy as np
+
+from simulation import Callback, Subscriber
+from spatial_index import LabGridIndex, join_neighbors
+from trajectory import topology_arrays
+
+QUANTILES = (0.1, 0.5, 0.9)
+
+
+class KnnEvaluator(Subscriber):
+    """
+    Per-epoch quality of the gossip-built views against the exact k nearest neighbors in Lab space.
+
+    The exact neighbors of every node are computed once with a LabGridIndex, to a depth of a few times k so that
+    ranks beyond k can be told apart. Lab coordinates never change, so the ground truth only changes when nodes join
+    or leave: joins are merged in with join_neighbors, which queries only the joining nodes, and when nodes die only
+    the rows that held them are queried again. Every epoch then costs a few vectorized passes over the (N, k) views.
+
+    Metrics of an epoch, over the live nodes:
+    recall -- mean fraction of a node's k true nearest neighbors that are in its view
+    rank_error -- mean over view entries of true rank minus position in the view sorted by distance, 0 for a perfect
+                  view; entries that are not among the depth nearest count with rank depth
+    quantiles -- per-node recall at the QUANTILES
+    histogram -- number of nodes with 0, 1, ..., k true nearest neighbors in their view
+    """
+
+    def __init__(self, depth=None):
+        """
+        Initializer
+        :param depth: length of the exact neighbor lists, 2k by default
+        """
+        self.depth = depth
+        self.truth = None
+        self.history = []
+
+    def on_epoch(self, topology, epoch):
+        self.evaluate(topology, epoch)
+
+    def ground_truth(self, lab, alive):
+        """
+        Bring the exact neighbor lists up to date with the nodes of the topology
+        :param lab: (N, 3) Lab coordinates
+        :param alive: (N,) boolean mask of the live nodes
+        :return: (N, depth) exact neighbor ids of every live node, nearest first, -1 where fewer nodes exist
+        """
+        num_nodes = len(lab)
+        if self.truth is None:
+            self.truth = np.full((num_nodes, self.depth), -1, dtype=np.int64)
+            stale = np.flatnonzero(alive)
+        else:
+            if num_nodes > len(self.truth):
+                self.truth = join_neighbors(lab, self.truth, len(self.truth), self.depth, alive[:len(self.truth)])
+            stale = np.empty(0, dtype=np.int64)
+            if not alive.all():
+                # the -1 of an empty slot reads the appended False
+                dead = np.append(~alive, False)
+                stale = np.flatnonzero(alive & dead[self.truth].any(axis=1))
+        if len(stale):
+            live = np.flatnonzero(alive)
+            position = np.full(num_nodes, -1)
+            position[live] = np.arange(len(live))
+            found = LabGridIndex(lab[live]).query(lab[stale], self.depth, exclude=position[stale])[0]
+            self.truth[stale] = np.where(found >= 0, live[found], -1)
+        return self.truth
+
+    def evaluate(self, topology, epoch=None):
+        """
+        Compare the views of a topology with the exact nearest neighbors
+        :param topology: a Ring or DynamicRing ranking by Lab distance
+        :param epoch: the epoch, for the history
+        :return: the metrics of the epoch, also appended to the history
+        """
+        if topology.ranking is not None:
+            raise ValueError("exact neighbors are only known for the Lab ranking, not {}".format(topology.ranking.name))
+        _, lab, neighbors = topology_arrays(topology.store, topology.nodes, topology.k)
+        k = neighbors.shape[1]
+        if self.depth is None:
+            self.depth = 2 * k
+        alive = np.ones(len(lab), dtype=bool) if topology.churn is None else topology.churn.alive.copy()
+        truth = self.ground_truth(lab, alive)
+
+        live = np.flatnonzero(alive)
+        views, truth = np.asarray(neighbors)[live].astype(np.int64), truth[live]
+        present = views >= 0
+        distance = np.where(present, ((lab[np.maximum(views, 0)] - lab[live, None, :]) ** 2).sum(axis=2), np.inf)
+        views = np.take_along_axis(views, np.argsort(distance, axis=1, kind="stable"), axis=1)
+        present = views >= 0
+
+        match = (views[:, :, None] == truth[:, None, :]) & present[:, :, None]
+        rank = np.where(match.any(axis=2), match.argmax(axis=2), self.depth)
+        correct = (rank < k).sum(axis=1)
+        recall = correct / k
+        metrics = {
+            "epoch": epoch,
+            "recall": float(recall.mean()) if len(live) else 1.0,
+            "rank_error": float((rank - np.arange(k)).mean()) if len(live) else 0.0,
+            "quantiles": dict(zip(QUANTILES, np.quantile(recall, QUANTILES).tolist())) if len(live) else {},
+            "histogram": np.bincount(correct, minlength=k + 1).tolist(),
+        }
+        self.history.append(metrics)
+        return metrics
+
+
+def main():
+    from dynamic_ring import DynamicRing
+    from ring import Ring
+
+    parser = argparse.ArgumentParser(description="Recall of the gossip-built views against the exact k nearest "
+                                                 "neighbors in Lab space, every epoch")
+    parser.add_argument("--n", type=int, default=10000, help="number of nodes")
+    parser.add_argument("--k", type=int, default=10, help="number of neighbors")
+    parser.add_argument("--epochs", type=int, default=20, help="epochs of a ring")
+    parser.add_argument("--radii", type=int, nargs="*", default=[], help="run a dynamic ring with these radii")
+    parser.add_argument("--engine", choices=["python", "batched", "sharded"], default="batched")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    evaluator = KnnEvaluator()
+    seconds = []
+
+    def timed(topology, epoch):
+        start = time.perf_counter()
+        evaluator.evaluate(topology, epoch)
+        seconds.append(time.perf_counter() - start)
+
+    options = dict(engine=args.engine, seed=args.seed, output=False, subscribers=[Callback(timed)])
+    if args.radii:
+        DynamicRing(args.n, args.k, len(args.radii), args.radii, **options)
+    else:
+        Ring(args.n, args.k, args.epochs, **options)
+    print("epoch  recall  rank error  p10   p50   p90   eval ms")
+    for metrics, spent in zip(evaluator.history, seconds):
+        quantiles = [metrics["quantiles"].get(q, 1.0) for q in QUANTILES]
+        print("{:5d}  {:6.4f}  {:10.3f}  {:.2f}  {:.2f}  {:.2f}  {:7.1f}".format(
+            metrics["epoch"], metrics["recall"], metrics["rank_error"], *quantiles, 1000 * spent))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import numpy as np
+
+from node_store import COLOR_LABELS
+from utils import Utils
+
+
+def count_changes(previous, neighbors):
+    """
+    Compare two neighbor matrices, the later one may have more rows
+    :param previous: (M, k) neighbor id matrix
+    :param neighbors: (N, k) neighbor id matrix, N >= M
+    :return: ids of the rows that changed or are new, and the number of entries that are not in the previous row
+    """
+    known = len(previous)
+    rows = np.flatnonzero((neighbors[:known] != previous).any(axis=1))
+    new, old = neighbors[rows], previous[rows]
+    kept = (new[:, :, None] == old[:, None, :]).any(axis=2)
+    changes = int((~kept & (new >= 0)).sum()) + int((neighbors[known:] >= 0).sum())
+    return np.concatenate((rows, np.arange(known, len(neighbors)))), changes
+
+
+class ConvergenceMonitor:
+    """
+    Per-epoch convergence metrics of a topology, updated from the rows that changed since the previous epoch:
+    the number of neighbor-list changes, the fraction of same-color edges per color and the number of connected
+    components of the graph plot_network draws for every color. Components are recounted only in epochs that changed
+    some edge.
+
+    The topology counts as converged once, for patience epochs in a row, every color has at least same_color of its
+    edges inside the color, every color graph is connected if connected is set, and at most max_changes entries
+    changed if max_changes is set. Ring and DynamicRing stop early then, unless early_stop is false.
+    Without color labels, as in a DynamicRing, there is no same-color criterion and the whole graph counts as one
+    color, reported as "all".
+    """
+
+    def __init__(self, same_color=1.0, connected=True, max_changes=None, patience=3, early_stop=True):
+        """
+        Initializer
+        :param same_color: smallest same-color edge fraction every color must reach
+        :param connected: if true every color graph must be a single component
+        :param max_changes: largest number of changed neighbor entries per epoch, None for any
+        :param patience: number of consecutive epochs the criterion must hold
+        :param early_stop: if false only record the metrics
+        """
+        self.same_color = same_color
+        self.connected = connected
+        self.max_changes = max_changes
+        self.patience = patience
+        self.early_stop = early_stop
+        self.previous = None
+        self.same = np.empty(0, dtype=np.int64)
+        self.degree = np.empty(0, dtype=np.int64)
+        self.components = {}
+        self.streak = 0
+        self.history = []
+
+    def update(self, epoch, color_code, neighbors):
+        """
+        Record the metrics of an epoch
+        :param epoch: the epoch
+        :param color_code: (N,) color codes, N may have grown since the previous epoch
+        :param neighbors: (N, k) neighbor id matrix, -1 marks an empty slot
+        :return: the metrics of the epoch
+        """
+        neighbors = np.asarray(neighbors)
+        color_code = np.asarray(color_code)
+        num_nodes = len(neighbors)
+        if self.previous is None:
+            rows = np.arange(num_nodes)
+            changes = 0
+        else:
+            rows, changes = count_changes(self.previous, neighbors)
+        self.previous = neighbors.copy()
+
+        if len(self.same) < num_nodes:
+            self.same = np.concatenate((self.same, np.zeros(num_nodes - len(self.same), dtype=np.int64)))
+            self.degree = np.concatenate((self.degree, np.zeros(num_nodes - len(self.degree), dtype=np.int64)))
+        changed = neighbors[rows]
+        valid = changed >= 0
+        self.same[rows] = ((color_code[changed] == color_code[rows, None]) & valid).sum(axis=1)
+        self.degree[rows] = valid.sum(axis=1)
+
+        # code 0 marks nodes without a color, e.g. nodes that left under churn
+        codes = np.unique(color_code[color_code > 0])
+        same = np.bincount(color_code, weights=self.same, minlength=len(COLOR_LABELS))
+        degree = np.bincount(color_code, weights=self.degree, minlength=len(COLOR_LABELS))
+        if len(rows) or not self.components:
+            # a topology without color labels, e.g. a DynamicRing, is one group of all nodes
+            self.components = {code: Utils.count_color_components(neighbors, color_code, code)
+                               for code in codes.tolist() or [None]}
+
+        metrics = {
+            "epoch": epoch,
+            "changes": changes,
+            "same_color": {COLOR_LABELS[code]: float(same[code] / degree[code]) if degree[code] else 1.0
+                           for code in codes.tolist()},
+            "components": {"all" if code is None else COLOR_LABELS[code]: count
+                           for code, count in self.components.items()},
+        }
+        holds = (all(fraction >= self.same_color for fraction in metrics["same_color"].values())
+                 and (not self.connected or all(count == 1 for count in self.components.values()))
+                 and (self.max_changes is None or changes <= self.max_changes))
+        self.streak = self.streak + 1 if holds else 0
+        self.history.append(metrics)
+        return metrics
+
+    def reset(self):
+        """
+        Restart the patience count, for topologies that changed from outside the gossip, e.g. when nodes joined
+        :return: None
+        """
+        self.streak = 0
+
+    def converged(self):
+        """
+        :return: true if the run should stop after the last recorded epoch
+        """
+        return self.early_stop and self.streak >= self.patience
@@ -1,8 +1,11 @@
 import heapq
+import math
 import random
 
+from ranking import select_k_nearest
 from TwoDPoint import TwoDPoint
-from utils import Utils
+
+DISTANCE_MEMO_SIZE = 128
 
 
 class Node:
@@ -10,6 +13,8 @@ class Node:
     Node class that represents a single node entity
     """
 
+    ranking = None
+
     def __init__(self, node_id, x_co_ordinate, y_co_ordinate):
         """
         Initializer
@@ -25,14 +30,16 @@ class Node:
         self.a_distance = 0
         self.b_distance = 0
         self.neighbors = []
+        self.distance_memo = {}
 
-    def select_random_neighbor(self, k):
+    def select_random_neighbor(self, k, rng=random):
         """
         choose a random neighbor from neighbor's list
         :param k: number of neighbors
+        :param rng: source of randomness with a randrange method, the random module by default
         :return: a random neighbor
         """
-        return self.neighbors[random.randrange(0, k)]
+        return self.neighbors[rng.randrange(0, k)]
 
     def get_identifiers(self):
         """
@@ -42,27 +49,32 @@ class Node:
 
     def select_k_nearest_neighbors(self, nodes, k):
         """
-        min heap based finding k nearest neighbors based on the distance criteria as provided in the assignment
-        :param nodes: set of all nodes
+        bounded heap based finding k nearest neighbors based on the distance criteria as provided in the assignment,
+        ties are broken by node id. Distances to the most recently seen peers are remembered in distance_memo,
+        an LRU of DISTANCE_MEMO_SIZE entries.
+        A node with a ranking from ranking.py ranks by it instead, with one vectorized kernel call.
+        :param nodes: iterable of candidate nodes
         :param k: the number of neighbors to choose
         :return: k nearest neighbors
         """
-        distance_pq = []
-        num_nodes = len(nodes)
+        if self.ranking is not None:
+            return select_k_nearest(self.ranking, self, nodes, k)
+        l_distance, a_distance, b_distance = self.l_distance, self.a_distance, self.b_distance
+        memo = self.distance_memo
+        ranked = []
 
-        for i in range(num_nodes):
-            point_A = (self.l_distance, self.a_distance, self.b_distance)
-            point_B = (nodes[i].l_distance, nodes[i].a_distance, nodes[i].b_distance)
-            dist = Utils.compute_distance(point_A, point_B)
-            heapq.heappush(distance_pq, (dist, nodes[i].id, nodes[i]))
+        for node in nodes:
+            # popping and re-inserting a hit moves it to the end, so the first entry is the least recently seen
+            dist = memo.pop(node.id, None)
+            if dist is None:
+                dist = math.sqrt((node.l_distance - l_distance) ** 2 + (node.a_distance - a_distance) ** 2 +
+                                 (node.b_distance - b_distance) ** 2)
+                if len(memo) >= DISTANCE_MEMO_SIZE:
+                    del memo[next(iter(memo))]
+            memo[node.id] = dist
+            ranked.append((dist, node.id, node))
 
-        k_nearest_neighbors = []
-        while k:
-            _, _, node = heapq.heappop(distance_pq)
-            k_nearest_neighbors.append(node)
-            k -= 1
-
-        return k_nearest_neighbors
+        return [node for _, _, node in heapq.nsmallest(k, ranked)]
 
     def update_neighbors(self, identifier_list, k):
         """
@@ -71,9 +83,9 @@ class Node:
         :param k: the number of neighbors to choose
         :return: None
         """
-        merged_list = set(self.neighbors).union(set(identifier_list))
-
-        if self in merged_list:
-            merged_list.remove(self)
+        candidates = {node.id: node for node in self.neighbors}
+        for node in identifier_list:
+            candidates[node.id] = node
+        candidates.pop(self.id, None)
 
-        self.neighbors = self.select_k_nearest_neighbors(list(merged_list), k)
+        self.neighbors = self.select_k_nearest_neighbors(candidates.values(), k)
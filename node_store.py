@@ -0,0 +1,219 @@
+import heapq
+
+import numpy as np
+
+from distance_cache import LabDistanceCache
+from node import Node
+from TwoDPoint import TwoDPoint
+
+COLOR_LABELS = ("", "red", "green", "blue")
+
+
+class NodeStore:
+    """
+    Struct-of-arrays storage for a topology. Row i of every array belongs to the node with id i.
+    """
+
+    def __init__(self, k, distance_cache_budget=None, ranking=None):
+        """
+        Initializer
+        :param k: number of neighbors every node keeps
+        :param distance_cache_budget: if given, keep a LabDistanceCache bounded by this many bytes
+        :param ranking: a Ranking from ranking.py the nodes rank each other by, None for Lab distance
+        """
+        self.k = k
+        self.ranking = ranking
+        self.distance_cache_budget = distance_cache_budget
+        self.distance_cache = None
+        self.lab = np.empty((0, 3), dtype=np.float64)
+        self.position = np.empty((0, 2), dtype=np.float64)
+        self.rgb = np.empty((0, 3), dtype=np.uint8)
+        self.color_code = np.empty(0, dtype=np.int8)
+        self.neighbors = np.empty((0, k), dtype=np.int32)
+        self._views = []
+
+    def __len__(self):
+        return len(self.color_code)
+
+    @staticmethod
+    def encode_colors(colors):
+        """
+        :param colors: iterable of color labels
+        :return: array of color codes
+        """
+        return np.array([COLOR_LABELS.index(color) for color in colors], dtype=np.int8)
+
+    def add_nodes(self, points, rgb, lab, colors):
+        """
+        Append a batch of nodes, ids continue from the current size of the store
+        :param points: sequence of (x, y) positions
+        :param rgb: sequence of (r, g, b) values on a scale of 0 to 255
+        :param lab: sequence of (l, a, b) values
+        :param colors: sequence of color labels
+        :return: views of the new nodes
+        """
+        start = len(self)
+        count = len(colors)
+        self.lab = np.concatenate((self.lab, np.asarray(lab, dtype=np.float64).reshape(count, 3)))
+        self.position = np.concatenate((self.position, np.asarray(points, dtype=np.float64).reshape(count, 2)))
+        self.rgb = np.concatenate((self.rgb, np.asarray(rgb, dtype=np.uint8).reshape(count, 3)))
+        self.color_code = np.concatenate((self.color_code, self.encode_colors(colors)))
+        self.neighbors = np.concatenate((self.neighbors, np.full((count, self.k), -1, dtype=np.int32)))
+        if self.distance_cache is not None:
+            self.distance_cache.extend(self.lab[start:])
+        elif self.distance_cache_budget is not None:
+            self.distance_cache = LabDistanceCache(self.lab, self.distance_cache_budget)
+        new_views = [NodeView(self, i) for i in range(start, start + count)]
+        self._views.extend(new_views)
+        return new_views
+
+    @classmethod
+    def from_nodes(cls, nodes, k):
+        """
+        Build a store from a list of Node objects whose ids are 0..len(nodes) - 1
+        :param nodes: list of nodes
+        :param k: number of neighbors every node keeps
+        :return: a populated store
+        """
+        store = cls(k)
+        ordered = sorted(nodes, key=lambda node: node.id)
+        store.add_nodes([(node.position.x, node.position.y) for node in ordered],
+                        [node.r_g_b for node in ordered],
+                        [(node.l_distance, node.a_distance, node.b_distance) for node in ordered],
+                        [node.color for node in ordered])
+        for node in ordered:
+            store.set_neighbors(node.id, [neighbor.id for neighbor in node.neighbors])
+        return store
+
+    def view(self, node_id):
+        """
+        :param node_id: identifier for a node
+        :return: the Node view of a row
+        """
+        return self._views[node_id]
+
+    def views(self):
+        """
+        :return: Node views of all rows
+        """
+        return list(self._views)
+
+    def color_of(self, node_id):
+        """
+        :param node_id: identifier for a node
+        :return: color label of the node
+        """
+        return COLOR_LABELS[self.color_code[node_id]]
+
+    def neighbor_ids(self, node_id):
+        """
+        :param node_id: identifier for a node
+        :return: list of neighbor ids, empty slots are skipped
+        """
+        return [j for j in self.neighbors[node_id].tolist() if j >= 0]
+
+    def set_neighbors(self, node_id, ids):
+        """
+        Overwrite the neighbor row of a node, unused slots are filled with -1
+        :param node_id: identifier for a node
+        :param ids: neighbor ids, at most k of them
+        :return: None
+        """
+        row = self.neighbors[node_id]
+        row[:len(ids)] = ids
+        row[len(ids):] = -1
+
+
+class NodeView(Node):
+    """
+    A Node backed by one row of a NodeStore, kept so that Node based code keeps working on the store
+    """
+
+    def __init__(self, store, node_id):
+        """
+        Initializer
+        :param store: the backing store
+        :param node_id: identifier for a node and row index in the store
+        """
+        self.store = store
+        self.id = node_id
+        self.distance_memo = {}
+
+    def select_k_nearest_neighbors(self, nodes, k):
+        """
+        Same selection as Node.select_k_nearest_neighbors, distances come from the store's cache when it has one and
+        ranks by Lab distance
+        :param nodes: iterable of candidate nodes
+        :param k: the number of neighbors to choose
+        :return: k nearest neighbors
+        """
+        cache = self.store.distance_cache
+        if cache is None or self.store.ranking is not None:
+            return Node.select_k_nearest_neighbors(self, nodes, k)
+
+        nodes = list(nodes)
+        ids = [node.id for node in nodes]
+        distances = cache.distances(self.id, ids).tolist()
+        return [node for _, _, node in heapq.nsmallest(k, zip(distances, ids, nodes))]
+
+    @property
+    def ranking(self):
+        return self.store.ranking
+
+    @property
+    def position(self):
+        x, y = self.store.position[self.id].tolist()
+        return TwoDPoint(x, y)
+
+    @position.setter
+    def position(self, point):
+        self.store.position[self.id] = (point.x, point.y)
+
+    @property
+    def r_g_b(self):
+        return self.store.rgb[self.id].tolist()
+
+    @r_g_b.setter
+    def r_g_b(self, rgb):
+        self.store.rgb[self.id] = rgb
+
+    @property
+    def color(self):
+        return self.store.color_of(self.id)
+
+    @color.setter
+    def color(self, color):
+        self.store.color_code[self.id] = COLOR_LABELS.index(color)
+
+    @property
+    def l_distance(self):
+        return self.store.lab[self.id, 0]
+
+    @l_distance.setter
+    def l_distance(self, value):
+        self.store.lab[self.id, 0] = value
+
+    @property
+    def a_distance(self):
+        return self.store.lab[self.id, 1]
+
+    @a_distance.setter
+    def a_distance(self, value):
+        self.store.lab[self.id, 1] = value
+
+    @property
+    def b_distance(self):
+        return self.store.lab[self.id, 2]
+
+    @b_distance.setter
+    def b_distance(self, value):
+        self.store.lab[self.id, 2] = value
+
+    @property
+    def neighbors(self):
+        views = self.store._views
+        return [views[j] for j in self.store.neighbor_ids(self.id)]
+
+    @neighbors.setter
+    def neighbors(self, neighbors):
+        self.store.set_neighbors(self.id, [node.id for node in neighbors])
@@ -0,0 +1,228 @@
+import argparse
+
+import numpy as np
+
+STATS = ("shuffles", "offered")
+
+
+def clean(views, owners, alive=None):
+    """
+    Drop repeated entries, the owner itself and dead nodes from views
+    :param views: (R, V) peer ids, -1 marks an empty slot
+    :param owners: (R,) id of the node every row belongs to
+    :param alive: boolean mask of the live nodes, all alive if None
+    :return: (R, V) views with the dropped entries set to -1
+    """
+    order = np.argsort(views, axis=1, kind="stable")
+    ordered = np.take_along_axis(views, order, axis=1)
+    repeated = np.zeros(views.shape, dtype=bool)
+    repeated[:, 1:] = ordered[:, 1:] == ordered[:, :-1]
+    dropped = np.empty_like(repeated)
+    np.put_along_axis(dropped, order, repeated, axis=1)
+    dropped |= views == owners[:, None]
+    if alive is not None:
+        dropped |= (views >= 0) & ~alive[np.maximum(views, 0)]
+    return np.where(dropped, -1, views)
+
+
+class PeerSampling:
+    """
+    Peer-sampling service in the style of Newscast and Cyclon: every node keeps a small view of random peers, next to
+    its T-Man neighbors, and every merge of neighbor lists also gets a few candidates from the view of the node that
+    merges. The views keep showing nodes from all over the topology, so a node stuck among poor neighbors still finds
+    better ones, which T-Man alone only reaches through chains of neighbors.
+
+    Once per cycle every live node shuffles: it picks a random peer of its view, draws its new view at random from
+    both views and the peer, and the peer puts the node into a random slot of its own view. Joining nodes start with
+    random views of the live nodes and are put into as many random views, the way a Cyclon join spreads a node by
+    random walks. Dead nodes are dropped from the views at the next shuffle.
+
+    All views are rows of one (N, view_size) matrix and a shuffle is a few vectorized passes over it. The merges of
+    the python engine go through Ring.communicate, those of the batched engine through BatchedGossipEngine.combine;
+    the sharded engine is not supported.
+    """
+
+    def __init__(self, view_size=8, mixed=2, seed=None):
+        """
+        Initializer
+        :param view_size: number of random peers every node keeps
+        :param mixed: number of random peers offered with every merge
+        :param seed: seed of the shuffles and draws
+        """
+        self.view_size = view_size
+        self.mixed = min(mixed, view_size)
+        self.rng = np.random.default_rng(seed)
+        self.views = np.full((0, view_size), -1, dtype=np.int32)
+        self.stats = dict.fromkeys(STATS, 0)
+
+    def attach(self, topology):
+        """
+        Give every node of a topology a random view and hook the service into its engine
+        :param topology: a Ring or DynamicRing
+        :return: None
+        """
+        if topology.engine is not None and not hasattr(topology.engine, "sampling"):
+            raise ValueError("peer sampling needs the python or the batched engine")
+        self.views = np.full((0, self.view_size), -1, dtype=np.int32)
+        self.sync(topology)
+        if topology.engine is not None:
+            topology.engine.sampling = self
+
+    @staticmethod
+    def alive(topology):
+        return None if topology.churn is None else topology.churn.alive
+
+    def sync(self, topology):
+        """
+        Add views for the nodes that joined since the last call
+        :param topology: the topology
+        :return: None
+        """
+        num_nodes = len(topology.nodes)
+        known = len(self.views)
+        if num_nodes <= known:
+            return
+        alive = self.alive(topology)
+        live = np.arange(num_nodes) if alive is None else np.flatnonzero(alive)
+        joined = np.arange(known, num_nodes)
+        views = live[self.rng.integers(0, len(live), (len(joined), self.view_size))].astype(np.int32)
+        self.views = np.concatenate((self.views, clean(views, joined, alive)))
+        if known:
+            hosts = live[self.rng.integers(0, len(live), (len(joined), self.view_size))].ravel()
+            slots = self.rng.integers(0, self.view_size, len(hosts))
+            self.views[hosts, slots] = np.repeat(joined, self.view_size)
+            self.views[hosts] = clean(self.views[hosts], hosts, alive)
+
+    def shuffle(self, topology):
+        """
+        One shuffle of every live node, run at the start of every gossip cycle
+        :param topology: the topology
+        :return: None
+        """
+        self.sync(topology)
+        alive = self.alive(topology)
+        views = self.views
+        nodes = np.arange(len(views)) if alive is None else np.flatnonzero(alive)
+        nodes = nodes[(views[nodes] >= 0).any(axis=1)]
+        if not len(nodes):
+            return
+        keys = self.rng.random((len(nodes), self.view_size))
+        keys[views[nodes] < 0] = 2.0
+        partners = views[nodes, keys.argmin(axis=1)]
+
+        pool = clean(np.concatenate((views[nodes], views[partners], partners[:, None]), axis=1), nodes, alive)
+        keys = self.rng.random(pool.shape)
+        keys[pool < 0] = np.inf
+        picked = np.argpartition(keys, self.view_size - 1, axis=1)[:, :self.view_size]
+        shuffled = views.copy()
+        shuffled[nodes] = np.where(np.isinf(np.take_along_axis(keys, picked, axis=1)), -1,
+                                   np.take_along_axis(pool, picked, axis=1))
+        shuffled[partners, self.rng.integers(0, self.view_size, len(nodes))] = nodes
+        self.views = clean(shuffled, np.arange(len(views)), alive)
+        self.stats["shuffles"] += len(nodes)
+
+    def sample(self, targets):
+        """
+        :param targets: (R,) ids of the nodes that merge
+        :return: (R, mixed) distinct random peers from the view of every target, -1 where the view has fewer
+        """
+        rows = self.views[targets]
+        keys = self.rng.random(rows.shape)
+        keys[rows < 0] = np.inf
+        picked = np.argpartition(keys, self.mixed - 1, axis=1)[:, :self.mixed]
+        ids = np.where(np.isinf(np.take_along_axis(keys, picked, axis=1)), -1, np.take_along_axis(rows, picked, axis=1))
+        self.stats["offered"] += int((ids >= 0).sum())
+        return ids
+
+    def mix(self, targets, offered):
+        """
+        Add random peers to the candidate blocks of the batched engine
+        :param targets: (R,) ids of the nodes being updated
+        :param offered: (R, W) offered candidate ids, free of duplicates within a row
+        :return: (R, W + mixed) candidate ids, still free of duplicates
+        """
+        extra = self.sample(targets).astype(offered.dtype)
+        extra[(extra[:, :, None] == offered[:, None, :]).any(axis=2)] = -1
+        return np.concatenate((offered, extra), axis=1)
+
+    def sample_nodes(self, topology, node):
+        """
+        :param topology: the topology
+        :param node: a node that merges, in the python engine
+        :return: random peers from the view of the node
+        """
+        return [topology.nodes[j] for j in self.sample(np.array([node.id]))[0].tolist() if j >= 0]
+
+    def report(self):
+        """
+        :return: one line with the shuffles run and the random peers offered
+        """
+        return "peer sampling: {} shuffles, {} random peers offered to merges".format(self.stats["shuffles"],
+                                                                                      self.stats["offered"])
+
+
+def main():
+    from dynamic_ring import DynamicRing
+    from knn_eval import KnnEvaluator
+    from ring import Ring
+    from simulation import Callback
+
+    parser = argparse.ArgumentParser(description="Epochs and exchanges to convergence with and without peer sampling; "
+                                                 "a run has converged once the recall of the views against the exact "
+                                                 "k nearest neighbors stays above the target")
+    parser.add_argument("--n", type=int, default=1000, help="number of nodes")
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 9], help="numbers of neighbors")
+    parser.add_argument("--epochs", type=int, default=40, help="epochs of a ring")
+    parser.add_argument("--radii", type=int, nargs="*", default=[], help="run a dynamic ring with these radii")
+    parser.add_argument("--engine", choices=["python", "batched"], default="batched")
+    parser.add_argument("--view-size", type=int, default=8, help="random peers every node keeps")
+    parser.add_argument("--mixed", type=int, default=2, help="random peers offered with every merge")
+    parser.add_argument("--target", type=float, default=0.95, help="recall that counts as converged")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 2, 3, 4])
+    args = parser.parse_args()
+
+    def run(k, seed, sampling):
+        """
+        :return: the epoch from which the recall stays above the target, None if it ends below, the exchanges
+                 initiated up to that epoch and the final recall
+        """
+        evaluator = KnnEvaluator()
+        history = []
+
+        def measure(topology, epoch):
+            exchanges = history[-1][2] if history else 0
+            initiated = len(topology.nodes) if topology.churn is None else int(topology.churn.alive.sum())
+            history.append((epoch, evaluator.evaluate(topology, epoch)["recall"], exchanges + initiated * (epoch > 0)))
+
+        options = dict(engine=args.engine, seed=seed, output=False, sampling=sampling, subscribers=[Callback(measure)])
+        if args.radii:
+            DynamicRing(args.n, k, len(args.radii), args.radii, **options)
+        else:
+            Ring(args.n, k, args.epochs, **options)
+        converged = None, None
+        for epoch, recall, exchanges in reversed(history):
+            if recall < args.target:
+                break
+            converged = epoch, exchanges
+        return converged + (history[-1][1],)
+
+    print("   k  seed  epochs without  epochs with  exchanges without  exchanges with  recall without  recall with")
+    for k in args.k:
+        saved_epochs, saved_exchanges = [], []
+        for seed in args.seeds:
+            epochs_before, exchanges_before, recall_before = run(k, seed, None)
+            epochs_after, exchanges_after, recall_after = run(k, seed, PeerSampling(args.view_size, args.mixed, seed))
+            if epochs_before is not None and epochs_after is not None:
+                saved_epochs.append(epochs_before - epochs_after)
+                saved_exchanges.append(1 - exchanges_after / exchanges_before)
+            print("{:4d}  {:4d}  {:>14}  {:>11}  {:>17}  {:>14}  {:14.4f}  {:11.4f}".format(
+                k, seed, *("-" if value is None else value
+                           for value in (epochs_before, epochs_after, exchanges_before, exchanges_after)),
+                recall_before, recall_after), flush=True)
+        if saved_epochs:
+            print("k={}: {:.1f} epochs and {:.1%} of the exchanges saved on average over {} seeds that converged both "
+                  "ways".format(k, float(np.mean(saved_epochs)), float(np.mean(saved_exchanges)), len(saved_epochs)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import heapq
+from collections import namedtuple
+
+import numpy as np
+
+Ranking = namedtuple("Ranking", ["name", "feature", "kernel"])
+
+RANKINGS = {}
+
+
+def lab_distance(source, candidates):
+    """
+    Euclidean distance in cie-Lab, the ranking of the assignment
+    """
+    diff = np.asarray(candidates, dtype=np.float64) - np.asarray(source, dtype=np.float64)
+    return np.sqrt((diff * diff).sum(axis=-1))
+
+
+def cie94_distance(source, candidates):
+    """
+    CIE94 color difference with the graphic arts weights, the source is the reference color
+    """
+    source = np.asarray(source, dtype=np.float64)
+    candidates = np.asarray(candidates, dtype=np.float64)
+    chroma_1 = np.hypot(source[..., 1], source[..., 2])
+    chroma_2 = np.hypot(candidates[..., 1], candidates[..., 2])
+    delta_l = source[..., 0] - candidates[..., 0]
+    delta_c = chroma_1 - chroma_2
+    delta_a = source[..., 1] - candidates[..., 1]
+    delta_b = source[..., 2] - candidates[..., 2]
+    delta_h_squared = np.maximum(delta_a ** 2 + delta_b ** 2 - delta_c ** 2, 0.0)
+    s_c = 1 + 0.045 * chroma_1
+    s_h = 1 + 0.015 * chroma_1
+    return np.sqrt(delta_l ** 2 + (delta_c / s_c) ** 2 + delta_h_squared / s_h ** 2)
+
+
+def ciede2000_distance(source, candidates):
+    """
+    CIEDE2000 color difference with unit weights
+    """
+    source = np.asarray(source, dtype=np.float64)
+    candidates = np.asarray(candidates, dtype=np.float64)
+    l_1, a_1, b_1 = source[..., 0], source[..., 1], source[..., 2]
+    l_2, a_2, b_2 = candidates[..., 0], candidates[..., 1], candidates[..., 2]
+
+    chroma_mean = (np.hypot(a_1, b_1) + np.hypot(a_2, b_2)) / 2
+    g = 0.5 * (1 - np.sqrt(chroma_mean ** 7 / (chroma_mean ** 7 + 25.0 ** 7)))
+    a_1, a_2 = (1 + g) * a_1, (1 + g) * a_2
+    c_1, c_2 = np.hypot(a_1, b_1), np.hypot(a_2, b_2)
+    h_1 = np.degrees(np.arctan2(b_1, a_1)) % 360
+    h_2 = np.degrees(np.arctan2(b_2, a_2)) % 360
+    achromatic = c_1 * c_2 == 0
+
+    delta_l = l_2 - l_1
+    delta_c = c_2 - c_1
+    delta_h = h_2 - h_1
+    delta_h = np.where(delta_h > 180, delta_h - 360, np.where(delta_h < -180, delta_h + 360, delta_h))
+    delta_h = np.where(achromatic, 0.0, delta_h)
+    delta_hue = 2 * np.sqrt(c_1 * c_2) * np.sin(np.radians(delta_h) / 2)
+
+    l_mean = (l_1 + l_2) / 2
+    c_mean = (c_1 + c_2) / 2
+    h_sum = h_1 + h_2
+    h_mean = np.where(np.abs(h_1 - h_2) <= 180, h_sum / 2, np.where(h_sum < 360, (h_sum + 360) / 2, (h_sum - 360) / 2))
+    h_mean = np.where(achromatic, h_sum, h_mean)
+
+    t = (1 - 0.17 * np.cos(np.radians(h_mean - 30)) + 0.24 * np.cos(np.radians(2 * h_mean))
+         + 0.32 * np.cos(np.radians(3 * h_mean + 6)) - 0.20 * np.cos(np.radians(4 * h_mean - 63)))
+    delta_theta = 30 * np.exp(-((h_mean - 275) / 25) ** 2)
+    r_c = 2 * np.sqrt(c_mean ** 7 / (c_mean ** 7 + 25.0 ** 7))
+    s_l = 1 + 0.015 * (l_mean - 50) ** 2 / np.sqrt(20 + (l_mean - 50) ** 2)
+    s_c = 1 + 0.045 * c_mean
+    s_h = 1 + 0.015 * c_mean * t
+    r_t = -np.sin(np.radians(2 * delta_theta)) * r_c
+    lightness, chroma, hue = delta_l / s_l, delta_c / s_c, delta_hue / s_h
+    return np.sqrt(np.maximum(lightness ** 2 + chroma ** 2 + hue ** 2 + r_t * chroma * hue, 0.0))
+
+
+def ring_distance(source, candidates):
+    """
+    Angle between positions seen from the center of the ring, in radians, so it does not change with the radius
+    """
+    source = np.asarray(source, dtype=np.float64)
+    candidates = np.asarray(candidates, dtype=np.float64)
+    angle = np.abs(np.arctan2(candidates[..., 1], candidates[..., 0]) - np.arctan2(source[..., 1], source[..., 0]))
+    angle %= 2 * np.pi
+    return np.minimum(angle, 2 * np.pi - angle)
+
+
+def torus_distance(source, candidates, period=2.0):
+    """
+    Euclidean distance between positions on the torus that wraps every axis with the period, by default the square
+    [-1, 1) x [-1, 1) around the unit ring
+    """
+    diff = np.abs(np.asarray(candidates, dtype=np.float64) - np.asarray(source, dtype=np.float64)) % period
+    diff = np.minimum(diff, period - diff)
+    return np.sqrt((diff * diff).sum(axis=-1))
+
+
+def line_distance(source, candidates):
+    """
+    Distance between identifiers on a line
+    """
+    return np.abs(np.asarray(candidates, dtype=np.float64)[..., 0] - np.asarray(source, dtype=np.float64)[..., 0])
+
+
+def register_ranking(name, feature, kernel):
+    """
+    Add a ranking function to the registry
+    :param name: name to select it by
+    :param feature: what a node is ranked by, "lab" for its cie-l, cie-a, cie-b values, "position" for its
+                    TwoDPoint, "id" for its identifier
+    :param kernel: kernel(source, candidates) maps feature arrays that broadcast against each other, the last axis
+                   holding the features of a node, to distances; smaller ranks closer
+    :return: the ranking
+    """
+    if feature not in ("lab", "position", "id"):
+        raise ValueError("unknown feature {}".format(feature))
+    ranking = RANKINGS[name] = Ranking(name, feature, kernel)
+    return ranking
+
+
+def get_ranking(name):
+    """
+    :param name: name of a registered ranking function
+    :return: the ranking
+    """
+    try:
+        return RANKINGS[name]
+    except KeyError:
+        raise ValueError("unknown ranking {}, choose from {}".format(name, ", ".join(sorted(RANKINGS))))
+
+
+def store_features(ranking, store):
+    """
+    :param ranking: a Ranking
+    :param store: a NodeStore, or anything with the same arrays
+    :return: (N, F) features of every node of the store
+    """
+    if ranking.feature == "id":
+        return np.arange(len(store), dtype=np.float64)[:, None]
+    return getattr(store, ranking.feature)
+
+
+def node_features(ranking, nodes):
+    """
+    :param ranking: a Ranking
+    :param nodes: list of nodes
+    :return: (len(nodes), F) features of the nodes
+    """
+    if ranking.feature == "lab":
+        rows = [(node.l_distance, node.a_distance, node.b_distance) for node in nodes]
+    elif ranking.feature == "position":
+        rows = [(point.x, point.y) for point in (node.position for node in nodes)]
+    else:
+        rows = [(node.id,) for node in nodes]
+    return np.array(rows, dtype=np.float64).reshape(len(nodes), -1)
+
+
+def select_k_nearest(ranking, node, nodes, k):
+    """
+    The k nearest candidates of a node under a ranking, with one kernel call for all candidates, ties broken by
+    node id like Node.select_k_nearest_neighbors
+    :param ranking: a Ranking
+    :param node: the node that ranks
+    :param nodes: iterable of candidate nodes
+    :param k: the number of neighbors to choose
+    :return: k nearest neighbors
+    """
+    nodes = list(nodes)
+    if not nodes:
+        return []
+    distances = ranking.kernel(node_features(ranking, [node])[0], node_features(ranking, nodes)).tolist()
+    return [candidate for _, _, candidate in heapq.nsmallest(k, zip(distances, [n.id for n in nodes], nodes))]
+
+
+register_ranking("lab", "lab", lab_distance)
+register_ranking("cie94", "lab", cie94_distance)
+register_ranking("ciede2000", "lab", ciede2000_distance)
+register_ranking("ring", "position", ring_distance)
+register_ranking("torus", "position", torus_distance)
+register_ranking("line", "id", line_distance)
@@ -0,0 +1,152 @@
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgb
+from matplotlib.figure import Figure
+from matplotlib.image import imsave
+
+from node_store import NodeStore
+
+RASTER_SAMPLES = 1 << 22
+
+
+def edge_arrays(neighbors):
+    """
+    :param neighbors: (N, k) neighbor id matrix, -1 marks an empty slot
+    :return: source and target id of every edge, grouped by source
+    """
+    present = neighbors >= 0
+    return np.repeat(np.arange(len(neighbors)), present.sum(axis=1)), neighbors[present]
+
+
+def pack(rgb):
+    """
+    :param rgb: (..., 3) array of redness, greenness, blueness on a scale of 0 to 255
+    :return: colors packed into little endian uint32 pixels, whose first three bytes are R, G, B
+    """
+    rgb = np.asarray(rgb).astype(np.uint32)
+    return rgb[..., 0] | (rgb[..., 1] << 8) | (rgb[..., 2] << 16)
+
+
+class SnapshotRenderer:
+    """
+    Draws the pictures of Ring.plot_network and DynamicRing.plot_network from the arrays of a topology. The edges
+    are computed once per snapshot and every requested color view is cut out of them with a mask. Edges are drawn
+    as one LineCollection and nodes as one scatter with an RGB array, on one figure that is reused across snapshots.
+
+    In raster mode nothing goes through matplotlib artists: edges are sampled pixel by pixel into a NumPy canvas and
+    the canvas is written as it is, which keeps graphs of 10^5 nodes fast. Use a .png file name then.
+    """
+
+    def __init__(self, raster=False, width=640, height=480, dpi=100):
+        """
+        Initializer
+        :param raster: if true draw into a NumPy canvas instead of a matplotlib figure
+        :param width: width of the picture in pixels
+        :param height: height of the picture in pixels
+        :param dpi: resolution of the matplotlib figure
+        """
+        self.raster = raster
+        self.width = width
+        self.height = height
+        if raster:
+            return
+        self.figure = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+        self.lines = LineCollection([], linewidths=1.0, zorder=1)
+        self.axes.add_collection(self.lines)
+        self.points = self.axes.scatter(np.empty(0), np.empty(0), s=5, zorder=2)
+        self.axes.tick_params(bottom=False, left=False, labelbottom=False, labelleft=False)
+        self.axes.grid(True)
+
+    def render(self, topology, outputs):
+        """
+        Draw and save several color views of one topology
+        :param topology: anything with position, rgb, color_code and neighbors arrays, a NodeStore or a Snapshot
+        :param outputs: list of (color, image file name). A color view shows the nodes of that color, their neighbors
+                        and the edges leaving nodes of that color, drawn in that color. None shows every node and
+                        colors every edge like its source node.
+        :return: None
+        """
+        position = np.asarray(topology.position, dtype=np.float64)
+        rgb = np.asarray(topology.rgb)
+        color_code = np.asarray(topology.color_code)
+        sources, targets = edge_arrays(np.asarray(topology.neighbors))
+
+        for color, image_file_name in outputs:
+            if color is None:
+                shown = np.ones(len(position), dtype=bool)
+                edges = slice(None)
+                edge_rgb = rgb[sources]
+            else:
+                code = NodeStore.encode_colors([color])[0]
+                shown = color_code == code
+                edges = shown[sources]
+                shown[targets[edges]] = True
+                edge_rgb = np.array(to_rgb(color)) * 255
+            segments = np.stack((position[sources[edges]], position[targets[edges]]), axis=1)
+            nodes = np.flatnonzero(shown)
+            if self.raster:
+                self.save_raster(segments, edge_rgb, position[nodes], rgb[nodes], position, image_file_name)
+            else:
+                self.save_figure(segments, edge_rgb, position[nodes], rgb[nodes], image_file_name)
+
+    def save_figure(self, segments, edge_rgb, points, point_rgb, image_file_name):
+        self.lines.set_segments(segments)
+        self.lines.set_color(np.asarray(edge_rgb, dtype=np.float64).reshape(-1, 3) / 255)
+        self.points.set_offsets(points)
+        self.points.set_facecolor(np.asarray(point_rgb, dtype=np.float64) / 255)
+        self.points.set_edgecolor("face")
+        if len(points):
+            low, high = points.min(axis=0), points.max(axis=0)
+            margin = np.maximum((high - low) * 0.05, 1e-9)
+            self.axes.set_xlim(low[0] - margin[0], high[0] + margin[0])
+            self.axes.set_ylim(low[1] - margin[1], high[1] + margin[1])
+        self.canvas.print_figure(image_file_name)
+
+    def pixels(self, xy, low, scale):
+        """
+        :return: float column and row of points, y grows upwards like in the figure
+        """
+        column = (xy[..., 0] - low[0]) * scale + self.width * 0.05
+        row = self.height - 1 - ((xy[..., 1] - low[1]) * scale + self.height * 0.05)
+        return column, row
+
+    def save_raster(self, segments, edge_rgb, points, point_rgb, position, image_file_name):
+        # one uint32 per pixel, so a pixel is written with a single store
+        canvas = np.full(self.height * self.width, 0xFFFFFF, dtype=np.uint32)
+        low, high = position.min(axis=0), position.max(axis=0)
+        extent = np.maximum(high - low, 1e-9)
+        scale = min(self.width * 0.9 / extent[0], self.height * 0.9 / extent[1])
+
+        column, row = self.pixels(segments, low, scale)
+        column, row = column.astype(np.float32), row.astype(np.float32)
+        edge_color = pack(edge_rgb)
+        steps = np.ceil(np.maximum(np.abs(column[:, 1] - column[:, 0]), np.abs(row[:, 1] - row[:, 0]))).astype(np.int64)
+        column_step = (column[:, 1] - column[:, 0]) / np.maximum(steps, 1)
+        row_step = (row[:, 1] - row[:, 0]) / np.maximum(steps, 1)
+        samples = np.cumsum(steps + 1)
+        start = 0
+        while start < len(segments):
+            # bound the samples held at once, long edges of an unconverged graph add up quickly
+            offset = samples[start - 1] if start else 0
+            end = max(int(np.searchsorted(samples, offset + RASTER_SAMPLES, side="right")), start + 1)
+            counts = steps[start:end] + 1
+            edge = np.repeat(np.arange(start, end), counts)
+            t = np.arange(len(edge), dtype=np.float32)
+            t -= np.repeat((samples[start:end] - counts - offset).astype(np.float32), counts)
+            x = (column[edge, 0] + t * column_step[edge] + 0.5).astype(np.int64)
+            y = (row[edge, 0] + t * row_step[edge] + 0.5).astype(np.int64)
+            canvas[y * self.width + x] = edge_color if edge_color.ndim == 0 else edge_color[edge]
+            start = end
+
+        x, y = self.pixels(points, low, scale)
+        x, y = np.rint(x).astype(np.int64), np.rint(y).astype(np.int64)
+        point_color = pack(point_rgb)
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                canvas[np.clip(y + dy, 0, self.height - 1) * self.width + np.clip(x + dx, 0, self.width - 1)] = \
+                    point_color
+        image = canvas.view(np.uint8).reshape(self.height, self.width, 4)[:, :, :3]
+        imsave(image_file_name, image)
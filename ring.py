@@ -1,22 +1,115 @@
 import math
-import matplotlib.pyplot as plt
 import random
-import networkx as nx
+import numpy as np
 
+import color_space
+from gossip_engine import BatchedGossipEngine
+from metrics import count_changes
 from node import Node
+from node_store import NodeStore
+from ranking import get_ranking
+from sharded import ShardedGossipEngine
+from snapshot_writer import SnapshotWriter, take_snapshot
+from simulation import EpochDelta, SnapshotFiles
+from trajectory import TrajectoryWriter, topology_arrays
 from utils import Utils
 
 
 class Ring:
-    def __init__(self, num_nodes, k, epochs):
+    def __init__(self, num_nodes, k, epochs, use_store=False, engine="python", one_way=False,
+                 distance_cache=None, synchronous=True, seed=None, output=True, snapshot_workers=0,
+                 trajectory=None, raster=False, monitor=None, churn=None, workers=None, ranking="lab",
+                 subscribers=None, run=True, checkpoint=None, output_dir=None, plot=True,
+                 snapshot_every=5, scheduler=None, sampling=None):
+        """
+        Initializer
+        :param num_nodes: number of nodes on the ring
+        :param k: number of neighbors
+        :param epochs: number of gossip cycles
+        :param use_store: if true keep the topology in a struct-of-arrays NodeStore, self.nodes then holds views
+        :param engine: "python" to run exchanges one at a time, "batched" to run whole cycles with
+                       BatchedGossipEngine, "sharded" to run them in worker processes with ShardedGossipEngine
+                       (both imply use_store)
+        :param one_way: if true only the receiving neighbor updates its neighbors list in an exchange
+        :param synchronous: update semantics of the batched engine, see BatchedGossipEngine
+        :param distance_cache: memory budget in bytes of a LabDistanceCache kept by the store (implies use_store)
+        :param seed: seed of the run, the same seed reproduces the same topology
+        :param output: if false skip all plots and text files
+        :param snapshot_workers: number of background processes that render and write the snapshots, 0 to write them
+                                 inside the gossip loop
+        :param trajectory: file name of a binary trajectory that records the neighbor matrix of every epoch, the
+                           snapshot text files are not written then, see trajectory.py
+        :param raster: if true render the snapshot graphs as PNG files from a NumPy canvas, see SnapshotRenderer
+        :param monitor: a ConvergenceMonitor that records the metrics of every epoch, the evolution stops early once
+                        it reports convergence
+        :param churn: a Churn that lets nodes depart and crash while the network evolves, see churn.py
+        :param workers: number of worker processes of the sharded engine, one per core by default
+        :param ranking: name of the ranking function nodes rank each other by, see ranking.py. "lab" is the Lab
+                        distance of the assignment, which also uses the distance memo, cache and join index
+        :param subscribers: output sinks notified after every epoch, see simulation.py
+        :param run: if true run the whole evolution before returning, otherwise nothing runs until run or stream is
+                    called. Either way the plots and text files of the assignment are written unless output is false.
+        :param checkpoint: a Checkpoint to continue from instead of building a random network, see checkpoint.py
+        :param output_dir: directory of the plots and text files, the assignment's directory in the home directory by
+                           default
+        :param plot: if false write only the text files, matplotlib is then never imported
+        :param snapshot_every: epochs between two snapshots, they are also written at epoch 1 and when a run stops early
+        :param scheduler: an ActiveSet that lets only the nodes whose views still change initiate in every cycle, see
+                          scheduler.py
+        :param sampling: a PeerSampling that mixes a few random peers into every merge of neighbor lists, see
+                         peer_sampling.py
+        """
         self.num_nodes = num_nodes
         self.epochs = epochs + 1
         self.nodes = []
         self.k = k
         self.counter = 0
-        self.build_nodes()
-        self.initialise_network_of_nodes()
-        self.evolve_network()
+        self.one_way = one_way
+        self.output = output
+        self.output_dir = output_dir or Utils.get_homework_directory()
+        self.plot = plot
+        self.rng = np.random.default_rng(seed)
+        self.random = random.Random(seed)
+        self.ranking = get_ranking(ranking) if ranking != "lab" else None
+        if use_store or engine != "python" or distance_cache is not None:
+            self.store = NodeStore(k, distance_cache, self.ranking)
+        else:
+            self.store = None
+        self.engine = None
+        if engine == "batched":
+            self.engine = BatchedGossipEngine(self.store, one_way, synchronous, self.rng)
+        elif engine == "sharded":
+            self.engine = ShardedGossipEngine(self.store, workers, one_way, self.rng)
+        self.raster = raster
+        self.renderer = None
+        self.writer = SnapshotWriter(snapshot_workers) if output and snapshot_workers else None
+        if checkpoint is None:
+            self.build_nodes()
+            self.initialise_network_of_nodes()
+        else:
+            checkpoint.restore_nodes(self)
+        self.monitor = monitor
+        self.scheduler = scheduler
+        self.churn = churn
+        if churn is not None:
+            churn.attach(self)
+        self.sampling = sampling
+        if sampling is not None:
+            sampling.attach(self)
+        self.epochs_run = 0
+        self.trajectory = None
+        if trajectory is not None:
+            color_code, lab, _ = topology_arrays(self.store, self.nodes, k)
+            self.trajectory = TrajectoryWriter(trajectory, color_code, lab, k, seed)
+        if checkpoint is not None:
+            checkpoint.restore_state(self)
+        self.stopped = False
+        self.closed = False
+        self.subscribers = list(subscribers or [])
+        if output:
+            self.subscribers.append(SnapshotFiles(snapshot_every))
+        if run:
+            self.run()
 
     def get_color_count(self, groups):
         """
@@ -27,57 +120,40 @@ class Ring:
                                               range(groups)]
         return red_count, green_count, blue_count
 
-    def get_nodes_color_randomized(self, groups, points_set: set):
+    def get_nodes_color_randomized(self, groups, points):
         """
         get random colored nodes from red green and blue
         :param groups: number of color groups
-        :param points_set: a set of points with a specified x,y position on the topology curve
-        :return: colored nodes
+        :param points: (N, 2) array of points with a specified x,y position on the topology curve
+        :return: shuffled points, (N, 3) array of redness, greenness, blueness and the color labels;
+                 red nodes come first, then green, then blue
         """
-        red, green, blue = self.get_color_count(groups)
-        points_colored = []
-
-        for i in range(red):
-            red_point = random.choice(tuple(points_set))
-            r, g, b, color = Utils.get_red_color()
-            points_colored.append((red_point, r, g, b, color))
-            points_set.remove(red_point)
-
-        for i in range(green):
-            green_point = random.choice(tuple(points_set))
-            r, g, b, color = Utils.get_green_color()
-            points_colored.append((green_point, r, g, b, color))
-            points_set.remove(green_point)
-
-        for i in range(blue):
-            blue_point = random.choice(tuple(points_set))
-            r, g, b, color = Utils.get_blue_color()
-            points_colored.append((blue_point, r, g, b, color))
-            points_set.remove(blue_point)
-
-        return points_colored
+        colors = np.repeat(["red", "green", "blue"], self.get_color_count(groups))
+        rgb = Utils.sample_colors(self.rng, colors)
+        return points[self.rng.permutation(len(points))], rgb, colors.tolist()
 
     def build_nodes(self):
         """
         build the topology with user input number of nodes on a ring
         :return:
         """
-        theta = [2 * math.pi / self.num_nodes * i for i in range(self.num_nodes)]
-        co_ordinates = set((math.cos(t), math.sin(t)) for t in theta)
+        theta = 2 * math.pi / self.num_nodes * np.arange(self.num_nodes)
+        co_ordinates = np.column_stack((np.cos(theta), np.sin(theta)))
 
-        colored_nodes = self.get_nodes_color_randomized(3, co_ordinates)
-        points, red, green, blue, color = zip(*colored_nodes)
+        points, rgb, color = self.get_nodes_color_randomized(3, co_ordinates)
+        lab = color_space.rgb_to_lab(rgb)
 
-        X, Y, Z = Utils.transform_rgb_to_xyz(red, green, blue)
-        l, a, b = Utils.transform_xyz_to_cie_l_ab(X, Y, Z)
+        if self.store is not None:
+            self.nodes = self.store.add_nodes(points, rgb, lab, color)
+            return
 
+        points, rgb, lab = points.tolist(), rgb.tolist(), lab.tolist()
         for i in range(0, self.num_nodes):
             node = Node(i, points[i][0], points[i][1])
-            node.l_distance = l[i]
-            node.a_distance = a[i]
-            node.b_distance = b[i]
-            node.r_g_b = [red[i], green[i], blue[i]]
+            node.l_distance, node.a_distance, node.b_distance = lab[i]
+            node.r_g_b = rgb[i]
             node.color = color[i]
+            node.ranking = self.ranking
             self.nodes.append(node)
 
     def initialise_network_of_nodes(self):
@@ -85,10 +161,13 @@ class Ring:
         Initiate network building
         :return:
         """
-        for i in range(self.num_nodes):
-            node = self.nodes[i]
-            neighbors = Utils.select_k_neighbors(node, self.nodes, self.k)
-            node.neighbors = neighbors
+        neighbor_ids = Utils.select_k_neighbors_batch(self.rng, self.num_nodes, self.k)
+        if self.store is not None:
+            self.store.neighbors[:] = neighbor_ids
+            return
+
+        for node, row in zip(self.nodes, neighbor_ids.tolist()):
+            node.neighbors = [self.nodes[j] for j in row]
 
     def communicate(self, node, one_way=False):
         """
@@ -97,76 +176,215 @@ class Ring:
         :param one_way: if true initiate only a one-sided communication otherwise a two-way communication
         :return:
         """
-        random_neighbor = node.select_random_neighbor(self.k)
+        if self.churn is None:
+            random_neighbor = node.select_random_neighbor(self.k, self.random)
+        else:
+            random_neighbor = self.churn.contact(self, node)
+            if random_neighbor is None:
+                return
 
         current_node_identifiers = node.get_identifiers() + [node]
         if not one_way:
             random_neighbor_identifiers = random_neighbor.get_identifiers() + [random_neighbor]
+            if self.sampling is not None:
+                random_neighbor_identifiers += self.sampling.sample_nodes(self, node)
             node.update_neighbors(random_neighbor_identifiers, self.k)
 
+        if self.sampling is not None:
+            current_node_identifiers += self.sampling.sample_nodes(self, random_neighbor)
         random_neighbor.update_neighbors(current_node_identifiers, self.k)
+        if self.churn is not None:
+            self.churn.track(node)
+            self.churn.track(random_neighbor)
 
-    def evolve_network(self):
+    def gossip_cycle(self):
         """
-        Network evolution
+        Every node initiates one communication, only the nodes it picks when there is a scheduler
         :return:
         """
-        network_color_file_name = Utils.get_homework_directory() + "/R_N{}_k{}.txt".format(self.num_nodes, self.k)
-        Utils.write_network_color_to_file(self.nodes, network_color_file_name)
-        for i in range(1, self.epochs):
-            for j in range(self.num_nodes):
-                self.communicate(self.nodes[j])
-            if i % 5 == 0 or i == 1:
-                colors = ["red", "green", "blue"]
-                for color in colors:
-                    image_file_name = Utils.get_homework_directory() + "/R_N{}_k{}_{}_{}.jpg".format(self.num_nodes,
-                                                                                                     self.k,
-                                                                                                     color, i)
-                    self.plot_network(color, image_file_name)
-                    file_name = Utils.get_homework_directory() + "/R_N{}_k{}_{}_{}.txt".format(self.num_nodes, self.k,
-                                                                                               color,
-                                                                                               i)
-                    Utils.write_network_topology_to_file(self.nodes, file_name)
+        initiators = None if self.churn is None else self.churn.live()
+        if self.scheduler is not None:
+            initiators = self.scheduler.select(self, initiators)
+        if self.sampling is not None:
+            self.sampling.shuffle(self)
+        if self.engine is not None:
+            self.engine.run_cycle(initiators)
+            if self.churn is not None:
+                self.churn.collect_timeouts(self)
+            return
+        for j in range(self.num_nodes) if initiators is None else initiators.tolist():
+            self.communicate(self.nodes[j], self.one_way)
 
-    def plot_network(self, color, image_file_name):
+    def run(self):
         """
-        Visualising the network at current instant of time.
-        :param color: color of interest in visualizing
-        :param image_file_name: a file to capture the network snapshot
+        Run the whole evolution, then release the workers and files of the run
+        :return: self
+        """
+        try:
+            self.evolve_network()
+        finally:
+            self.close()
+        return self
+
+    def evolve_network(self):
+        """
+        Network evolution, until the epochs run out or the monitor reports convergence
         :return:
         """
-        nodes = set(filter(lambda x: x.color == color, self.nodes))
-        node_neighbors = set([nei for node in nodes for nei in node.neighbors])
+        for _ in self.advance():
+            pass
+
+    def advance(self):
+        """
+        Lazy network evolution: every item pulled runs one epoch, records it and notifies the subscribers. Epoch 0 is
+        the initial topology, a run resumed from a checkpoint starts after the epoch of the checkpoint.
+        :return: generator of the epochs that ran
+        """
+        if self.epochs_run == 0:
+            self.record_epoch(0)
+            self.notify(0)
+            yield 0
+        for i in range(self.epochs_run + 1, self.epochs):
+            if self.churn is not None:
+                self.churn.apply(self, i)
+            self.gossip_cycle()
+            self.record_epoch(i)
+            self.epochs_run = i
+            self.stopped = self.monitor is not None and self.monitor.converged()
+            self.notify(i)
+            yield i
+            if self.stopped:
+                break
+
+    def stream(self):
+        """
+        Lazy network evolution that yields what changed: the delta of an epoch holds the rows of the neighbor matrix
+        that differ from the epoch before, so a consumer keeps at most one matrix however long the run, see
+        apply_delta. The run is closed once the stream is exhausted or closed.
+        :return: generator of EpochDelta
+        """
+        previous = np.full((0, self.k), -1, dtype=np.int32)
+        try:
+            for epoch in self.advance():
+                neighbors = np.array(topology_arrays(self.store, self.nodes, self.k)[2], dtype=np.int32)
+                rows, _ = count_changes(previous, neighbors)
+                changed = neighbors[rows]
+                changed.flags.writeable = False
+                yield EpochDelta(epoch, len(neighbors), rows, changed)
+                previous = neighbors
+        finally:
+            self.close()
+
+    def notify(self, i):
+        for subscriber in self.subscribers:
+            subscriber.on_epoch(self, i)
+
+    def close(self):
+        """
+        Close the subscribers, then release the engine workers, snapshot writers and trajectory file of the run
+        :return: None
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            for subscriber in self.subscribers:
+                subscriber.close()
+        finally:
+            if self.engine is not None:
+                self.engine.close()
+            if self.writer is not None:
+                self.writer.close()
+            if self.trajectory is not None:
+                self.trajectory.close()
 
-        all_nodes = nodes.union(node_neighbors)
+    def record_epoch(self, i):
+        """
+        Append the neighbor matrix of the current epoch to the trajectory and the monitor, if there are any
+        :param i: the current epoch
+        :return:
+        """
+        if self.trajectory is None and self.monitor is None:
+            return
+        color_code, lab, neighbors = topology_arrays(self.store, self.nodes, self.k)
+        if self.trajectory is not None:
+            self.trajectory.record(i, color_code, lab, neighbors)
+        if self.monitor is not None:
+            self.monitor.update(i, color_code if self.churn is None else self.churn.mask(color_code), neighbors)
 
-        rgb, X, Y = [], [], []
-        position = {}
-        color_map = []
+    def write_snapshot(self, i):
+        """
+        Plot and write the topology of every color at the current epoch, in the background when there is a writer.
+        Nothing is plotted when plot is false.
+        :param i: the current epoch
+        :return:
+        """
+        colors = ["red", "green", "blue"]
+        extension = "png" if self.raster else "jpg"
+        outputs = [(color,
+                    self.output_dir + "/R_N{}_k{}_{}_{}.{}".format(self.num_nodes, self.k, color, i, extension)
+                    if self.plot else None,
+                    None if self.trajectory is not None else
+                    self.output_dir + "/R_N{}_k{}_{}_{}.txt".format(self.num_nodes, self.k, color, i))
+                   for color in colors]
+        if self.writer is not None:
+            self.writer.submit(take_snapshot(self.store, self.nodes, self.k), outputs, self.raster)
+            return
+        if self.plot:
+            self.plot_views([(color, image_file_name) for color, image_file_name, _ in outputs])
+        for _, _, file_name in outputs:
+            if file_name is not None:
+                self.write_network_topology(file_name)
 
-        for node in all_nodes:
-            rgb.append(node.r_g_b)
-            X.append(node.position.x)
-            Y.append(node.position.y)
-            position[node.id] = (node.position.x, node.position.y)
-            color_map.append(Utils.convert_to_hex(tuple(node.r_g_b)))
+    def write_colors(self):
+        """
+        Write the node colors of the initial topology
+        :return: None
+        """
+        self.write_network_color(self.output_dir + "/R_N{}_k{}.txt".format(self.num_nodes, self.k))
 
-        edges = [(node.id, nei.id) for node in nodes for nei in node.neighbors]
+    def write_network_color(self, file_name):
+        """
+        Write node colors, through the store when there is one
+        :param file_name: a file to capture the colored network snapshot
+        :return:
+        """
+        if self.store is not None:
+            Utils.write_store_color_to_file(self.store, file_name)
+        else:
+            Utils.write_network_color_to_file(self.nodes, file_name)
 
-        graph = nx.Graph()
-        for key, value in position.items():
-            graph.add_node(key, pos=value)
-        graph.add_edges_from(edges)
+    def write_network_topology(self, file_name):
+        """
+        Write the neighbor lists, through the store when there is one
+        :param file_name: a file to capture the network snapshot
+        :return:
+        """
+        if self.store is not None:
+            Utils.write_store_topology_to_file(self.store, file_name)
+        else:
+            Utils.write_network_topology_to_file(self.nodes, file_name)
 
-        pos = nx.get_node_attributes(graph, 'pos')
-        nx.draw_networkx(graph, pos, node_color=color_map, node_size=5, with_labels=False, edge_color=color)
-        plt.grid('on')
-        plt.savefig(image_file_name)
-        # print("{} node graph is connected".format(color)) if nx.is_connected(graph) else print(
-        #     "{} node graph is disconnected".format(color))
+    def plot_network(self, color, image_file_name):
+        """
+        Visualising the network at current instant of time.
+        :param color: color of interest in visualizing
+        :param image_file_name: a file to capture the network snapshot
+        :return:
+        """
+        self.plot_views([(color, image_file_name)])
 
-        graph.clear()
-        plt.clf()
+    def plot_views(self, views):
+        """
+        Draw several color views of the current topology from one pass over the neighbor lists, see SnapshotRenderer
+        :param views: list of (color, image file name)
+        :return:
+        """
+        if self.renderer is None:
+            from renderer import SnapshotRenderer
+            self.renderer = SnapshotRenderer(self.raster)
+        topology = self.store if self.store is not None else take_snapshot(nodes=self.nodes, k=self.k)
+        self.renderer.render(topology, views)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+import argparse
+import sys
+
+import numpy as np
+
+from trajectory import topology_arrays
+
+STATS = ("cycles", "exchanges", "skipped", "woken")
+
+
+class ActiveSet:
+    """
+    Adaptive gossip schedule: nodes whose views are still changing initiate an exchange in every cycle, stable nodes
+    only every few cycles.
+
+    A node is active for patience cycles after its view or the view of one of its neighbors changed, the cases where
+    its exchanges can still turn up new candidates. Changes are found by comparing the neighbor matrix with the one
+    of the previous cycle, so every kind of change wakes the nodes it affects before the next cycle: exchanges,
+    nodes joining a DynamicRing, departures and crashes. A stable node still initiates once every period cycles,
+    staggered by id, so it keeps handing its view to nodes that may need it.
+    """
+
+    def __init__(self, patience=2, period=4):
+        """
+        Initializer
+        :param patience: cycles a node stays active after a change that affects it
+        :param period: a stable node initiates once every period cycles
+        """
+        self.patience = patience
+        self.period = period
+        self.quiet = np.zeros(0, dtype=np.int64)
+        self.previous = None
+        self.stats = dict.fromkeys(STATS, 0)
+
+    def select(self, topology, initiators=None):
+        """
+        Pick the nodes that initiate an exchange in the next cycle
+        :param topology: the Ring or DynamicRing about to run a cycle
+        :param initiators: ids of the nodes that may initiate, e.g. the live nodes under churn, all nodes if None
+        :return: ids of the initiators of the cycle, in order
+        """
+        neighbors = np.array(topology_arrays(topology.store, topology.nodes, topology.k)[2], dtype=np.int32)
+        self.wake(neighbors)
+        ids = np.arange(len(neighbors)) if initiators is None else np.asarray(initiators, dtype=np.int64)
+        turn = (ids + self.stats["cycles"]) % self.period == 0
+        selected = ids[(self.quiet[ids] < self.patience) | turn]
+        self.stats["cycles"] += 1
+        self.stats["exchanges"] += len(selected)
+        self.stats["skipped"] += len(ids) - len(selected)
+        self.previous = neighbors
+        return selected
+
+    def wake(self, neighbors):
+        """
+        Age every node by one cycle and make the nodes affected by a change since the previous cycle active: the
+        nodes whose row changed or is new, and the nodes pointing to one of them
+        :param neighbors: (N, k) neighbor matrix before the next cycle
+        :return: None
+        """
+        self.quiet += 1
+        known = len(self.quiet)
+        if len(neighbors) > known:
+            self.quiet = np.concatenate((self.quiet, np.zeros(len(neighbors) - known, dtype=np.int64)))
+        changed = np.ones(len(neighbors), dtype=bool)
+        if self.previous is not None:
+            changed[:known] = (neighbors[:known] != self.previous).any(axis=1)
+        if not changed.any():
+            return
+        woken = changed | (changed[np.maximum(neighbors, 0)] & (neighbors >= 0)).any(axis=1)
+        self.stats["woken"] += int((woken & (self.quiet >= self.patience)).sum())
+        self.quiet[woken] = 0
+
+    def report(self):
+        """
+        :return: one line with the exchanges run and skipped
+        """
+        total = self.stats["exchanges"] + self.stats["skipped"]
+        return "scheduler: {} exchanges, {} skipped ({:.1%}), {} nodes woken up over {} cycles".format(
+            self.stats["exchanges"], self.stats["skipped"], self.stats["skipped"] / max(total, 1), self.stats["woken"],
+            self.stats["cycles"])
+
+
+def view_quality(topology):
+    """
+    :param topology: a Ring or DynamicRing
+    :return: mean Lab distance of a node to its neighbors, what T-Man minimizes, and the fraction of edges between
+             nodes of the same color
+    """
+    color_code, lab, neighbors = topology_arrays(topology.store, topology.nodes, topology.k)
+    present = neighbors >= 0
+    ids = np.maximum(neighbors, 0)
+    distance = np.sqrt(((lab[ids] - lab[:, None, :]) ** 2).sum(axis=2))
+    same = color_code[ids] == color_code[:, None]
+    return float(distance[present].mean()), float(same[present].mean())
+
+
+def compare(make_topology, tolerance=0.01):
+    """
+    Correctness mode: run the same topology with full scheduling and with an ActiveSet and compare the quality of
+    the final views
+    :param make_topology: make_topology(scheduler) builds and runs a topology, scheduler is None for full scheduling
+    :param tolerance: relative excess of the mean neighbor distance, and absolute loss of the same-color fraction,
+                      that still counts as a match
+    :return: (quality of the full run, quality of the active-set run, the ActiveSet, whether they match)
+    """
+    full = view_quality(make_topology(None))
+    scheduler = ActiveSet()
+    active = view_quality(make_topology(scheduler))
+    match = active[0] <= full[0] * (1 + tolerance) and active[1] >= full[1] - tolerance
+    return full, active, scheduler, match
+
+
+def main():
+    from dynamic_ring import DynamicRing
+    from ring import Ring
+
+    parser = argparse.ArgumentParser(description="Check that active-set scheduling reaches the quality of full "
+                                                 "scheduling, and count the exchanges it skips")
+    parser.add_argument("--n", type=int, default=1000, help="number of nodes")
+    parser.add_argument("--k", type=int, default=10, help="number of neighbors")
+    parser.add_argument("--epochs", type=int, default=40, help="epochs of a ring")
+    parser.add_argument("--radii", type=int, nargs="*", default=[], help="run a dynamic ring with these radii")
+    parser.add_argument("--engine", choices=["python", "batched", "sharded"], default="batched")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--tolerance", type=float, default=0.01)
+    args = parser.parse_args()
+
+    failed = 0
+    for seed in args.seeds:
+        def make_topology(scheduler):
+            options = dict(engine=args.engine, seed=seed, output=False, scheduler=scheduler)
+            if args.radii:
+                return DynamicRing(args.n, args.k, len(args.radii), args.radii, **options)
+            return Ring(args.n, args.k, args.epochs, **options)
+
+        full, active, scheduler, match = compare(make_topology, args.tolerance)
+        failed += not match
+        print("seed {}: mean neighbor distance {:.4f} full, {:.4f} active set; same color {:.4f} full, {:.4f} "
+              "active set; {}".format(seed, full[0], active[0], full[1], active[1], "ok" if match else "MISMATCH"))
+        print("  " + scheduler.report(), flush=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
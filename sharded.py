@@ -0,0 +1,318 @@
+import argparse
+import multiprocessing
+import time
+from multiprocessing.shared_memory import SharedMemory
+from threading import BrokenBarrierError
+
+import numpy as np
+
+from gossip_engine import BatchedGossipEngine
+from ranking import get_ranking
+
+GOLDEN = 0x9E3779B97F4A7C15
+MASK = (1 << 64) - 1
+
+
+def mix(z):
+    """
+    SplitMix64 finalizer
+    :param z: uint64 array
+    :return: uint64 array of hashed values
+    """
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def node_draws(seed, cycle, ids):
+    """
+    Uniform draws that only depend on the seed, the cycle and the node, so the partners of a cycle are the same
+    however the nodes are sharded
+    :param seed: seed of the run, a non-negative integer
+    :param cycle: number of the cycle
+    :param ids: ids of the nodes
+    :return: one draw in [0, 1) per node
+    """
+    salt = mix(np.array([seed & MASK], dtype=np.uint64))
+    salt = mix(salt + np.uint64(cycle & MASK))
+    z = mix(np.asarray(ids).astype(np.uint64) * np.uint64(GOLDEN) + salt)
+    return (z >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+
+class SharedArrays:
+    """
+    The arrays of a sharded cycle, each in its own shared memory block: Lab coordinates, positions, two (N, k)
+    neighbor buffers, the partner, initiator and liveness of every node and a control word. Also serves as the store
+    the engine of a worker reads the ranking, its features and k from.
+    """
+
+    SPECS = [("lab", 3, np.float64), ("position", 2, np.float64), ("front", None, np.int32), ("back", None, np.int32),
+             ("partners", 1, np.int64), ("active", 1, np.bool_), ("alive", 1, np.bool_)]
+
+    def __init__(self, num_nodes, k, names=None, ranking=None):
+        """
+        Initializer
+        :param num_nodes: number of nodes
+        :param k: number of neighbors
+        :param names: names of the blocks to attach to, new blocks are created if None
+        :param ranking: name of the ranking function, None for Lab distance
+        """
+        self.k = k
+        self.ranking = None if ranking is None else get_ranking(ranking)
+        self.distance_cache = None
+        self.neighbors = None
+        self.blocks = {}
+        specs = self.SPECS + [("control", 0, np.int64)]
+        for name, width, dtype in specs:
+            shape = (1,) if width == 0 else (num_nodes,) if width == 1 else (num_nodes, width or k)
+            size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            block = SharedMemory(create=True, size=size) if names is None else SharedMemory(name=names[name])
+            self.blocks[name] = block
+            setattr(self, name, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+
+    def __len__(self):
+        return len(self.lab)
+
+    def names(self):
+        return {name: block.name for name, block in self.blocks.items()}
+
+    def buffers(self, cycle):
+        """
+        :param cycle: number of the cycle
+        :return: the neighbor buffer the cycle reads and the one it writes
+        """
+        return (self.front, self.back) if cycle % 2 == 0 else (self.back, self.front)
+
+    def close(self, unlink=False):
+        """
+        Detach from the blocks, the arrays must not be used afterwards
+        :param unlink: if true also free the blocks, done once by the process that created them
+        :return: None
+        """
+        for name in self.blocks:
+            setattr(self, name, None)
+        self.neighbors = None
+        for block in self.blocks.values():
+            try:
+                block.close()
+            except BufferError:
+                # a view is still referenced somewhere, the memory is freed with the last view
+                pass
+            if unlink:
+                block.unlink()
+        self.blocks = {}
+
+
+def run_shard(names, num_nodes, k, ranking, one_way, seed, low, high, barrier):
+    """
+    Worker loop of one shard, the nodes low..high - 1, until the control word is below 0
+    """
+    shared = SharedArrays(num_nodes, k, names, ranking)
+    engine = BatchedGossipEngine(shared, one_way)
+    try:
+        while True:
+            barrier.wait()
+            cycle = int(shared.control[0])
+            if cycle < 0:
+                break
+            shard_cycle(engine, shared, cycle, seed, low, high, barrier)
+    except BaseException:
+        barrier.abort()
+        raise
+    finally:
+        engine = None
+        shared.close()
+
+
+def shard_cycle(engine, shared, cycle, seed, low, high, barrier):
+    """
+    One cycle of a shard, in two phases separated by barriers:
+    1. pick the partner of every initiator of the shard from the read buffer
+    2. apply every exchange with an end in the shard to the rows of the shard, reading only the read buffer, and
+       write the rows of the shard into the write buffer
+    """
+    current, following = shared.buffers(cycle)
+    shared.neighbors = current
+    engine.alive = shared.alive
+    own = np.flatnonzero(shared.active[low:high]) + low
+    shared.partners[own] = engine.pick_partners(own, node_draws(seed, cycle, own))
+    barrier.wait()
+
+    partners = shared.partners
+    touching = (partners >= low) & (partners < high)
+    touching[low:high] = True
+    initiators = np.flatnonzero(shared.active & touching)
+    targets, sources = engine.offers(initiators, partners[initiators])
+    engine.timeouts.clear()
+    mine = (targets >= low) & (targets < high)
+    following[low:high] = current[low:high]
+    if mine.any():
+        rows, ids, _ = engine.combine(current, targets[mine], sources[mine])
+        following[rows] = ids
+    shared.neighbors = engine.alive = None
+    barrier.wait()
+
+
+class ShardedGossipEngine:
+    """
+    Runs gossip cycles over a NodeStore in worker processes, each owning a contiguous shard of node ids. The Lab
+    array and the neighbor matrix live in shared memory, so workers read the views of nodes in other shards without
+    copying them; between cycles the store's neighbor matrix is the shared buffer itself.
+
+    Consistency model, epoch double-buffering: a cycle reads one neighbor buffer and writes the other, and the two
+    swap after every cycle. Every exchange of a cycle reads the views as they were at its start, also across
+    shards, and a node touched by several exchanges keeps the k nearest of the union of everything it was offered.
+    This is the synchronous mode of BatchedGossipEngine. Only the owner of a row writes it, so no locks are needed,
+    and partners are drawn from a hash of the seed, the cycle and the node, so the result does not depend on the
+    number of workers.
+
+    Every worker scans the partner array once per cycle to find the exchanges that reach into its shard, O(N) per
+    worker, which is small next to the exchanges themselves.
+    """
+
+    def __init__(self, store, workers=None, one_way=False, rng=None):
+        """
+        Initializer
+        :param store: the NodeStore holding Lab coordinates and the neighbor matrix
+        :param workers: number of worker processes, one per core by default
+        :param one_way: if true only the receiving neighbor updates its neighbors list
+        :param rng: a numpy random Generator the seed of the partner draws is taken from
+        """
+        self.store = store
+        self.workers = workers or multiprocessing.cpu_count()
+        self.one_way = one_way
+        rng = rng if rng is not None else np.random.default_rng()
+        self.seed = int(rng.integers(0, 2 ** 63))
+        self.alive = None
+        self.timeouts = []
+        self.written = None
+        self.cycle = 0
+        self.shared = None
+        self.processes = []
+        self.barrier = None
+
+    def start(self):
+        """
+        Copy the Lab and position arrays into shared memory and start one worker per shard
+        :return: None
+        """
+        num_nodes = len(self.store)
+        ranking = None if self.store.ranking is None else self.store.ranking.name
+        self.shared = SharedArrays(num_nodes, self.store.k, ranking=ranking)
+        self.shared.lab[:] = self.store.lab
+        self.shared.position[:] = self.store.position
+        workers = max(1, min(self.workers, num_nodes))
+        bounds = np.linspace(0, num_nodes, workers + 1).astype(np.int64).tolist()
+        context = multiprocessing.get_context()
+        self.barrier = context.Barrier(workers + 1)
+        self.processes = [context.Process(target=run_shard, daemon=True,
+                                          args=(self.shared.names(), num_nodes, self.store.k, ranking, self.one_way,
+                                                self.seed, bounds[i], bounds[i + 1], self.barrier))
+                          for i in range(workers)]
+        for process in self.processes:
+            process.start()
+
+    def prepare(self):
+        """
+        Make the read buffer of the next cycle hold the store's neighbor matrix, restarting the workers when the
+        number of nodes changed, e.g. after a join
+        :return: the read buffer
+        """
+        if self.shared is not None and len(self.shared) != len(self.store):
+            self.close()
+        if self.shared is None:
+            self.start()
+        current = self.shared.buffers(self.cycle)[0]
+        if self.store.neighbors is not current:
+            current[:] = self.store.neighbors
+            self.store.neighbors = current
+        return current
+
+    def wait(self):
+        try:
+            self.barrier.wait()
+        except BrokenBarrierError:
+            self.close()
+            raise RuntimeError("a shard worker failed")
+
+    def run_cycle(self, initiators=None):
+        """
+        Run one gossip cycle
+        :param initiators: ids of the nodes that initiate an exchange, all nodes if None
+        :return: None
+        """
+        self.prepare()
+        shared = self.shared
+        if initiators is None:
+            shared.active[:] = True
+        else:
+            shared.active[:] = False
+            shared.active[np.asarray(initiators, dtype=np.int64)] = True
+        shared.alive[:] = True if self.alive is None else self.alive
+        shared.control[0] = self.cycle
+        self.wait()
+        self.wait()
+        self.wait()
+
+        if self.written is not None:
+            # an exchange writes its initiator and, unless one-way, its partner
+            initiators = np.flatnonzero(shared.active)
+            partners = shared.partners[initiators]
+            self.written[initiators] = True
+            self.written[partners[partners >= 0]] = True
+        if self.alive is not None:
+            initiators = np.flatnonzero(shared.active)
+            partners = shared.partners[initiators]
+            timed_out = partners >= 0
+            timed_out[timed_out] = ~shared.alive[partners[timed_out]]
+            self.timeouts.extend(zip(initiators[timed_out].tolist(), partners[timed_out].tolist()))
+        self.store.neighbors = shared.buffers(self.cycle)[1]
+        self.cycle += 1
+
+    def close(self):
+        """
+        Stop the workers and free the shared memory, the store gets a private copy of the neighbor matrix. The next
+        cycle starts them again.
+        :return: None
+        """
+        if self.shared is None:
+            return
+        self.store.neighbors = np.array(self.store.neighbors)
+        if all(process.is_alive() for process in self.processes) and not self.barrier.broken:
+            self.shared.control[0] = -1
+            self.barrier.wait()
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        self.shared.close(unlink=True)
+        self.shared = None
+
+
+def main():
+    from ring import Ring
+
+    parser = argparse.ArgumentParser(description="Gossip cycle rate of the sharded engine for several worker counts")
+    parser.add_argument("--n", type=int, default=1000000, help="number of nodes")
+    parser.add_argument("--k", type=int, default=10, help="number of neighbors")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--cycles", type=int, default=5, help="timed cycles per worker count")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    base = None
+    for workers in args.workers:
+        ring = Ring(args.n, args.k, 0, engine="sharded", workers=workers, seed=args.seed, output=False)
+        ring.gossip_cycle()
+        start = time.perf_counter()
+        for _ in range(args.cycles):
+            ring.gossip_cycle()
+        rate = args.cycles / (time.perf_counter() - start)
+        ring.engine.close()
+        base = base or rate
+        print("workers={:<3} {:8.3f} cycles/s  speedup {:5.2f}".format(workers, rate, rate / base), flush=True)
+
+
+if __name__ == "__main__":
+    main()
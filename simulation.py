@@ -0,0 +1,71 @@
+from collections import namedtuple
+
+import numpy as np
+
+EpochDelta = namedtuple("EpochDelta", ["epoch", "num_nodes", "rows", "neighbors"])
+
+
+def apply_delta(matrix, delta):
+    """
+    Rebuild the neighbor matrix of an epoch from the matrix of the epoch before and the delta
+    :param matrix: (M, k) neighbor matrix of the previous epoch, None before epoch 0
+    :param delta: an EpochDelta, its rows are the ids of the changed and the new rows, its neighbors their contents
+    :return: (N, k) neighbor matrix of the epoch
+    """
+    k = delta.neighbors.shape[1]
+    grown = np.full((delta.num_nodes, k), -1, dtype=np.int32)
+    if matrix is not None:
+        grown[:len(matrix)] = matrix
+    grown[delta.rows] = delta.neighbors
+    return grown
+
+
+class Subscriber:
+    """
+    Base of the output sinks of a topology. Ring and DynamicRing call on_epoch of every subscriber after each epoch,
+    epoch 0 being the initial topology, and close once the evolution is over.
+    """
+
+    def on_epoch(self, topology, epoch):
+        """
+        :param topology: the Ring or DynamicRing, its stopped attribute is true in the epoch a run stops early
+        :param epoch: the epoch that just ran
+        :return: None
+        """
+
+    def close(self):
+        """
+        :return: None
+        """
+
+
+class SnapshotFiles(Subscriber):
+    """
+    The plots and text files of the assignment: the node colors at epoch 0, then snapshots at epoch 1, every few
+    epochs, 5 by default, and the epoch a run stops early
+    """
+
+    def __init__(self, every=5):
+        """
+        Initializer
+        :param every: epochs between two snapshots
+        """
+        self.every = every
+
+    def on_epoch(self, topology, epoch):
+        if epoch == 0:
+            topology.write_colors()
+        elif epoch == 1 or epoch % self.every == 0 or topology.stopped:
+            topology.write_snapshot(epoch)
+
+
+class Callback(Subscriber):
+    """
+    Wraps a function of (topology, epoch) into a subscriber
+    """
+
+    def __init__(self, function):
+        self.function = function
+
+    def on_epoch(self, topology, epoch):
+        self.function(topology, epoch)
@@ -0,0 +1,105 @@
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from node_store import NodeStore
+from utils import Utils
+
+Snapshot = namedtuple("Snapshot", ["position", "rgb", "color_code", "neighbors"])
+RENDERERS = {}
+
+
+def take_snapshot(store=None, nodes=None, k=None):
+    """
+    Read-only copy of the topology state a snapshot needs, so the gossip can go on while it is written
+    :param store: a NodeStore, or None to copy from node objects
+    :param nodes: list of nodes with ids 0..len(nodes) - 1, used when there is no store
+    :param k: number of neighbors, used when there is no store
+    :return: a Snapshot of positions, RGB values, color codes and the neighbor matrix
+    """
+    if store is None:
+        store = NodeStore.from_nodes(nodes, k)
+    arrays = [np.array(array) for array in (store.position, store.rgb, store.color_code, store.neighbors)]
+    for array in arrays:
+        array.flags.writeable = False
+    return Snapshot(*arrays)
+
+
+def write_snapshot_files(snapshot, outputs, raster=False):
+    """
+    Render and write the files of one snapshot, runs in a worker. Every worker keeps one renderer per mode, so its
+    figure is reused across snapshots.
+    :param snapshot: a Snapshot
+    :param outputs: list of (color, image file name, text file name), color as in SnapshotRenderer.render, no image
+                    or text file if its name is None
+    :param raster: if true render with the raster mode of SnapshotRenderer
+    :return: None
+    """
+    views = [(color, image_file_name) for color, image_file_name, _ in outputs if image_file_name is not None]
+    if views:
+        renderer = RENDERERS.get(raster)
+        if renderer is None:
+            from renderer import SnapshotRenderer
+            renderer = RENDERERS[raster] = SnapshotRenderer(raster)
+        renderer.render(snapshot, views)
+    for _, _, file_name in outputs:
+        if file_name is not None:
+            Utils.write_neighbor_matrix_to_file(snapshot.neighbors, file_name)
+
+
+class SnapshotWriter:
+    """
+    Renders and writes snapshots in a pool of background workers. At most max_pending snapshots are queued: when the
+    queue is full, submit waits for the oldest one, so a slow disk slows the gossip down instead of piling up copies
+    of the topology in memory. Errors of a worker are raised by the submit or flush that collects its snapshot.
+    """
+
+    def __init__(self, workers=1, max_pending=None, processes=True):
+        """
+        Initializer
+        :param workers: number of workers
+        :param max_pending: bound of the queue of submitted snapshots, twice the number of workers by default
+        :param processes: if true use worker processes, otherwise threads
+        """
+        executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        self.pool = executor(max_workers=workers)
+        self.max_pending = max_pending if max_pending is not None else 2 * workers
+        self.pending = deque()
+        self.written = 0
+
+    def submit(self, snapshot, outputs, raster=False):
+        """
+        Queue a snapshot, waiting for the oldest queued one while the queue is full
+        :param snapshot: a Snapshot
+        :param outputs: list of (color, image file name, text file name)
+        :param raster: if true render with the raster mode of SnapshotRenderer
+        :return: None
+        """
+        while len(self.pending) >= self.max_pending:
+            self.collect()
+        self.pending.append(self.pool.submit(write_snapshot_files, snapshot, outputs, raster))
+
+    def collect(self):
+        self.pending.popleft().result()
+        self.written += 1
+
+    def flush(self):
+        """
+        Wait until every queued snapshot is written
+        :return: None
+        """
+        while self.pending:
+            self.collect()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
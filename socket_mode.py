@@ -0,0 +1,277 @@
+import asyncio
+import heapq
+import math
+import multiprocessing
+import queue
+import random
+import struct
+import time
+
+import numpy as np
+
+from ring import Ring
+from utils import Utils
+
+FRAME = struct.Struct("<I")
+HEADER = struct.Struct("<IH")
+ENTRY = struct.Struct("<I3f")
+
+
+def encode_view(sender, entries):
+    """
+    Binary neighbor view: sender id, entry count, then id and float32 Lab triple per entry, length prefixed
+    :param sender: id of the sending peer
+    :param entries: list of (id, l, a, b)
+    :return: the framed message
+    """
+    body = HEADER.pack(sender, len(entries)) + b"".join(ENTRY.pack(*entry) for entry in entries)
+    return FRAME.pack(len(body)) + body
+
+
+def decode_view(body):
+    """
+    :param body: a message without its length prefix
+    :return: sender id and list of (id, l, a, b)
+    """
+    sender, count = HEADER.unpack_from(body)
+    return sender, list(ENTRY.iter_unpack(body[HEADER.size:HEADER.size + count * ENTRY.size]))
+
+
+async def read_frame(reader):
+    """
+    :param reader: an asyncio StreamReader
+    :return: the next message body, None at end of stream
+    """
+    try:
+        prefix = await reader.readexactly(FRAME.size)
+        return await reader.readexactly(FRAME.unpack(prefix)[0])
+    except asyncio.IncompleteReadError:
+        return None
+
+
+class Peer:
+    """
+    A T-Man peer that keeps only ids and Lab triples of its neighbors and exchanges views over TCP. Connections to
+    current neighbors are pooled and closed when the neighbor drops out of the view.
+    """
+
+    def __init__(self, peer_id, lab, view, k, one_way, base_port, rng):
+        """
+        Initializer
+        :param peer_id: identifier of the peer, it listens on base_port + peer_id
+        :param lab: own (l, a, b)
+        :param view: map of neighbor id to (l, a, b)
+        :param k: number of neighbors
+        :param one_way: if true only the receiving peer updates its view
+        :param base_port: port of peer 0
+        :param rng: a random.Random
+        """
+        self.id = peer_id
+        self.lab = tuple(lab)
+        self.view = view
+        self.k = k
+        self.one_way = one_way
+        self.base_port = base_port
+        self.rng = rng
+        self.pool = {}
+        self.handlers = set()
+        self.latencies = []
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def entries(self):
+        return [(self.id,) + self.lab] + [(j,) + lab for j, lab in self.view.items()]
+
+    def merge(self, entries):
+        """
+        Keep the k nearest of the current view and the received entries, ties broken by id like
+        Node.select_k_nearest_neighbors
+        :param entries: list of (id, l, a, b)
+        :return: None
+        """
+        candidates = dict(self.view)
+        for node_id, l, a, b in entries:
+            candidates[node_id] = (l, a, b)
+        candidates.pop(self.id, None)
+        l, a, b = self.lab
+        nearest = heapq.nsmallest(self.k, ((math.sqrt((lab[0] - l) ** 2 + (lab[1] - a) ** 2 + (lab[2] - b) ** 2),
+                                            node_id) for node_id, lab in candidates.items()))
+        self.view = {node_id: candidates[node_id] for _, node_id in nearest}
+        for node_id in [node_id for node_id in self.pool if node_id not in self.view]:
+            self.pool.pop(node_id)[1].close()
+
+    async def connection(self, node_id):
+        """
+        :param node_id: id of a neighbor
+        :return: pooled (reader, writer) to the neighbor, opened on first use
+        """
+        connection = self.pool.get(node_id)
+        if connection is None:
+            connection = await asyncio.open_connection("127.0.0.1", self.base_port + node_id)
+            self.pool[node_id] = connection
+        return connection
+
+    async def exchange(self):
+        """
+        Send the view to a random neighbor and merge its reply, the latency of the round trip is recorded
+        :return: None
+        """
+        neighbor = self.rng.choice(list(self.view))
+        reader, writer = await self.connection(neighbor)
+        message = encode_view(self.id, self.entries())
+        start = time.perf_counter()
+        writer.write(message)
+        await writer.drain()
+        body = await read_frame(reader)
+        self.latencies.append(time.perf_counter() - start)
+        self.bytes_sent += len(message)
+        if body is None:
+            # the neighbor closed the connection, drop it from the pool
+            writer.close()
+            self.pool.pop(neighbor, None)
+            return
+        self.bytes_received += FRAME.size + len(body)
+        _, entries = decode_view(body)
+        if not self.one_way:
+            self.merge(entries)
+
+    async def handle(self, reader, writer):
+        """
+        Serve one incoming connection: reply with the view held before merging, an empty view in one-way mode
+        """
+        self.handlers.add(asyncio.current_task())
+        while True:
+            body = await read_frame(reader)
+            if body is None:
+                break
+            self.bytes_received += FRAME.size + len(body)
+            reply = encode_view(self.id, [] if self.one_way else self.entries())
+            writer.write(reply)
+            self.bytes_sent += len(reply)
+            await writer.drain()
+            self.merge(decode_view(body)[1])
+        writer.close()
+
+
+async def serve_peers(peer_ids, lab, neighbors, k, epochs, one_way, base_port, seed, barrier):
+    rng = random.Random(seed)
+    peers = [Peer(i, lab[i], {j: tuple(lab[j]) for j in neighbors[i]}, k, one_way, base_port, rng)
+             for i in peer_ids]
+    servers = [await asyncio.start_server(peer.handle, "127.0.0.1", base_port + peer.id) for peer in peers]
+    loop = asyncio.get_running_loop()
+
+    await loop.run_in_executor(None, barrier.wait)
+    for _ in range(epochs):
+        for peer in peers:
+            await peer.exchange()
+    # keep serving until every process has finished its exchanges
+    await loop.run_in_executor(None, barrier.wait)
+
+    for peer in peers:
+        for _, writer in peer.pool.values():
+            writer.close()
+            await writer.wait_closed()
+    # every client side is closed now, the serving side of each connection ends at end of stream
+    await loop.run_in_executor(None, barrier.wait)
+    handlers = [handler for peer in peers for handler in peer.handlers]
+    if handlers:
+        await asyncio.wait(handlers)
+    for server in servers:
+        server.close()
+        await server.wait_closed()
+    return peers
+
+
+def run_process(peer_ids, lab, neighbors, k, epochs, one_way, base_port, seed, barrier, results):
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError):
+        pass
+    try:
+        peers = asyncio.run(serve_peers(peer_ids, lab, neighbors, k, epochs, one_way, base_port, seed, barrier))
+    except BaseException:
+        # e.g. a port in use, the other processes must not wait for this one at the barrier
+        barrier.abort()
+        raise
+    results.put([(peer.id, list(peer.view), peer.latencies, peer.bytes_sent, peer.bytes_received)
+                 for peer in peers])
+
+
+def run_socket_ring(num_nodes, k, epochs, processes=2, one_way=False, base_port=20000, seed=None):
+    """
+    Run the ring topology with every peer behind its own TCP server on localhost, peers spread over processes
+    :param num_nodes: number of peers
+    :param k: number of neighbors
+    :param epochs: number of gossip cycles every process runs
+    :param processes: number of worker processes
+    :param one_way: if true only the receiving peer updates its view
+    :param base_port: peer i listens on base_port + i
+    :param seed: seed of the initial topology and the partner choices
+    :return: a map with latency percentiles, bytes on the wire and the final neighbor matrix
+    :raises RuntimeError: if a worker process fails
+    """
+    ring = Ring(num_nodes, k, 0, use_store=True, seed=seed, output=False)
+    lab = ring.store.lab.tolist()
+    neighbors = ring.store.neighbors.tolist()
+
+    barrier = multiprocessing.Barrier(processes)
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=run_process,
+                                       args=(list(range(p, num_nodes, processes)), lab, neighbors, k, epochs,
+                                             one_way, base_port, None if seed is None else seed + p, barrier,
+                                             results))
+               for p in range(processes)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    latencies, bytes_on_wire = [], 0
+    collected = 0
+    while collected < len(workers):
+        try:
+            peers = results.get(timeout=1)
+        except queue.Empty:
+            failed = [worker for worker in workers if worker.exitcode not in (None, 0)]
+            if failed:
+                barrier.abort()
+                for worker in workers:
+                    worker.terminate()
+                    worker.join()
+                raise RuntimeError("socket worker failed with exit code {}".format(failed[0].exitcode))
+            continue
+        collected += 1
+        for peer_id, view, peer_latencies, sent, _ in peers:
+            ring.store.set_neighbors(peer_id, view)
+            latencies.extend(peer_latencies)
+            bytes_on_wire += sent
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    store = ring.store
+    same_color = store.color_code[store.neighbors] == store.color_code[:, None]
+    return {
+        "exchanges": len(latencies),
+        "latency_ms": {"p50": float(np.percentile(latencies, 50)), "p90": float(np.percentile(latencies, 90)),
+                       "p99": float(np.percentile(latencies, 99)), "max": float(latencies.max())},
+        "bytes_on_wire": bytes_on_wire,
+        "bytes_per_exchange": bytes_on_wire / len(latencies),
+        "same_color_fraction": float(same_color.mean()),
+        "seconds": elapsed,
+        "store": store,
+    }
+
+
+def print_report(report):
+    latency = report["latency_ms"]
+    print("{} exchanges in {:.2f}s, latency p50 {:.3f}ms p90 {:.3f}ms p99 {:.3f}ms max {:.3f}ms".format(
+        report["exchanges"], report["seconds"], latency["p50"], latency["p90"], latency["p99"], latency["max"]))
+    print("{} bytes on the wire, {:.1f} bytes per exchange, same color edges {:.4f}".format(
+        report["bytes_on_wire"], report["bytes_per_exchange"], report["same_color_fraction"]))
+
+
+def write_report_topology(report, num_nodes, k, output_dir=None):
+    file_name = (output_dir or Utils.get_homework_directory()) + "/S_N{}_k{}.txt".format(num_nodes, k)
+    Utils.write_store_topology_to_file(report["store"], file_name)
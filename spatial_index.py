@@ -0,0 +1,190 @@
+import numpy as np
+
+
+class LabGridIndex:
+    """
+    Uniform grid over the Lab coordinates of a set of nodes. The points are sorted by cell, so a cell is a slice of
+    the order array and a block of cells is gathered with one searchsorted. Lab coordinates never change, so an index
+    stays valid for as long as the set of nodes it was built from.
+
+    Queries are answered for groups of query points that fall into the same cell: the block of cells around the
+    group grows by one cell per side until the k-th nearest candidate of every point of the group is closer than
+    the border of the block, which makes the answer exact.
+    """
+
+    def __init__(self, lab, cell_size=None, occupancy=8):
+        """
+        Initializer
+        :param lab: (M, 3) Lab coordinates, row i is point i
+        :param cell_size: edge length of a cell, chosen for the occupancy by default
+        :param occupancy: average number of points per occupied cell when cell_size is not given
+        """
+        self.lab = np.asarray(lab, dtype=np.float64).reshape(-1, 3)
+        num_points = len(self.lab)
+        if num_points:
+            self.low = self.lab.min(axis=0)
+            extent = np.maximum(self.lab.max(axis=0) - self.low, 1e-9)
+        else:
+            self.low, extent = np.zeros(3), np.ones(3)
+        fitted = cell_size is None
+        if fitted:
+            # flat point sets would get tiny cells, at most about cbrt(M) cells per axis keeps the grid near M cells
+            cell_size = max(float(np.cbrt(np.prod(extent) * occupancy / max(num_points, 1))),
+                            float(extent.max() / max(np.cbrt(num_points), 1.0)))
+        for _ in range(4):
+            self.cell_size = max(cell_size, 1e-9)
+            self.shape = np.maximum(np.floor(extent / self.cell_size).astype(np.int64) + 1, 1)
+            keys = self.keys(self.cells(self.lab))
+            if not fitted:
+                break
+            # clustered points crowd the cells of the bounding box, refine until the occupied cells hold the occupancy
+            crowding = num_points / max(len(np.unique(keys)), 1) / occupancy
+            if crowding < 2 or np.prod(self.shape.astype(np.float64)) * crowding > 64.0 * num_points:
+                break
+            cell_size /= float(np.cbrt(crowding))
+
+        self.order = np.argsort(keys, kind="stable")
+        self.occupied, self.starts, counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+        self.ends = self.starts + counts
+
+    def __len__(self):
+        return len(self.lab)
+
+    def cells(self, points):
+        """
+        :param points: (Q, 3) Lab coordinates, they may lie outside the grid
+        :return: (Q, 3) integer cell coordinates
+        """
+        return np.floor((np.asarray(points, dtype=np.float64) - self.low) / self.cell_size).astype(np.int64)
+
+    def keys(self, cells):
+        return (cells[:, 0] * self.shape[1] + cells[:, 1]) * self.shape[2] + cells[:, 2]
+
+    def block(self, cell, reach):
+        """
+        :param cell: integer cell coordinates, possibly outside the grid
+        :param reach: number of cells on every side of the cell
+        :return: ids of the points in the cube of cells around the cell, and whether the cube covers the whole grid
+        """
+        low = np.maximum(cell - reach, 0)
+        high = np.minimum(cell + reach, self.shape - 1)
+        if (low > high).any():
+            return np.empty(0, dtype=np.int64), False
+        axes = [np.arange(low[axis], high[axis] + 1) for axis in range(3)]
+        cube = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+        keys = self.keys(cube)
+        found = np.minimum(np.searchsorted(self.occupied, keys), len(self.occupied) - 1)
+        found = found[self.occupied[found] == keys]
+        counts = self.ends[found] - self.starts[found]
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        whole = bool((cell - reach <= 0).all() and (cell + reach >= self.shape - 1).all())
+        return self.order[np.repeat(self.starts[found], counts) + offsets], whole
+
+    def query(self, points, k, exclude=None, max_distance=None):
+        """
+        Exact k nearest neighbors of query points among the points of the index, ordered by distance, ties by id
+        :param points: (Q, 3) Lab coordinates of the queries
+        :param k: number of neighbors
+        :param exclude: (Q,) id of the index point each query must not return, e.g. the query itself, -1 for none
+        :param max_distance: (Q,) or scalar, only points at most this far are returned
+        :return: (Q, k) ids, -1 where fewer than k points qualify, and (Q, k) squared distances, inf there
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        num_queries = len(points)
+        ids = np.full((num_queries, k), -1, dtype=np.int64)
+        squared = np.full((num_queries, k), np.inf)
+        if not num_queries or not len(self.lab) or not k:
+            return ids, squared
+        exclude = np.full(num_queries, -1) if exclude is None else np.asarray(exclude)
+        limit = np.full(num_queries, np.inf) if max_distance is None else \
+            np.broadcast_to(np.asarray(max_distance, dtype=np.float64), (num_queries,))
+        limit = limit ** 2
+
+        cells = self.cells(points)
+        groups, group_of = np.unique(cells, axis=0, return_inverse=True)
+        members = np.argsort(group_of.reshape(-1), kind="stable")
+        bounds = np.cumsum(np.bincount(group_of.reshape(-1), minlength=len(groups)))
+        start = 0
+        for group, end in zip(groups, bounds.tolist()):
+            pending = members[start:end]
+            start = end
+            # queries outside the grid start with the first block that reaches it
+            reach = max(1, int(np.max(np.maximum(-group, group - (self.shape - 1)))))
+            while len(pending):
+                candidates, whole = self.block(group, reach)
+                distance = ((self.lab[candidates][None, :, :] - points[pending][:, None, :]) ** 2).sum(axis=2)
+                distance[(candidates[None, :] == exclude[pending][:, None]) | (distance > limit[pending][:, None])] \
+                    = np.inf
+                order = nearest(distance, candidates, k)
+                found = np.take_along_axis(distance, order, axis=1)
+                count = found.shape[1]
+                ids[pending, :count] = np.where(np.isfinite(found), candidates[order], -1)
+                squared[pending, :count] = found
+                covered = (reach * self.cell_size) ** 2
+                done = np.full(len(pending), whole) | (limit[pending] <= covered) | (squared[pending, -1] <= covered)
+                pending = pending[~done]
+                reach += 1
+        return ids, squared
+
+
+def nearest(distance, candidates, k):
+    """
+    Column indices of the k smallest distances of every row, ordered by distance then candidate id. Only the k
+    partitioned columns are sorted, rows where a distance tied with the k-th one was left out of the partition are
+    sorted whole so ties still go to the smaller id.
+    :param distance: (Q, C) distances, inf for excluded candidates
+    :param candidates: (C,) candidate ids
+    :param k: number of columns to keep
+    :return: (Q, min(k, C)) column indices
+    """
+    if distance.shape[1] <= k:
+        return np.lexsort((np.broadcast_to(candidates, distance.shape), distance), axis=1)
+    order = np.argpartition(distance, k - 1, axis=1)[:, :k]
+    kept = np.take_along_axis(distance, order, axis=1)
+    kth = kept.max(axis=1)
+    # with an infinite k-th distance the rows left out are all excluded anyway
+    tied = np.flatnonzero(np.isfinite(kth) & ((distance == kth[:, None]).sum(axis=1) >
+                                              (kept == kth[:, None]).sum(axis=1)))
+    order = np.take_along_axis(order, np.lexsort((candidates[order], kept), axis=1), axis=1)
+    if len(tied):
+        order[tied] = np.lexsort((np.broadcast_to(candidates, (len(tied), len(candidates))), distance[tied]),
+                                 axis=1)[:, :k]
+    return order
+
+
+def join_neighbors(lab, neighbors, num_old, k, alive=None):
+    """
+    Neighbors after a batch of nodes joined: every old node keeps the k nearest of its neighbors and the new nodes,
+    every new node takes the k nearest of all other nodes. This is what update_neighbors gives when every old node
+    is offered all new nodes and every new node all nodes, but only the k nearest new nodes of an old node can make
+    it into its list, and only if they are closer than its farthest neighbor, so both sides are grid queries.
+    :param lab: (N, 3) Lab coordinates of all nodes, the new ones last
+    :param neighbors: (num_old, k) neighbor id matrix of the old nodes, -1 marks an empty slot
+    :param num_old: number of old nodes
+    :param k: number of neighbors
+    :param alive: (num_old,) boolean mask of the old nodes that are still alive, dead nodes keep their rows and are
+                  not offered to the new nodes
+    :return: (N, k) neighbor id matrix of all nodes
+    """
+    lab = np.asarray(lab, dtype=np.float64)
+    neighbors = np.asarray(neighbors, dtype=np.int64)[:num_old]
+    joined = np.full((len(lab), k), -1, dtype=np.int64)
+
+    old = np.arange(num_old) if alive is None else np.flatnonzero(alive)
+    joined[:num_old] = neighbors
+    neighbors, old_lab = neighbors[old], lab[old]
+    present = neighbors >= 0
+    current = np.where(present, ((lab[np.maximum(neighbors, 0)] - old_lab[:, None, :]) ** 2).sum(axis=2), np.inf)
+    farthest = np.where(present.all(axis=1), np.sqrt(current.max(axis=1, initial=0.0)), np.inf)
+    offered, offered_squared = LabGridIndex(lab[num_old:]).query(old_lab, k, max_distance=farthest)
+    offered = np.where(offered >= 0, offered + num_old, -1)
+    ids = np.concatenate((neighbors, offered), axis=1)
+    distance = np.concatenate((current, offered_squared), axis=1)
+    order = np.lexsort((ids, distance), axis=1)[:, :k]
+    joined[old] = np.where(np.isfinite(np.take_along_axis(distance, order, axis=1)),
+                           np.take_along_axis(ids, order, axis=1), -1)
+
+    members = np.concatenate((old, np.arange(num_old, len(lab))))
+    found = LabGridIndex(lab[members]).query(lab[num_old:], k, exclude=np.arange(len(old), len(members)))[0]
+    joined[num_old:] = np.where(found >= 0, members[found], -1)
+    return joined
@@ -0,0 +1,240 @@
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from dynamic_ring import DynamicRing
+from metrics import ConvergenceMonitor
+from node_store import NodeStore
+from ring import Ring
+from utils import Utils
+
+FIELDS = ["topology", "n", "k", "seed", "mode", "engine", "epochs", "radii", "early_stop",
+          "connected", "components", "same_color_fraction", "seconds", "epochs_run"]
+KEY_FIELDS = FIELDS[:9]
+
+
+def case_key(case):
+    """
+    :param case: a map with at least the KEY_FIELDS of a run
+    :return: a hashable key identifying the run
+    """
+    return tuple(str(case[field]) for field in KEY_FIELDS)
+
+
+def migrate(file_name):
+    """
+    Rewrite a results table written with an older set of columns to the current FIELDS. Tables written before early
+    stopping existed have no early_stop and epochs_run columns: their runs did not stop early and ran every epoch.
+    :param file_name: an existing CSV results table
+    :return: None
+    """
+    with open(file_name, newline="") as f:
+        reader = csv.DictReader(f)
+        header = reader.fieldnames or []
+        rows = list(reader)
+    if header == FIELDS or not header:
+        return
+    unknown = [field for field in header if field not in FIELDS]
+    if unknown:
+        raise ValueError("cannot resume {}: unknown columns {}".format(file_name, ", ".join(unknown)))
+    for row in rows:
+        row.setdefault("early_stop", 0)
+        row.setdefault("epochs_run", row["epochs"])
+    missing = [field for field in FIELDS if any(row.get(field) is None for row in rows)]
+    if missing:
+        raise ValueError("cannot resume {}: missing columns {}".format(file_name, ", ".join(missing)))
+    temporary = file_name + ".tmp"
+    with open(temporary, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(temporary, file_name)
+
+
+def run_case(case):
+    """
+    Run one topology without plots or text files and measure how well it converged. Runs in a worker process.
+    A D topology has no colors, its same_color_fraction is left empty.
+    :param case: a map with the KEY_FIELDS of the run, radii as a space separated string
+    :return: the case extended by the result fields
+    """
+    one_way = case["mode"] == "one_way"
+    if one_way and case["topology"] != "R":
+        raise ValueError("D topologies only run two-way exchanges")
+    start = time.perf_counter()
+    monitor = ConvergenceMonitor() if int(case["early_stop"]) else None
+    if case["topology"] == "R":
+        topology = Ring(case["n"], case["k"], case["epochs"], engine=case["engine"], one_way=one_way,
+                        seed=case["seed"], output=False, monitor=monitor)
+        codes = NodeStore.encode_colors(["red", "green", "blue"]).tolist()
+    else:
+        radii = [int(r) for r in case["radii"].split()]
+        topology = DynamicRing(case["n"], case["k"], case["epochs"] // 5, radii, engine=case["engine"],
+                               seed=case["seed"], output=False, monitor=monitor)
+        codes = [None]
+    elapsed = time.perf_counter() - start
+
+    store = topology.store if topology.store is not None else NodeStore.from_nodes(topology.nodes, case["k"])
+    components = [Utils.count_color_components(store.neighbors, store.color_code, code) for code in codes]
+    row = dict(case)
+    row["connected"] = int(all(count == 1 for count in components))
+    row["components"] = sum(components)
+    row["same_color_fraction"] = ""
+    if case["topology"] == "R":
+        valid = store.neighbors >= 0
+        same_color = store.color_code[store.neighbors] == store.color_code[:, None]
+        row["same_color_fraction"] = round(float(same_color[valid].mean()), 6)
+    row["seconds"] = round(elapsed, 4)
+    row["epochs_run"] = topology.epochs_run
+    return row
+
+
+class ResultsTable:
+    """
+    A CSV results table that is appended to and flushed row by row, so a sweep can be watched while it runs and
+    resumed after it stops: runs already in the file are not run again.
+    """
+
+    def __init__(self, file_name):
+        """
+        Initializer
+        :param file_name: the CSV file, created if it does not exist and migrated to the current columns if it
+                          has older ones
+        """
+        self.file_name = file_name
+        self.rows = {}
+        if os.path.exists(file_name):
+            migrate(file_name)
+            with open(file_name, newline="") as f:
+                for row in csv.DictReader(f):
+                    self.rows[case_key(row)] = row
+        new_file = not os.path.exists(file_name) or os.path.getsize(file_name) == 0
+        self.file = open(file_name, "a", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+        if new_file:
+            self.writer.writeheader()
+            self.file.flush()
+
+    def get(self, case):
+        """
+        :param case: a run
+        :return: the stored result of the run or None
+        """
+        return self.rows.get(case_key(case))
+
+    def append(self, row):
+        """
+        Store and flush the result of a run
+        :param row: the result of a run
+        :return: None
+        """
+        self.rows[case_key(row)] = row
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def run_cases(cases, pool, table, verbose=True):
+    """
+    Run every case that is not in the table yet, results are streamed into the table as workers finish
+    :param cases: list of runs
+    :param pool: a process pool
+    :param table: the results table
+    :param verbose: if true print a line per finished run
+    :return: the results of all cases, in order
+    """
+    pending = [case for case in cases if table.get(case) is None]
+    futures = [pool.submit(run_case, case) for case in pending]
+    for done, future in enumerate(as_completed(futures), 1):
+        row = future.result()
+        table.append(row)
+        if verbose:
+            print("[{}/{}] {} N={} k={} seed={} {} connected={} same_color={}".format(
+                done, len(futures), row["topology"], row["n"], row["k"], row["seed"], row["mode"],
+                row["connected"], row["same_color_fraction"] or "-"), flush=True)
+    return [table.get(case) for case in cases]
+
+
+def make_case(topology, n, k, seed, mode, engine, epochs, radii, early_stop=False):
+    return {"topology": topology, "n": n, "k": k, "seed": seed, "mode": mode, "engine": engine,
+            "epochs": epochs, "radii": " ".join(str(r) for r in radii), "early_stop": int(early_stop)}
+
+
+def minimum_k(topology, n, seeds, mode, engine, epochs, radii, pool, table, verbose=True, early_stop=False):
+    """
+    Bisection for the smallest k whose topology is connected for every seed at the given epoch, assuming that
+    connectivity is monotone in k
+    :return: the smallest such k, or None if even the largest k is disconnected for some seed
+    """
+    def connected(k):
+        rows = run_cases([make_case(topology, n, k, seed, mode, engine, epochs, radii, early_stop)
+                          for seed in seeds], pool, table, verbose)
+        result = all(int(row["connected"]) for row in rows)
+        if verbose:
+            print("k={} {}".format(k, "connected for all seeds" if result else "disconnected"), flush=True)
+        return result
+
+    # the largest color group is an upper bound on the k needed for a ring of three colors
+    low, high = 1, (-(-n // 3) if topology == "R" else n - 1)
+    if not connected(high):
+        return None
+    while low < high:
+        middle = (low + high) // 2
+        if connected(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run T-Man parameter sweeps in a process pool, without plots")
+    parser.add_argument("--topology", choices=["R", "D"], default="R")
+    parser.add_argument("--n", type=int, nargs="+", default=[100], help="numbers of nodes")
+    parser.add_argument("--k", type=int, nargs="+", default=[9], help="numbers of neighbors")
+    parser.add_argument("--seeds", type=int, default=5, help="number of seeds per configuration")
+    parser.add_argument("--seed-offset", type=int, default=0, help="first seed")
+    parser.add_argument("--modes", nargs="+", choices=["two_way", "one_way"], default=["two_way"],
+                        help="exchange modes of an R topology, D topologies are always two-way")
+    parser.add_argument("--engine", choices=["python", "batched"], default="batched")
+    parser.add_argument("--epochs", type=int, default=40)
+    parser.add_argument("--radii", type=int, nargs="*", default=[], help="radii of a D topology")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--early-stop", action="store_true",
+                        help="stop a run once its color graphs are connected and pure for 3 epochs")
+    parser.add_argument("--min-k", action="store_true", help="bisect for the smallest connected k instead of a grid")
+    parser.add_argument("--out", default="sweep.csv", help="results table, existing runs are reused")
+    args = parser.parse_args()
+    if args.topology == "D" and "one_way" in args.modes:
+        parser.error("--modes one_way only applies to R topologies, D topologies are always two-way")
+
+    seeds = list(range(args.seed_offset, args.seed_offset + args.seeds))
+    table = ResultsTable(args.out)
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            if args.min_k:
+                for n in args.n:
+                    for mode in args.modes:
+                        k = minimum_k(args.topology, n, seeds, mode, args.engine, args.epochs, args.radii, pool,
+                                      table, early_stop=args.early_stop)
+                        print("minimum k for {} N={} {} over {} seeds at epoch {}: {}".format(
+                            args.topology, n, mode, len(seeds), args.epochs, k), flush=True)
+            else:
+                cases = [make_case(args.topology, n, k, seed, mode, args.engine, args.epochs, args.radii,
+                                   args.early_stop)
+                         for n in args.n for k in args.k for mode in args.modes for seed in seeds]
+                rows = run_cases(cases, pool, table)
+                connected = np.array([int(row["connected"]) for row in rows])
+                print("{} runs, {} connected".format(len(rows), connected.sum()))
+    finally:
+        table.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from checkpoint import Checkpoint, Checkpointer, resume, write_checkpoint
+from churn import Churn
+from dynamic_ring import DynamicRing
+from ring import Ring
+from scheduler import ActiveSet
+from trajectory import topology_arrays
+
+
+def neighbor_matrix(topology):
+    return np.asarray(topology_arrays(topology.store, topology.nodes, topology.k)[2])
+
+
+def options(engine, churn, scheduler):
+    return dict(engine=engine, seed=3, output=False, churn=Churn(0.02, 0.5, seed=4) if churn else None,
+                scheduler=ActiveSet() if scheduler else None)
+
+
+def test_round_trip(tmp_path):
+    file_name = str(tmp_path / "ring.ckpt")
+    topology = Ring(120, 5, 4, engine="batched", seed=0, output=False)
+    write_checkpoint(topology, file_name)
+    checkpoint = Checkpoint(file_name)
+    assert (checkpoint["neighbors"] == neighbor_matrix(topology)).all()
+    assert (checkpoint["lab"] == topology.store.lab).all()
+    assert (checkpoint["rgb"] == topology.store.rgb).all()
+    assert checkpoint.epochs_run == topology.epochs_run
+
+
+@pytest.mark.parametrize("scheduler", [False, True])
+@pytest.mark.parametrize("churn", [False, True])
+@pytest.mark.parametrize("engine", ["python", "batched"])
+def test_resumed_ring_matches_uninterrupted(tmp_path, engine, churn, scheduler):
+    file_name = str(tmp_path / "ring.ckpt")
+    full = Ring(200, 5, 12, subscribers=[Checkpointer(file_name, 5)], **options(engine, churn, scheduler))
+    assert Checkpoint(file_name).epochs_run == 10
+    resumed = resume(file_name, **options(engine, churn, scheduler))
+    assert resumed.epochs_run == full.epochs_run
+    assert (neighbor_matrix(resumed) == neighbor_matrix(full)).all()
+
+
+@pytest.mark.parametrize("churn", [False, True])
+@pytest.mark.parametrize("engine", ["python", "batched"])
+def test_resumed_dynamic_ring_matches_uninterrupted(tmp_path, engine, churn):
+    file_name = str(tmp_path / "dynamic.ckpt")
+    full = DynamicRing(150, 5, 3, [40, 60, 80], subscribers=[Checkpointer(file_name, 4)],
+                       **options(engine, churn, False))
+    assert Checkpoint(file_name).epochs_run == 12
+    resumed = resume(file_name, **options(engine, churn, False))
+    assert len(resumed.nodes) == len(full.nodes)
+    assert (neighbor_matrix(resumed) == neighbor_matrix(full)).all()
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from churn import Churn
+from ring import Ring
+from trajectory import topology_arrays
+
+
+@pytest.mark.parametrize("engine", ["python", "batched"])
+def test_reverse_index_matches_neighbor_lists(engine):
+    churn = Churn(0.05, 0.5, seed=1)
+    topology = Ring(200, 5, 10, engine=engine, seed=0, output=False, churn=churn)
+    assert churn.stats["departures"] > 0
+    churn.refresh(topology)
+    assert not churn.dirty.any()
+    neighbors = np.asarray(topology_arrays(topology.store, topology.nodes, topology.k)[2])
+    reverse = [set() for _ in range(len(topology.nodes))]
+    for node_id, row in enumerate(neighbors.tolist()):
+        for j in row:
+            if j >= 0:
+                reverse[j].add(node_id)
+    assert churn.reverse == reverse
@@ -0,0 +1,104 @@
+import numpy as np
+
+import color_space
+from utils import Utils
+
+
+def reference_rgb_to_xyz(r, g, b):
+    """
+    The per-element conversion color_space replaced, kept as the reference
+    """
+    sR = np.array(r)
+    sG = np.array(g)
+    sB = np.array(b)
+
+    var_R = (sR / 255.0)
+    var_G = (sG / 255.0)
+    var_B = (sB / 255.0)
+
+    var_R = [((vR + 0.055) / 1.055) ** 2.4 if vR > 0.04045 else vR / 12.92 for vR in var_R]
+    var_G = [((vG + 0.055) / 1.055) ** 2.4 if vG > 0.04045 else vG / 12.92 for vG in var_G]
+    var_B = [((vB + 0.055) / 1.055) ** 2.4 if vB > 0.04045 else vB / 12.92 for vB in var_B]
+
+    var_R = [vR * 100 for vR in var_R]
+    var_G = [vG * 100 for vG in var_G]
+    var_B = [vB * 100 for vB in var_B]
+
+    X = np.array(var_R) * 0.4124 + np.array(var_G) * 0.3576 + np.array(var_B) * 0.1805
+    Y = np.array(var_R) * 0.2126 + np.array(var_G) * 0.7152 + np.array(var_B) * 0.0722
+    Z = np.array(var_R) * 0.0193 + np.array(var_G) * 0.1192 + np.array(var_B) * 0.9505
+
+    return X, Y, Z
+
+
+def reference_xyz_to_cie_l_ab(x, y, z):
+    """
+    The per-element conversion color_space replaced, kept as the reference
+    """
+    reference_x = 94.811
+    reference_y = 100.00
+    reference_z = 107.304
+
+    var_X = x / reference_x
+    var_Y = y / reference_y
+    var_Z = z / reference_z
+
+    var_X = np.array([vx ** (1 / 3) if vx > 0.008856 else (7.87 * vx) + (16 / 116) for vx in var_X])
+    var_Y = np.array([vy ** (1 / 3) if vy > 0.008856 else (7.87 * vy) + (16 / 116) for vy in var_Y])
+    var_Z = np.array([vz ** (1 / 3) if vz > 0.008856 else (7.87 * vz) + (16 / 116) for vz in var_Z])
+
+    cie_l = (116 * var_Y) - 16
+    cie_a = 500 * (var_X - var_Y)
+    cie_b = 200 * (var_Y - var_Z)
+
+    return cie_l, cie_a, cie_b
+
+
+def all_channel_values(step=15):
+    """
+    :param step: spacing of the values of the other two channels
+    :return: (M, 3) uint8 triples in which every channel takes each of its 256 values, against a grid of the others
+    """
+    values = np.arange(256)
+    grid = np.arange(0, 256, step)
+    rows = []
+    for channel in range(3):
+        varied, first, second = np.meshgrid(values, grid, grid, indexing="ij")
+        others = [first.ravel(), second.ravel()]
+        columns = others[:channel] + [varied.ravel()] + others[channel:]
+        rows.append(np.column_stack(columns))
+    return np.concatenate(rows).astype(np.uint8)
+
+
+RGB = all_channel_values()
+REFERENCE_XYZ = np.column_stack(reference_rgb_to_xyz(*RGB.T.astype(np.int64)))
+REFERENCE_LAB = np.column_stack(reference_xyz_to_cie_l_ab(*REFERENCE_XYZ.T))
+
+
+def test_rgb_to_xyz_matches_reference():
+    np.testing.assert_allclose(color_space.rgb_to_xyz(RGB), REFERENCE_XYZ, rtol=0, atol=1e-12)
+    np.testing.assert_allclose(color_space.rgb_to_xyz(RGB.astype(np.float64)), REFERENCE_XYZ, rtol=0, atol=1e-12)
+
+
+def test_xyz_to_lab_matches_reference():
+    np.testing.assert_allclose(color_space.xyz_to_lab(REFERENCE_XYZ), REFERENCE_LAB, rtol=0, atol=1e-12)
+
+
+def test_rgb_to_lab_float64_matches_reference():
+    lab = color_space.rgb_to_lab(RGB)
+    assert lab.dtype == np.float64
+    np.testing.assert_allclose(lab, REFERENCE_LAB, rtol=0, atol=1e-12)
+
+
+def test_rgb_to_lab_float32_matches_reference():
+    lab = color_space.rgb_to_lab(RGB, np.float32)
+    assert lab.dtype == np.float32
+    np.testing.assert_allclose(lab, REFERENCE_LAB, rtol=0, atol=1e-5)
+
+
+def test_utils_wrappers_match_reference():
+    r, g, b = RGB.T.astype(np.int64)
+    xyz = Utils.transform_rgb_to_xyz(r, g, b)
+    np.testing.assert_allclose(np.column_stack(xyz), REFERENCE_XYZ, rtol=0, atol=1e-12)
+    lab = Utils.transform_xyz_to_cie_l_ab(*xyz)
+    np.testing.assert_allclose(np.column_stack(lab), REFERENCE_LAB, rtol=0, atol=1e-12)
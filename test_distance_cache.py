@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from dynamic_ring import DynamicRing
+from ring import Ring
+from trajectory import topology_arrays
+
+
+def neighbor_matrix(topology):
+    return np.asarray(topology_arrays(topology.store, topology.nodes, topology.k)[2])
+
+
+# 10 ** 8 bytes hold the whole matrix, 10 ** 4 only a few tiles
+@pytest.mark.parametrize("budget", [10 ** 8, 10 ** 4])
+@pytest.mark.parametrize("engine", ["python", "batched"])
+def test_cached_ring_matches_uncached(engine, budget):
+    uncached = Ring(300, 6, 12, engine=engine, use_store=True, seed=1, output=False)
+    cached = Ring(300, 6, 12, engine=engine, seed=1, output=False, distance_cache=budget)
+    assert cached.store.distance_cache.mode == ("full" if budget == 10 ** 8 else "tiled")
+    assert (neighbor_matrix(cached) == neighbor_matrix(uncached)).all()
+
+
+@pytest.mark.parametrize("engine", ["python", "batched"])
+def test_cached_dynamic_ring_matches_uncached(engine):
+    uncached = DynamicRing(100, 5, 2, [40, 60], engine=engine, use_store=True, seed=2, output=False)
+    cached = DynamicRing(100, 5, 2, [40, 60], engine=engine, seed=2, output=False, distance_cache=10 ** 4)
+    assert (neighbor_matrix(cached) == neighbor_matrix(uncached)).all()
@@ -0,0 +1,58 @@
+import numpy as np
+
+from gossip_engine import BatchedGossipEngine
+from node import Node
+from node_store import NodeStore
+
+
+def make_store(lab, neighbors):
+    store = NodeStore(neighbors.shape[1])
+    num_nodes = len(lab)
+    store.add_nodes(np.zeros((num_nodes, 2)), np.zeros((num_nodes, 3), dtype=np.uint8), lab, ["red"] * num_nodes)
+    store.neighbors[:] = neighbors
+    return store
+
+
+def random_neighbors(rng, num_nodes, k):
+    return np.array([rng.choice(np.delete(np.arange(num_nodes), i), k, replace=False) for i in range(num_nodes)],
+                    dtype=np.int32)
+
+
+def test_merges_match_update_neighbors_with_ties():
+    rng = np.random.default_rng(0)
+    num_nodes, k = 300, 6
+    # few distinct integer coordinates, so many candidates tie, also at the k-th distance
+    lab = rng.integers(0, 4, (num_nodes, 3)).astype(np.float64)
+    neighbors = random_neighbors(rng, num_nodes, k)
+    engine = BatchedGossipEngine(make_store(lab, neighbors), rng=np.random.default_rng(1))
+
+    nodes = []
+    for i in range(num_nodes):
+        node = Node(i, 0, 0)
+        node.l_distance, node.a_distance, node.b_distance = lab[i].tolist()
+        nodes.append(node)
+    for node, row in zip(nodes, neighbors.tolist()):
+        node.neighbors = [nodes[j] for j in row]
+
+    targets = rng.permutation(num_nodes)[:150]
+    sources = np.array([rng.choice(np.delete(np.arange(num_nodes), t)) for t in targets])
+    rows, ids, _ = engine.combine(neighbors, targets, sources)
+    # every offer reads the views as they were before the merges, like combine
+    offers = {target: nodes[source].neighbors + [nodes[source]] for target, source in zip(targets, sources)}
+    for target, row in zip(rows.tolist(), ids.tolist()):
+        nodes[target].update_neighbors(offers[target], k)
+        assert row == [node.id for node in nodes[target].neighbors]
+
+
+def test_initiator_without_neighbors_has_no_exchange():
+    rng = np.random.default_rng(2)
+    num_nodes, k = 50, 4
+    lab = rng.normal(0, 50, (num_nodes, 3))
+    neighbors = random_neighbors(rng, num_nodes, k)
+    neighbors[neighbors == 0] = num_nodes - 1
+    neighbors[0] = -1
+    for synchronous in (True, False):
+        engine = BatchedGossipEngine(make_store(lab, neighbors), synchronous=synchronous,
+                                     rng=np.random.default_rng(3))
+        engine.run_cycle([0])
+        assert (engine.store.neighbors == neighbors).all()
@@ -0,0 +1,48 @@
+import sys
+
+from instrumentation import Instrumentation
+from node import DISTANCE_MEMO_SIZE, Node
+from ring import Ring
+
+
+class Totals:
+    def __init__(self):
+        self.totals = None
+
+    def emit(self, report, totals):
+        self.totals = totals
+
+    def close(self):
+        pass
+
+
+def test_memo_misses_count_evictions():
+    node = Node(0, 0, 0)
+    candidates = [Node(i, 0, 0) for i in range(1, 2 * DISTANCE_MEMO_SIZE + 1)]
+    node.select_k_nearest_neighbors(candidates[:DISTANCE_MEMO_SIZE], 4)
+    sink = Totals()
+    with Instrumentation(sink):
+        # the new candidates come first and evict the remembered ones before they are reached
+        node.select_k_nearest_neighbors(candidates[DISTANCE_MEMO_SIZE:] + candidates[:DISTANCE_MEMO_SIZE], 4)
+    assert sink.totals["counters"]["distance_evaluations"] == 2 * DISTANCE_MEMO_SIZE
+
+
+def test_sharded_engine_counts_like_batched():
+    counters = {}
+    for engine in ("batched", "sharded"):
+        sink = Totals()
+        with Instrumentation(sink):
+            ring = Ring(200, 5, 3, engine=engine, workers=2, seed=0, output=False)
+            ring.engine.close()
+        counters[engine] = {name: value for name, value in sink.totals["counters"].items()
+                            if name != "changed_entries"}
+        assert sink.totals["calls"]["engine_cycle"] == 3
+    assert counters["sharded"] == counters["batched"]
+    assert counters["sharded"]["heap_selections"] > 0
+
+
+def test_renderer_is_not_imported_without_plots():
+    sys.modules.pop("renderer", None)
+    with Instrumentation(Totals()):
+        Ring(60, 4, 2, engine="batched", seed=0, output=False)
+    assert "renderer" not in sys.modules
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+
+from dynamic_ring import DynamicRing
+from metrics import ConvergenceMonitor
+from sweep import make_case, run_case
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_monitor_on_unlabeled_dynamic_ring():
+    monitor = ConvergenceMonitor()
+    topology = DynamicRing(60, 4, 3, [50, 60, 70], engine="batched", seed=0, output=False, monitor=monitor)
+    assert monitor.history
+    assert all(metrics["same_color"] == {} for metrics in monitor.history)
+    assert all(list(metrics["components"]) == ["all"] for metrics in monitor.history)
+    assert topology.epochs_run <= topology.epochs
+
+
+def test_tman_early_stop_on_dynamic_ring(tmp_path):
+    result = subprocess.run([sys.executable, os.path.join(HERE, "TMAN.py"), "100", "4", "D", "50", "60", "70",
+                             "--early-stop", "--no-plot", "--output-dir", str(tmp_path)],
+                            cwd=HERE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert result.returncode == 0, result.stderr
+
+
+def test_sweep_early_stop_on_dynamic_ring():
+    row = run_case(make_case("D", 60, 4, 0, "two_way", "batched", 15, [50, 60, 70], early_stop=True))
+    assert row["epochs_run"] <= 15
@@ -0,0 +1,26 @@
+import numpy as np
+
+from ring import Ring
+from scheduler import compare
+
+
+def make_ring(scheduler):
+    return Ring(300, 6, 30, engine="batched", seed=0, output=False, scheduler=scheduler)
+
+
+def test_active_set_matches_full_scheduling():
+    full, active, scheduler, match = compare(make_ring)
+    assert match
+    assert scheduler.stats["skipped"] > 0
+
+
+def test_corrupted_view_is_flagged():
+    def corrupted(scheduler):
+        topology = make_ring(scheduler)
+        if scheduler is not None:
+            # a single node of the active-set run ends up with arbitrary neighbors
+            topology.store.neighbors[0] = np.arange(150, 156)
+        return topology
+
+    _, _, _, match = compare(corrupted)
+    assert not match
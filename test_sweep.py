@@ -0,0 +1,15 @@
+import pytest
+
+from sweep import make_case, run_case
+
+
+def test_dynamic_ring_has_no_same_color_fraction():
+    row = run_case(make_case("D", 60, 4, 0, "two_way", "batched", 10, [50, 60]))
+    assert row["same_color_fraction"] == ""
+    row = run_case(make_case("R", 60, 4, 0, "two_way", "batched", 10, []))
+    assert 0 < row["same_color_fraction"] <= 1
+
+
+def test_one_way_dynamic_ring_is_rejected():
+    with pytest.raises(ValueError):
+        run_case(make_case("D", 60, 4, 0, "one_way", "batched", 10, [50, 60]))
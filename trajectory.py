@@ -0,0 +1,274 @@
+import argparse
+import os
+import struct
+
+import numpy as np
+
+from node_store import COLOR_LABELS, NodeStore
+from utils import Utils
+
+MAGIC = b"TMANTRAJ"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIq")
+RECORD = struct.Struct("<IiII")
+ALIGNMENT = 8
+
+FULL = 1
+DELTA = 2
+NODES = 3
+
+
+def padding(size):
+    return -size % ALIGNMENT
+
+
+def topology_arrays(store=None, nodes=None, k=None):
+    """
+    :param store: a NodeStore, or None to read node objects
+    :param nodes: list of nodes with ids 0..len(nodes) - 1, used when there is no store
+    :param k: number of neighbors, used when there is no store
+    :return: color codes, Lab array and (N, k) int32 neighbor matrix of the topology, -1 marks an empty slot
+    """
+    if store is not None:
+        return store.color_code, store.lab, store.neighbors
+    ordered = sorted(nodes, key=lambda node: node.id)
+    neighbors = np.full((len(ordered), k), -1, dtype=np.int32)
+    for node in ordered:
+        ids = [neighbor.id for neighbor in node.neighbors]
+        neighbors[node.id, :len(ids)] = ids
+    color_code = NodeStore.encode_colors(node.color for node in ordered)
+    lab = np.array([(node.l_distance, node.a_distance, node.b_distance) for node in ordered], dtype=np.float64)
+    return color_code, lab.reshape(-1, 3), neighbors
+
+
+class TrajectoryWriter:
+    """
+    Appends the neighbor matrices of a run to one binary file.
+
+    Layout, little endian, every block padded to 8 bytes:
+    header (magic, version, N, k, seed or -1), int8 color codes of the N nodes, float64 (N, 3) Lab array, then a
+    sequence of records. A record is (kind, epoch, number of nodes, count) followed by its data:
+    FULL: the (number of nodes, k) int32 neighbor matrix,
+    DELTA: count int32 row ids and the (count, k) int32 rows that changed since the previous record,
+    NODES: int8 color codes and float64 (count, 3) Lab array of count joining nodes.
+    A FULL record is written every keyframe_interval records, when the number of nodes changes, and whenever a DELTA
+    record would not be smaller, so reading any epoch replays a bounded number of deltas.
+    """
+
+    def __init__(self, file_name, color_code, lab, k, seed=None, delta=True, keyframe_interval=10):
+        """
+        Initializer
+        :param file_name: the trajectory file, overwritten
+        :param color_code: (N,) color codes of the initial nodes
+        :param lab: (N, 3) Lab array of the initial nodes
+        :param k: number of neighbors
+        :param seed: seed of the run, stored for reference
+        :param delta: if false every record is a FULL record
+        :param keyframe_interval: maximal number of records between two FULL records
+        """
+        self.k = k
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval
+        self.num_nodes = len(color_code)
+        self.previous = None
+        self.since_keyframe = 0
+        self.records = 0
+        self.file = open(file_name, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.num_nodes, k, -1 if seed is None else seed))
+        self.write_block(HEADER.size, np.asarray(color_code, dtype=np.int8))
+        self.write_block(0, np.asarray(lab, dtype="<f8"))
+
+    def write_block(self, written, *arrays):
+        """
+        Bulk write arrays back to back, then pad to the alignment
+        :param written: bytes already written since the last aligned offset
+        :param arrays: arrays to write
+        :return: None
+        """
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            if array.size:
+                self.file.write(memoryview(array).cast("B"))
+            written += array.nbytes
+        self.file.write(b"\0" * padding(written))
+
+    def add_nodes(self, color_code, lab):
+        """
+        Record joining nodes, they get the next ids
+        :param color_code: color codes of the joining nodes
+        :param lab: (M, 3) Lab array of the joining nodes
+        :return: None
+        """
+        color_code = np.asarray(color_code, dtype=np.int8)
+        self.file.write(RECORD.pack(NODES, -1, self.num_nodes, len(color_code)))
+        self.write_block(RECORD.size, color_code)
+        self.write_block(0, np.asarray(lab, dtype="<f8"))
+        self.num_nodes += len(color_code)
+
+    def append(self, epoch, neighbors):
+        """
+        Record the neighbor matrix of an epoch
+        :param epoch: the epoch
+        :param neighbors: (num_nodes, k) neighbor matrix
+        :return: None
+        """
+        neighbors = np.asarray(neighbors, dtype="<i4")
+        num_nodes = len(neighbors)
+        changed = None
+        if (self.delta and self.previous is not None and len(self.previous) == num_nodes
+                and self.since_keyframe < self.keyframe_interval):
+            changed = np.flatnonzero((neighbors != self.previous).any(axis=1)).astype("<i4")
+            if len(changed) * (self.k + 1) >= num_nodes * self.k:
+                changed = None
+
+        if changed is None:
+            self.file.write(RECORD.pack(FULL, epoch, num_nodes, num_nodes))
+            self.write_block(RECORD.size, neighbors)
+            self.since_keyframe = 0
+        else:
+            self.file.write(RECORD.pack(DELTA, epoch, num_nodes, len(changed)))
+            self.write_block(RECORD.size, changed, neighbors[changed])
+            self.since_keyframe += 1
+        self.previous = neighbors.copy()
+        self.records += 1
+
+    def record(self, epoch, color_code, lab, neighbors):
+        """
+        Record an epoch of a topology that may have grown since the last record
+        :param epoch: the epoch
+        :param color_code: color codes of all nodes
+        :param lab: Lab array of all nodes
+        :param neighbors: neighbor matrix of all nodes
+        :return: None
+        """
+        if len(neighbors) > self.num_nodes:
+            self.add_nodes(color_code[self.num_nodes:], lab[self.num_nodes:])
+        self.append(epoch, neighbors)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Trajectory:
+    """
+    Read access to a trajectory file through numpy.memmap. Opening scans the record headers once, after that the
+    neighbor matrix of any epoch is read without parsing the records before it.
+    """
+
+    def __init__(self, file_name):
+        """
+        Initializer
+        :param file_name: a file written by TrajectoryWriter
+        """
+        self.data = np.memmap(file_name, dtype=np.uint8, mode="r")
+        magic, version, num_nodes, self.k, seed = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} trajectory file".format(file_name, VERSION))
+        self.seed = None if seed < 0 else seed
+
+        offset = HEADER.size
+        color_code, offset = self.array(offset, np.int8, num_nodes)
+        offset += padding(offset)
+        lab, offset = self.array(offset, "<f8", num_nodes * 3)
+        offset += padding(offset)
+        color_codes, labs = [color_code], [lab.reshape(-1, 3)]
+
+        self.epochs = []
+        self.records = []
+        while offset < len(self.data):
+            kind, epoch, count_nodes, count = RECORD.unpack_from(self.data, offset)
+            offset += RECORD.size
+            if kind == NODES:
+                codes, offset = self.array(offset, np.int8, count)
+                offset += padding(offset)
+                lab, offset = self.array(offset, "<f8", count * 3)
+                color_codes.append(codes)
+                labs.append(lab.reshape(-1, 3))
+            elif kind == FULL:
+                matrix, offset = self.array(offset, "<i4", count * self.k)
+                self.records.append((kind, epoch, None, matrix.reshape(count, self.k)))
+                self.epochs.append(epoch)
+            elif kind == DELTA:
+                rows, offset = self.array(offset, "<i4", count)
+                values, offset = self.array(offset, "<i4", count * self.k)
+                self.records.append((kind, epoch, rows, values.reshape(count, self.k)))
+                self.epochs.append(epoch)
+            else:
+                raise ValueError("unknown record kind {} at offset {}".format(kind, offset - RECORD.size))
+            offset += padding(offset)
+
+        self.color_code = np.concatenate(color_codes)
+        self.lab = np.concatenate(labs)
+        self.index = {epoch: i for i, epoch in enumerate(self.epochs)}
+
+    def array(self, offset, dtype, count):
+        """
+        :return: a view of count items of dtype at offset into the mapped file, and the offset behind it
+        """
+        end = offset + count * np.dtype(dtype).itemsize
+        return self.data[offset:end].view(dtype), end
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def neighbors(self, epoch):
+        """
+        :param epoch: a recorded epoch
+        :return: the (N, k) neighbor matrix of the epoch, a read-only view into the file for FULL records
+        """
+        position = self.index[epoch]
+        start = position
+        while self.records[start][0] != FULL:
+            start -= 1
+        matrix = self.records[start][3]
+        if start == position:
+            return matrix
+        matrix = np.array(matrix)
+        for _, _, rows, values in self.records[start + 1:position + 1]:
+            matrix[rows] = values
+        return matrix
+
+    def colors(self, epoch):
+        """
+        :param epoch: a recorded epoch
+        :return: color codes of the nodes present at the epoch
+        """
+        return self.color_code[:len(self.neighbors(epoch))]
+
+    def export_text(self, directory, prefix):
+        """
+        Write the text files of the original output: a <prefix>.txt color file of all nodes and a
+        <prefix>_<epoch>.txt topology file for every recorded epoch
+        :param directory: target directory
+        :param prefix: file name prefix, e.g. R_N100_k9
+        :return: None
+        """
+        with open(os.path.join(directory, prefix + ".txt"), 'w+') as f:
+            f.writelines("{} {}\n".format(i, COLOR_LABELS[code]) for i, code in enumerate(self.color_code.tolist()))
+        for epoch in self.epochs:
+            Utils.write_neighbor_matrix_to_file(self.neighbors(epoch),
+                                                os.path.join(directory, "{}_{}.txt".format(prefix, epoch)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a binary trajectory to the text files of the original output")
+    parser.add_argument("trajectory", help="trajectory file")
+    parser.add_argument("directory", help="target directory")
+    parser.add_argument("--prefix", help="file name prefix, the trajectory file name by default")
+    args = parser.parse_args()
+
+    trajectory = Trajectory(args.trajectory)
+    prefix = args.prefix or os.path.splitext(os.path.basename(args.trajectory))[0]
+    os.makedirs(args.directory, exist_ok=True)
+    trajectory.export_text(args.directory, prefix)
+    print("{} epochs of {} nodes exported to {}".format(len(trajectory), len(trajectory.color_code), args.directory))
+
+
+if __name__ == "__main__":
+    main()
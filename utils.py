@@ -3,6 +3,15 @@ import numpy as np
 import math
 import os
 
+import color_space
+
+COLOR_RANGES = {
+    "": ((0, 255), (0, 255), (0, 255)),
+    "red": ((200, 255), (0, 80), (0, 80)),
+    "green": ((0, 80), (200, 255), (0, 80)),
+    "blue": ((0, 80), (0, 80), (200, 255)),
+}
+
 
 class Utils:
     """A utility class for methods frequently used in building a topology"""
@@ -48,6 +57,18 @@ class Utils:
         r, g, b, color = random.randrange(0, 80), random.randrange(0, 80), random.randrange(200, 255), "blue"
         return r, g, b, color
 
+    @staticmethod
+    def sample_colors(rng, colors):
+        """
+        Vectorized version of get_random_color, get_red_color, get_green_color and get_blue_color
+        :param rng: a numpy random Generator
+        :param colors: array of color labels, "" for a random color
+        :return: (N, 3) uint8 array of redness, greenness, blueness
+        """
+        labels, codes = np.unique(np.asarray(colors), return_inverse=True)
+        ranges = np.array([COLOR_RANGES[color] for color in labels.tolist()])[codes.ravel()]
+        return rng.integers(ranges[:, :, 0], ranges[:, :, 1], dtype=np.uint8)
+
     @staticmethod
     def transform_rgb_to_xyz(r, g, b):
         """
@@ -57,26 +78,7 @@ class Utils:
         :param b: Blue vector containing blueness values on a scale of 0 to 255
         :return: X Y Z values
         """
-        sR = np.array(r)
-        sG = np.array(g)
-        sB = np.array(b)
-
-        var_R = (sR / 255.0)
-        var_G = (sG / 255.0)
-        var_B = (sB / 255.0)
-
-        var_R = [((vR + 0.055) / 1.055) ** 2.4 if vR > 0.04045 else vR / 12.92 for vR in var_R]
-        var_G = [((vG + 0.055) / 1.055) ** 2.4 if vG > 0.04045 else vG / 12.92 for vG in var_G]
-        var_B = [((vB + 0.055) / 1.055) ** 2.4 if vB > 0.04045 else vB / 12.92 for vB in var_B]
-
-        var_R = [vR * 100 for vR in var_R]
-        var_G = [vG * 100 for vG in var_G]
-        var_B = [vB * 100 for vB in var_B]
-
-        X = np.array(var_R) * 0.4124 + np.array(var_G) * 0.3576 + np.array(var_B) * 0.1805
-        Y = np.array(var_R) * 0.2126 + np.array(var_G) * 0.7152 + np.array(var_B) * 0.0722
-        Z = np.array(var_R) * 0.0193 + np.array(var_G) * 0.1192 + np.array(var_B) * 0.9505
-
+        X, Y, Z = color_space.rgb_to_xyz(np.column_stack((r, g, b))).T
         return X, Y, Z
 
     @staticmethod
@@ -88,22 +90,7 @@ class Utils:
         :param z: Z vector
         :return: cie-l, cie-a, cie-b
         """
-        reference_x = 94.811
-        reference_y = 100.00
-        reference_z = 107.304
-
-        var_X = x / reference_x
-        var_Y = y / reference_y
-        var_Z = z / reference_z
-
-        var_X = np.array([vx ** (1 / 3) if vx > 0.008856 else (7.87 * vx) + (16 / 116) for vx in var_X])
-        var_Y = np.array([vy ** (1 / 3) if vy > 0.008856 else (7.87 * vy) + (16 / 116) for vy in var_Y])
-        var_Z = np.array([vz ** (1 / 3) if vz > 0.008856 else (7.87 * vz) + (16 / 116) for vz in var_Z])
-
-        cie_l = (116 * var_Y) - 16
-        cie_a = 500 * (var_X - var_Y)
-        cie_b = 200 * (var_Y - var_Z)
-
+        cie_l, cie_a, cie_b = color_space.xyz_to_lab(np.column_stack((x, y, z))).T
         return cie_l, cie_a, cie_b
 
     @staticmethod
@@ -131,26 +118,32 @@ class Utils:
         return '#%02x%02x%02x' % (red, green, blue)
 
     @staticmethod
-    def select_k_neighbors(node, all_nodes, k):
+    def select_k_neighbors_batch(rng, num_nodes, k):
         """
-        min heap based finding k nearest neighbors based on the distance criteria as provided in the assignment
-        :param node: the node whose nearest neighbors is to be calculated
-        :param all_nodes: set of all nodes
+        Draw k distinct random neighbors for every node at once, a node never draws itself
+        :param rng: a numpy random Generator
+        :param num_nodes: number of nodes, ids are 0..num_nodes - 1
         :param k: the number of neighbors to choose
-        :return: k nearest neighboring nodes
-        """
-        nodes = set(all_nodes)
-        nodes.remove(node)
-        k_nearest_neighbors = []
-
-        n = k
-        while n:
-            neighbor = random.choice(tuple(nodes))
-            k_nearest_neighbors.append(neighbor)
-            nodes.remove(neighbor)
-            n -= 1
-
-        return k_nearest_neighbors
+        :return: (num_nodes, k) int32 array of neighbor ids
+        """
+        if k > num_nodes - 1:
+            raise ValueError("cannot choose {} neighbors out of {} nodes".format(k, num_nodes))
+        ids = np.arange(num_nodes)[:, None]
+        neighbors = rng.integers(0, num_nodes - 1, size=(num_nodes, k))
+        neighbors += neighbors >= ids
+
+        # redraw only the duplicate entries of the few rows that have any
+        while True:
+            neighbors.sort(axis=1)
+            duplicate = np.zeros(neighbors.shape, dtype=bool)
+            duplicate[:, 1:] = neighbors[:, 1:] == neighbors[:, :-1]
+            rows, cols = duplicate.nonzero()
+            if not len(rows):
+                break
+            redraw = rng.integers(0, num_nodes - 1, size=len(rows))
+            neighbors[rows, cols] = redraw + (redraw >= rows)
+
+        return rng.permuted(neighbors, axis=1).astype(np.int32)
 
     @staticmethod
     def write_network_color_to_file(nodes, file_name):
@@ -171,3 +164,79 @@ class Utils:
             for i in range(len(nodes)):
                 neighbor_ids = [str(node.id) for node in nodes[i].neighbors]
                 f.write(str(nodes[i].id) + " : " + ",".join(neighbor_ids) + "\n")
+
+    @staticmethod
+    def write_store_color_to_file(store, file_name):
+        """
+        A writer method that writes the node colors of a NodeStore to a file, same format as write_network_color_to_file
+        :param store: a NodeStore
+        :param file_name: a file to capture the colored network snapshot
+        :return:
+        """
+        with open(file_name, 'w+') as f:
+            f.writelines("{} {}\n".format(i, store.color_of(i)) for i in range(len(store)))
+
+    @staticmethod
+    def write_store_topology_to_file(store, file_name):
+        """
+        A writer method that writes the neighbor matrix of a NodeStore to a file, same format as
+        write_network_topology_to_file
+        :param store: a NodeStore
+        :param file_name: a file to capture the network snapshot
+        :return:
+        """
+        Utils.write_neighbor_matrix_to_file(store.neighbors, file_name)
+
+    @staticmethod
+    def write_neighbor_matrix_to_file(neighbors, file_name):
+        """
+        A writer method that writes a neighbor matrix to a file, same format as write_network_topology_to_file
+        :param neighbors: (N, k) neighbor id matrix, -1 marks an empty slot
+        :param file_name: a file to capture the network snapshot
+        :return:
+        """
+        with open(file_name, 'w+') as f:
+            for i, row in enumerate(neighbors.tolist()):
+                f.write(str(i) + " : " + ",".join(str(j) for j in row if j >= 0) + "\n")
+
+    @staticmethod
+    def connected_components(num_nodes, sources, targets):
+        """
+        Label the connected components of an undirected graph given as edge arrays
+        :param num_nodes: number of nodes, ids are 0..num_nodes - 1
+        :param sources: first endpoint of every edge
+        :param targets: second endpoint of every edge
+        :return: array with the smallest node id of its component for every node
+        """
+        parent = np.arange(num_nodes)
+        while True:
+            root_u, root_v = parent[sources], parent[targets]
+            if np.array_equal(root_u, root_v):
+                return parent
+            np.minimum.at(parent, np.maximum(root_u, root_v), np.minimum(root_u, root_v))
+            while True:
+                grand_parent = parent[parent]
+                if np.array_equal(grand_parent, parent):
+                    break
+                parent = grand_parent
+
+    @staticmethod
+    def count_color_components(neighbors, color_code, code=None):
+        """
+        Count the connected components of the graph plot_network draws for a color: nodes of that color, their
+        neighbors and the edges leaving nodes of that color
+        :param neighbors: (N, k) neighbor id matrix, -1 marks an empty slot
+        :param color_code: (N,) color codes
+        :param code: color code of interest, None for all nodes
+        :return: number of connected components
+        """
+        sources = np.arange(len(neighbors)) if code is None else np.flatnonzero(color_code == code)
+        rows = neighbors[sources]
+        present = rows >= 0
+        targets = rows[present]
+        sources = np.repeat(sources, present.sum(axis=1))
+        members = np.union1d(sources, targets)
+        if not len(members):
+            return 0
+        labels = Utils.connected_components(len(neighbors), sources, targets)
+        return len(np.unique(labels[members]))